@@ -0,0 +1,142 @@
+# Enrichment_Benchmark: startup time of the form, measured in new processes like a user launching it, and recorded in a
+# JSON lines file so a change can be compared with the previous records. Without a display, the imports done before
+# the window is shown are timed against the import of the analysis modules
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from GUI_Form_Enrichment import STARTUP_BENCHMARK_VARIABLE
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+HEADLESS_STEPS = {"window": "import GUI_Form_Enrichment", "analysis": "import GUI_Form_Enrichment, Whole_Enrichment"}
+
+
+def time_form(timeout=120):
+    """
+    time_form : launches the form, which prints when its window is shown and when the analysis is imported, then closes
+        inputs:
+            timeout : seconds before the form is stopped (default = 120)
+        output:
+            d_seconds : dictionary with the seconds from the launch to "window" and to "analysis"
+    """
+    environment = dict(os.environ, **{STARTUP_BENCHMARK_VARIABLE: "1"})
+    d_seconds = {}
+
+    def read_steps(stdout):
+        for line in stdout:
+            step = line.split()[0] if line.strip() else None
+            if step in ["window", "analysis"]:
+                d_seconds[step] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with subprocess.Popen([sys.executable, os.path.join(FOLDER, "GUI_Form_Enrichment.py")], cwd=FOLDER,
+                          env=environment, stdout=subprocess.PIPE, text=True) as process:
+        # the steps are timed as they are printed, on a thread, so a form that never closes is stopped at the timeout
+        reader = threading.Thread(target=read_steps, args=(process.stdout,), daemon=True)
+        reader.start()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise RuntimeError("The form did not close within " + str(timeout) + " s") from None
+        reader.join()
+
+    if process.returncode != 0 or len(d_seconds) != 2:
+        raise RuntimeError("The form did not report its startup, exit code " + str(process.returncode))
+    return d_seconds
+
+
+def time_headless():
+    """
+    time_headless : seconds of a new interpreter importing the form, and importing the form and the analysis
+        output:
+            d_seconds : dictionary with the seconds to "window" and to "analysis"
+    """
+    d_seconds = {}
+    for step, statement in HEADLESS_STEPS.items():
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=FOLDER, check=True)
+        d_seconds[step] = time.perf_counter() - start
+
+    return d_seconds
+
+
+def startup_benchmark(repeats=5, headless=False):
+    """
+    startup_benchmark : median startup times over new processes, the first one is left out so files are cached
+        inputs:
+            repeats : number of launches timed (default = 5)
+            headless : boolean to time imports instead of launching the form
+        output:
+            record : dictionary with the medians and the environment of the benchmark
+    """
+    measure = time_headless if headless else time_form
+    measure()
+    list_seconds = [measure() for _ in range(repeats)]
+
+    return {"benchmark": "startup", "mode": "headless" if headless else "form", "time": time.time(),
+            "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "repeats": repeats,
+            "window_seconds": statistics.median(seconds["window"] for seconds in list_seconds),
+            "analysis_seconds": statistics.median(seconds["analysis"] for seconds in list_seconds)}
+
+
+def git_commit():
+    """
+    git_commit : commit of the repository the benchmark runs in, None outside of a git repository
+        output:
+            commit : abbreviated commit hash
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=FOLDER, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_record(record_file, record):
+    """
+    previous_record : last record of the same benchmark and mode in a JSON lines file
+        inputs:
+            record_file : path of the JSON lines file
+            record : new record
+        output:
+            previous : dictionary, None if there is none
+    """
+    previous = None
+    if os.path.isfile(record_file):
+        with open(record_file) as file:
+            for line in file:
+                if line.strip():
+                    old_record = json.loads(line)
+                    if (old_record["benchmark"], old_record["mode"]) == (record["benchmark"], record["mode"]):
+                        previous = old_record
+
+    return previous
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how long the form takes to start")
+    parser.add_argument("--repeats", type=int, default=5, help="number of launches timed")
+    parser.add_argument("--headless", action="store_true", help="time imports, for machines without a display")
+    parser.add_argument("--record", help="JSON lines file where the result is added and compared with the last one")
+    args = parser.parse_args()
+
+    new_record = startup_benchmark(args.repeats, args.headless)
+    print("Window shown after %.3f s, analysis imported after %.3f s (%s)" % (
+        new_record["window_seconds"], new_record["analysis_seconds"], new_record["mode"]))
+
+    if args.record is not None:
+        last_record = previous_record(args.record, new_record)
+        if last_record is not None:
+            print("Previous record (%s): window %.3f s, analysis %.3f s" % (
+                last_record["commit"], last_record["window_seconds"], last_record["analysis_seconds"]))
+        with open(args.record, "a") as record_handle:
+            record_handle.write(json.dumps(new_record) + "\n")
@@ -0,0 +1,133 @@
+# Enrichment_Bootstrap: bootstrap confidence intervals of net enrichment factors over the mice of a cell type. Every
+# resample of mice is a row of weights, the averaged rankings of a batch of resamples are one matrix product with the
+# normalized counts, then ranked and counted together, and batches of resamples run over a pool of processes
+from concurrent.futures import ProcessPoolExecutor
+import warnings
+
+import numpy as np
+
+from Enrichment_Permutation import one_hot_components
+from Enrichment_Sensitivity import ranked_net_enrichment
+
+BOOTSTRAP_COLUMNS = ["CI low", "CI high"]
+CHUNK_REPLICATES = 100  # replicates per task, each task has its own seed so results do not depend on the workers
+MAX_BATCH_CELLS = 2 ** 22  # largest matrix of resampled averages (LNPs x replicates) built at once
+
+
+def resampled_averages(block, weights):
+    """
+    resampled_averages : averages of the normalized counts of resampled mice, missing counts are skipped like mean
+        inputs:
+            block : matrix of normalized counts, one column per mouse
+            weights : matrix with how many times each mouse is drawn, one row per replicate
+        output:
+            values : matrix of averages, one column per replicate, NaN where no drawn mouse has a count
+    """
+    present = ~np.isnan(block)
+    sums = np.where(present, block, 0) @ weights.T
+    drawn = present.astype(float) @ weights.T
+    return sums / np.where(drawn == 0, np.nan, drawn)
+
+
+def bootstrap_chunk(one_hot, boundaries, block, x_percent, number_naked_bcs, n_replicates, seed_sequence):
+    """
+    bootstrap_chunk : net enrichment factors of the averaged rankings of resampled mice
+        inputs:
+            one_hot : one-hot matrix of the components
+            boundaries : array with the first column of each component
+            block : matrix of normalized counts, one column per mouse
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            n_replicates : number of resamples of mice
+            seed_sequence : numpy SeedSequence of the chunk
+        output:
+            replicates : matrix of net enrichment factors, one row per resample
+    """
+    rng = np.random.default_rng(seed_sequence)
+    n_mice = block.shape[1]
+    batch = max(1, MAX_BATCH_CELLS // max(len(block), 1))
+
+    list_replicates = []
+    for start in range(0, n_replicates, batch):
+        size = min(batch, n_replicates - start)
+        weights = rng.multinomial(n_mice, np.full(n_mice, 1 / n_mice), size=size).astype(float)
+        net, _, _ = ranked_net_enrichment(one_hot, boundaries, resampled_averages(block, weights), x_percent,
+                                          number_naked_bcs)
+        list_replicates.append(net)
+
+    return np.concatenate(list_replicates)
+
+
+class BootstrapTest:
+    """
+    BootstrapTest : percentile confidence intervals of the net enrichment factors of the average of a cell type, from
+    resamples of its mice with replacement
+        inputs:
+            n_replicates : number of resamples of mice
+            seed : seed of the resamples, the same seed gives the same intervals
+            workers : number of processes computing resamples, all cores if not given
+            confidence : confidence level of the intervals in percent (default = 95)
+    """
+
+    def __init__(self, n_replicates, seed=0, workers=None, confidence=95):
+        self.n_replicates = n_replicates
+        self.seed = seed
+        self.workers = workers
+        self.confidence = confidence
+
+    def replicates(self, one_hot, boundaries, block, x_percent, number_naked_bcs):
+        """
+        replicates : net enrichment factors of every resample, computed in chunks over a pool of processes
+            inputs:
+                one_hot : one-hot matrix of the components
+                boundaries : array with the first column of each component
+                block : matrix of normalized counts, one column per mouse
+                x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+                number_naked_bcs : user specified number of naked barcodes
+            output:
+                replicates : matrix of net enrichment factors, one row per resample
+        """
+        chunks = range(0, self.n_replicates, CHUNK_REPLICATES)
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(len(chunks))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(bootstrap_chunk, one_hot, boundaries, block, x_percent, number_naked_bcs,
+                                       min(CHUNK_REPLICATES, self.n_replicates - start), seed_sequence)
+                       for start, seed_sequence in zip(chunks, seed_sequences)]
+            return np.concatenate([future.result() for future in futures])
+
+    def intervals(self, df_formulations, dict_components, df_samples, x_percent, number_naked_bcs):
+        """
+        intervals : confidence intervals of the net enrichment factors of the ranking by the average of the mice
+            inputs:
+                df_formulations : dataframe with formulations sheet, aligned with df_samples
+                dict_components : a dictionary containing list of all the component mole ratios and types
+                df_samples : dataframe with the normalized counts of each mouse of the cell type
+                x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+                number_naked_bcs : user specified number of naked barcodes
+            output:
+                d_intervals : dictionary with an array of (low, high) rows by component, one per level
+        """
+        one_hot, boundaries = one_hot_components(df_formulations, dict_components)
+        replicates = self.replicates(one_hot, boundaries, df_samples.to_numpy(dtype=float), x_percent,
+                                     number_naked_bcs)
+
+        tail = (100 - self.confidence) / 2
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # levels absent from all LNPs have no factors
+            bounds = np.nanpercentile(replicates, [tail, 100 - tail], axis=0).T
+
+        return dict(zip(dict_components, np.split(bounds, boundaries[1:])))
+
+
+def add_confidence_columns(d_df_net_enrichment, d_intervals):
+    """
+    add_confidence_columns : adds confidence intervals to tables of net enrichment factors, the TOTAL rows are left
+                             empty
+        inputs:
+            d_df_net_enrichment : dictionary with tables of net enrichment factors by component
+            d_intervals : dictionary with an array of (low, high) rows by component, one per level
+    """
+    for component, df in d_df_net_enrichment.items():
+        bounds = d_intervals[component]
+        for column, values in zip(BOOTSTRAP_COLUMNS, bounds.T):
+            df[column] = list(np.round(values, 9)) + [np.nan] * (len(df) - len(values))
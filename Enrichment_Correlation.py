@@ -0,0 +1,164 @@
+# Enrichment_Correlation: correlations between mice for outlier detection. The count block of each cell type is ranked
+# or log-transformed and a single batched kernel correlates every pair of its samples, the log pseudocount comes from
+# the smallest positive count of all samples so that every cell type gets the same one
+import numpy as np
+import pandas as pd
+
+CORRELATION_METHODS = ["pearson", "spearman", "log-pearson"]
+REMOVAL_COLUMNS = ["Cell type", "Step", "Mouse removed", "Pairs under threshold", "Mice left", "Mean r", "Min r"]
+
+
+def check_correlation_method(method):
+    """
+    check_correlation_method : fails before any analysis is done if the correlation method is unknown
+        inputs:
+            method : "pearson", "spearman" or "log-pearson"
+    """
+    if method not in CORRELATION_METHODS:
+        raise ValueError("Correlation method must be one of " + ", ".join(CORRELATION_METHODS) + ", got " +
+                         str(method))
+
+
+def log_pseudocount(smallest_positive):
+    """
+    log_pseudocount : count added before the log of log-pearson, half of the smallest positive count
+        inputs:
+            smallest_positive : smallest positive normalized count of all samples, inf or NaN if there is none
+        output:
+            pseudocount : count added, 1 if no count is positive
+    """
+    return smallest_positive / 2 if np.isfinite(smallest_positive) else 1.0
+
+
+def smallest_positive_count(block):
+    """
+    smallest_positive_count : smallest positive normalized count of a block
+        inputs:
+            block : matrix of normalized counts
+        output:
+            smallest : smallest positive count, inf if there is none
+    """
+    positive = block[block > 0]
+    return positive.min() if len(positive) != 0 else np.inf
+
+
+def transform_block(block, method, pseudocount=None):
+    """
+    transform_block : prepares the normalized counts for the correlation method, every sample at once
+        inputs:
+            block : matrix of normalized counts, one column per sample
+            method : "pearson" leaves the counts, "spearman" ranks each sample over its rows with counts (ties get
+                     their average rank) and "log-pearson" takes the log of the counts plus half of the smallest
+                     positive count
+            pseudocount : count added before the log, from the smallest positive count of block if not given
+        output:
+            block : transformed matrix, missing counts stay missing
+    """
+    if method == "spearman":
+        return pd.DataFrame(block).rank(method="average").to_numpy(dtype=float)
+
+    if method == "log-pearson":
+        if pseudocount is None:
+            pseudocount = log_pseudocount(smallest_positive_count(block))
+        return np.log10(np.maximum(block, 0) + pseudocount)
+
+    return block
+
+
+def correlation_kernel(block):
+    """
+    correlation_kernel : Pearson correlation of every pair of columns over the rows where both have values, like
+                         DataFrame.corr, with matrix products instead of a loop over pairs. Spearman ranks are taken
+                         once per column, so with missing values they differ from DataFrame.corr("spearman"), which
+                         ranks again the rows shared by each pair
+        inputs:
+            block : matrix with one column per sample, NaN for missing values
+        output:
+            corr : matrix of correlations, NaN for pairs with less than two shared rows or no variance
+    """
+    present = (~np.isnan(block)).astype(float)
+    n_present = present.sum(axis=0)
+    means = np.where(present > 0, block, 0).sum(axis=0) / np.where(n_present == 0, 1, n_present)
+    centered = np.where(present > 0, block - means, 0)  # centering keeps the sums below well conditioned
+
+    n_pairs = present.T @ present
+    sums = centered.T @ present  # sums[i, j] : sum of column i over the rows shared with column j
+    squares = (centered ** 2).T @ present
+    products = centered.T @ centered
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = n_pairs * products - sums * sums.T
+        variance = n_pairs * squares - sums ** 2
+        corr = covariance / np.sqrt(variance * variance.T)
+
+    corr = np.where(n_pairs < 2, np.nan, np.clip(corr, -1, 1))
+    np.fill_diagonal(corr, np.where(np.diag(n_pairs) < 2, np.nan, 1.0))
+    return corr
+
+
+def correlation_matrices(block, samples, dict_samples_by_cell_type, method="pearson", pseudocount=None):
+    """
+    correlation_matrices : correlation matrices between the mice of each cell type from one kernel over the samples of
+                           block, called with the block of one cell type at a time
+        inputs:
+            block : matrix of normalized counts, one column per sample
+            samples : names of the columns of block
+            dict_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            method : "pearson", "spearman" or "log-pearson" (default = "pearson")
+            pseudocount : count added before the log of log-pearson, from the smallest positive count of block if not
+                          given
+        output:
+            dict_corr_matrices : dictionary with correlation matrices for each cell type
+    """
+    check_correlation_method(method)
+    corr = correlation_kernel(transform_block(block, method, pseudocount))
+    positions = {sample: index for index, sample in enumerate(samples)}
+
+    dict_corr_matrices = {}
+    for cell_type, list_samples in dict_samples_by_cell_type.items():
+        indices = [positions[sample] for sample in list_samples]
+        dict_corr_matrices[cell_type] = pd.DataFrame(corr[np.ix_(indices, indices)], index=list_samples,
+                                                     columns=list_samples)
+
+    return dict_corr_matrices
+
+
+def iterative_removal(df_corr, threshold):
+    """
+    iterative_removal : removes outlying mice one at a time, the mouse under the threshold with the most other mice
+                        first, until no mouse is under the threshold with more than half of the mice left. Correlations
+                        between two mice do not depend on the others, so removing a mouse only takes its pairs out of
+                        the counts under the threshold
+        inputs:
+            df_corr : correlation matrix between the mice of a cell type
+            threshold : r value used as threshold to flag outlying mice
+        output:
+            list_steps : list of (mouse, pairs under threshold, mice left, mean r, min r), in the order of removal,
+                         with the r values to the mice left when the mouse was removed
+    """
+    corr = df_corr.to_numpy(dtype=float)
+    under = corr < threshold
+    np.fill_diagonal(under, False)
+    counts = under.sum(axis=1)
+    active = np.ones(len(corr), dtype=bool)
+    positions = np.arange(len(corr))
+
+    list_steps = []
+    while active.sum() > 2:
+        n_active = int(active.sum())
+        flagged = active & (counts > 0.5 * n_active)
+        if not flagged.any():
+            break
+
+        # most pairs under the threshold first, the lowest mean correlation breaks ties
+        worst = min(np.flatnonzero(flagged),
+                    key=lambda index: (-counts[index], np.nanmean(corr[index, active & (positions != index)])))
+
+        r_values = corr[worst, active & (positions != worst)]
+        list_steps.append((df_corr.columns[worst], int(counts[worst]), n_active - 1, float(np.nanmean(r_values)),
+                           float(np.nanmin(r_values))))
+
+        active[worst] = False
+        counts -= under[:, worst]
+
+    return list_steps
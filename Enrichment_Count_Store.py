@@ -0,0 +1,255 @@
+# Enrichment_Count_Store: normalized counts kept on disk as a memory-mapped matrix, with a sidecar index of the
+# barcodes and sample columns, for barcode libraries and cohorts too large to copy in memory
+import json
+import math
+from os import makedirs, path
+
+import numpy as np
+import pandas as pd
+
+CHUNK_COLUMNS = 64  # columns read at a time when a matrix is scanned or copied
+CHUNK_ROWS = 10000  # rows of the csv file read at a time
+
+
+class CountStore:
+    """
+    CountStore : normalized counts in a memory-mapped matrix with one column per sample. The matrix is stored column
+    by column, so columns next to each other are read as a view without copies; other columns, like the samples of a
+    cell type when mouse-prefixed sample IDs sort them apart, are copied when read
+        inputs:
+            folder : folder where the matrix and its index are saved
+            name : name of the matrix, its files are name.npy and name.json
+            barcodes : list of barcodes, one per row
+            columns : list of sample IDs, one per column of the matrix
+            matrix : memory-mapped matrix of normalized counts
+            positions : positions of the columns in use, all columns if not given
+    """
+
+    def __init__(self, folder, name, barcodes, columns, matrix, positions=None):
+        self.folder = folder
+        self.name = name
+        self.barcodes = barcodes
+        self.all_columns = columns
+        self.matrix = matrix
+        self.positions = np.arange(len(columns)) if positions is None else np.asarray(positions)
+        self.d_positions = {column: index for index, column in enumerate(columns)}
+
+    @classmethod
+    def create(cls, folder, name, barcodes, columns):
+        """
+        create : creates an empty matrix and saves its index
+            inputs:
+                folder : folder where the matrix and its index are saved
+                name : name of the matrix
+                barcodes : list of barcodes, one per row
+                columns : list of sample IDs, one per column
+            output:
+                count_store : writable CountStore
+        """
+        makedirs(folder, exist_ok=True)
+        matrix = np.lib.format.open_memmap(path.join(folder, name + ".npy"), mode="w+", dtype=np.float64,
+                                           shape=(len(barcodes), len(columns)), fortran_order=True)
+        with open(path.join(folder, name + ".json"), "w") as index_file:
+            json.dump({"barcodes": list(barcodes), "columns": list(columns)}, index_file)
+
+        return cls(folder, name, list(barcodes), list(columns), matrix)
+
+    @classmethod
+    def open(cls, folder, name):
+        """
+        open : opens a saved matrix, read only
+            inputs:
+                folder : folder where the matrix and its index are saved
+                name : name of the matrix
+            output:
+                count_store : CountStore
+        """
+        with open(path.join(folder, name + ".json")) as index_file:
+            index = json.load(index_file)
+        matrix = np.load(path.join(folder, name + ".npy"), mmap_mode="r")
+
+        return cls(folder, name, index["barcodes"], index["columns"], matrix)
+
+    @classmethod
+    def from_csv(cls, folder, name, csv_filepath, columns):
+        """
+        from_csv : writes columns of a csv file of normalized counts into a matrix, a chunk of rows at a time
+            inputs:
+                folder : folder where the matrix and its index are saved
+                name : name of the matrix
+                csv_filepath : file path to csv file, the first column holds the barcodes
+                columns : names of the sample columns to keep
+            output:
+                count_store : read only CountStore
+        """
+        barcode_column = pd.read_csv(csv_filepath, sep=',', header=0, nrows=0).columns[0]
+        barcodes = pd.read_csv(csv_filepath, sep=',', header=0, usecols=[barcode_column])[barcode_column].tolist()
+
+        count_store = cls.create(folder, name, barcodes, columns)
+        row = 0
+        for df_chunk in pd.read_csv(csv_filepath, sep=',', header=0, usecols=list(columns), chunksize=CHUNK_ROWS):
+            count_store.matrix[row:row + len(df_chunk)] = df_chunk[list(columns)].to_numpy(dtype=np.float64)
+            row += len(df_chunk)
+        count_store.matrix.flush()
+
+        return cls.open(folder, name)
+
+    @classmethod
+    def from_frame(cls, folder, name, df_counts, columns):
+        """
+        from_frame : writes columns of a dataframe of normalized counts into a matrix
+            inputs:
+                folder : folder where the matrix and its index are saved
+                name : name of the matrix
+                df_counts : dataframe with a BC column of barcodes
+                columns : names of the sample columns to keep
+            output:
+                count_store : read only CountStore
+        """
+        count_store = cls.create(folder, name, df_counts["BC"].tolist(), columns)
+        count_store.matrix[:] = df_counts[list(columns)].to_numpy(dtype=np.float64)
+        count_store.matrix.flush()
+
+        return cls.open(folder, name)
+
+    @property
+    def columns(self):
+        """
+        columns : sample IDs of the columns in use
+        """
+        return [self.all_columns[position] for position in self.positions]
+
+    def select(self, columns):
+        """
+        select : store sharing the same matrix with only some columns in use
+            inputs:
+                columns : list of sample IDs
+            output:
+                count_store : CountStore
+        """
+        return CountStore(self.folder, self.name, self.barcodes, self.all_columns, self.matrix,
+                          [self.d_positions[column] for column in columns])
+
+    def block(self, columns=None):
+        """
+        block : matrix of normalized counts of some columns, a view of the memory-mapped matrix when the columns are
+                next to each other
+            inputs:
+                columns : list of sample IDs, columns in use if not given
+            output:
+                matrix : matrix of normalized counts
+        """
+        positions = self.positions if columns is None else np.array([self.d_positions[column] for column in columns],
+                                                                      dtype=int)
+        if len(positions) != 0 and np.array_equal(positions, np.arange(positions[0], positions[0] + len(positions))):
+            return self.matrix[:, positions[0]:positions[0] + len(positions)]
+
+        return self.matrix[:, positions]
+
+    def frame(self, columns=None):
+        """
+        frame : dataframe of normalized counts backed by the memory-mapped matrix
+            inputs:
+                columns : list of sample IDs, columns in use if not given
+            output:
+                df : dataframe with one column per sample
+        """
+        if columns is None:
+            columns = self.columns
+
+        return pd.DataFrame(self.block(columns), columns=list(columns), copy=False)
+
+    def chunks(self):
+        """
+        chunks : blocks of CHUNK_COLUMNS columns in use, to scan the matrix with bounded memory
+            output:
+                generator of matrices
+        """
+        columns = self.columns
+        for start in range(0, len(columns), CHUNK_COLUMNS):
+            yield self.block(columns[start:start + CHUNK_COLUMNS])
+
+    def percentile(self, percentile):
+        """
+        percentile : value at given percentile of all normalized counts in use, interpolated like np.percentile,
+                     keeping only the values above it in memory
+            inputs:
+                percentile : percentile (0-100)
+            output:
+                n_at_percentile : value at given percentile
+        """
+        n_values = len(self.barcodes) * len(self.positions)
+        rank = percentile / 100 * (n_values - 1)
+        n_largest = n_values - math.floor(rank)  # largest values needed, down to the lower neighbor of rank
+
+        if n_largest > n_values // 2:
+            return np.percentile(self.block(), percentile)
+
+        largest = np.empty(0)
+        for block in self.chunks():
+            values = np.concatenate([largest, np.asarray(block).ravel()])
+            if len(values) > n_largest:
+                values = np.partition(values, len(values) - n_largest)[len(values) - n_largest:]
+            largest = values
+
+        # linear interpolation between the two values around rank, as np.percentile does
+        largest.sort()
+        lower = largest[0]
+        upper = largest[1] if n_largest > 1 else lower
+        fraction = rank - math.floor(rank)
+        if fraction >= 0.5:
+            return upper - (upper - lower) * (1 - fraction)
+
+        return lower + (upper - lower) * fraction
+
+    def count_at_least(self, value):
+        """
+        count_at_least : number of samples in which each barcode has normalized counts at or above value
+            inputs:
+                value : threshold
+            output:
+                counts : array with one count per barcode
+        """
+        counts = np.zeros(len(self.barcodes), dtype=int)
+        for block in self.chunks():
+            counts += (np.asarray(block) >= value).sum(axis=1)
+
+        return counts
+
+    def smallest_positive(self):
+        """
+        smallest_positive : smallest positive normalized count in use, a chunk of columns at a time
+            output:
+                smallest : smallest positive count, inf if there is none
+        """
+        smallest = np.inf
+        for block in self.chunks():
+            block = np.asarray(block)
+            positive = block[block > 0]
+            if len(positive) != 0:
+                smallest = min(smallest, positive.min())
+
+        return smallest
+
+    def reorder(self, name, rows, columns, renormalize=False):
+        """
+        reorder : copies some rows and columns into a new matrix, a chunk of columns at a time
+            inputs:
+                name : name of the new matrix
+                rows : positions of the rows to copy, in their new order
+                columns : sample IDs of the columns to copy, in their new order
+                renormalize : boolean to renormalize every column to 100 like renormalize_counts
+            output:
+                count_store : read only CountStore
+        """
+        rows = np.asarray(rows, dtype=int)
+        count_store = CountStore.create(self.folder, name, [self.barcodes[row] for row in rows], columns)
+        for start in range(0, len(columns), CHUNK_COLUMNS):
+            block = np.asarray(self.block(columns[start:start + CHUNK_COLUMNS]))[rows]
+            if renormalize:
+                sums = block.sum(axis=0)
+                block = np.where(sums != 100, block / np.where(sums == 0, 1, sums) * 100, block)
+            count_store.matrix[:, start:start + block.shape[1]] = block
+        count_store.matrix.flush()
+
+        return CountStore.open(self.folder, name)
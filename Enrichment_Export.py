@@ -0,0 +1,213 @@
+# Enrichment_Export: tidy long-format export of the tables created by Whole_Enrichment.py
+import importlib.util
+
+import pandas as pd
+
+from Enrichment_Bootstrap import BOOTSTRAP_COLUMNS
+from Enrichment_Permutation import EMPIRICAL_P_COLUMN
+from Enrichment_Statistics import SIGNIFICANCE_COLUMNS
+
+EXPORT_FORMATS = ["parquet", "feather"]
+KEY_COLUMNS = ["scope", "organ", "cell_type", "sample"]
+EXTRA_TABLE_COLUMNS = {"Weighted Enrichment": "weighted_enrichment", "Running-Sum Enrichment": "running_sum"}
+
+
+def table_key(scope, organ=None, cell_type=None, sample=None):
+    """
+    table_key : key identifying the ranking a table belongs to
+        inputs:
+            scope : "overall", "organ", "cell_type", "sample" or "mouse"
+            organ : organ of the ranking, if any
+            cell_type : cell type of the ranking, if any
+            sample : sample ID, or sample number for a mouse, if any
+        output:
+            key : dictionary with the key columns of the long-format tables
+    """
+    return {"scope": scope, "organ": organ, "cell_type": cell_type, "sample": sample}
+
+
+def check_export_format(export_format):
+    """
+    check_export_format : fails before any analysis is done if the export format can not be written
+        inputs:
+            export_format : "parquet" or "feather"
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Export format must be one of " + ", ".join(EXPORT_FORMATS) + ", got " + str(export_format))
+    if importlib.util.find_spec("pyarrow") is None:
+        raise ImportError("pyarrow is required to export " + export_format + " files: 'pip3 install pyarrow'")
+
+
+class LongFormatExport:
+    """
+    LongFormatExport : collects every table of an enrichment analysis as long-format tables, one row per LNP (counts,
+    rankings) or per component level (enrichment), keyed by scope, organ, cell type and sample
+    """
+
+    def __init__(self):
+        self.tables = {"counts": [], "rankings": [], "enrichment": [], "influence": [], "rarefaction": []}
+
+    def add_counts(self, key, df_lnps, values, std=None):
+        """
+        add_counts : adds normalized counts, or their average, of a sample, mouse, cell type or organ
+            inputs:
+                key : table_key of the counts
+                df_lnps : dataframe with LNP and BC columns
+                values : normalized counts aligned with df_lnps
+                std : standard deviation aligned with df_lnps (optional input)
+        """
+        df = pd.DataFrame({"LNP": df_lnps["LNP"].to_numpy(), "BC": df_lnps["BC"].to_numpy(),
+                           "value": pd.to_numeric(pd.Series(values).to_numpy())})
+        if std is not None:
+            df["std"] = pd.Series(std).to_numpy()
+        self.tables["counts"].append(add_key_columns(df, key))
+
+    def add_ranking(self, key, view, top, bottom):
+        """
+        add_ranking : adds the rank of every LNP and whether it is among the top or bottom performing LNPs
+            inputs:
+                key : table_key of the ranking
+                view : RankedView of the formulations by the column to sort by
+                top : positions of top performing LNPs
+                bottom : positions of bottom performing LNPs
+        """
+        order = view.order
+        df = pd.DataFrame({"LNP": view.df_formulations["LNP"].to_numpy()[order],
+                           "BC": view.df_formulations["BC"].to_numpy()[order],
+                           "rank": range(1, len(order) + 1),
+                           "value": pd.to_numeric(view.df_values[view.sort_by].to_numpy()[order])})
+        df["top"] = pd.Series(order).isin(top).to_numpy()
+        df["bottom"] = pd.Series(order).isin(bottom).to_numpy()
+        self.tables["rankings"].append(add_key_columns(df, key))
+
+    def add_enrichment(self, key, list_tables, extra_tables=None):
+        """
+        add_enrichment : adds the total, top and bottom enrichment and net enrichment factors of a ranking, and their
+                         p-values, q-values, empirical p-values, confidence intervals and the scores of the extra
+                         tables when there are
+            inputs:
+                key : table_key of the ranking
+                list_tables : dictionaries of tables by component, in the order of ENRICHMENT_TABLE_TITLES
+                extra_tables : dictionary with, for each title, a dictionary of tables by component placed after the
+                               net enrichment tables (optional input)
+        """
+        d_total, d_top, d_factors_top, d_bottom, d_factors_bottom, d_net = list_tables[:6]
+        for component in d_total:
+            levels = d_total[component][component].astype(str).to_numpy()
+            df = pd.DataFrame({"component": component, "level": levels,
+                               "total_count": table_column(d_total[component], 1),
+                               "total_fraction": table_column(d_total[component], 2),
+                               "top_count": table_column(d_top[component], 1),
+                               "top_fraction": table_column(d_top[component], 2),
+                               "enrichment_top": table_column(d_factors_top[component], 1),
+                               "bottom_count": table_column(d_bottom[component], 1),
+                               "bottom_fraction": table_column(d_bottom[component], 2),
+                               "depletion_bottom": table_column(d_factors_bottom[component], 1),
+                               "net_enrichment": table_column(d_net[component], 1)})
+            for name, d_tables in [("top", d_factors_top), ("bottom", d_factors_bottom), ("net", d_net)]:
+                if SIGNIFICANCE_COLUMNS[0] in d_tables[component].columns:
+                    df["p_" + name] = d_tables[component][SIGNIFICANCE_COLUMNS[0]].to_numpy(dtype=float)
+                    df["q_" + name] = d_tables[component][SIGNIFICANCE_COLUMNS[1]].to_numpy(dtype=float)
+            for title, d_tables in (extra_tables or {}).items():
+                name = EXTRA_TABLE_COLUMNS[title]
+                df[name] = table_column(d_tables[component], 1)
+                if EMPIRICAL_P_COLUMN in d_tables[component].columns:
+                    df["p_" + name] = d_tables[component][EMPIRICAL_P_COLUMN].to_numpy(dtype=float)
+            if EMPIRICAL_P_COLUMN in d_net[component].columns:
+                df["p_empirical"] = d_net[component][EMPIRICAL_P_COLUMN].to_numpy(dtype=float)
+            if BOOTSTRAP_COLUMNS[0] in d_net[component].columns:
+                df["ci_low"] = d_net[component][BOOTSTRAP_COLUMNS[0]].to_numpy(dtype=float)
+                df["ci_high"] = d_net[component][BOOTSTRAP_COLUMNS[1]].to_numpy(dtype=float)
+            df = df[levels != "TOTAL"]
+            self.tables["enrichment"].append(add_key_columns(df, key))
+
+    def add_influence(self, key, df_influence):
+        """
+        add_influence : adds the influence of each mouse on the ranking of a cell type
+            inputs:
+                key : table_key of the ranking
+                df_influence : dataframe with one row per mouse left out
+        """
+        df = df_influence.rename(columns={"Mouse left out": "mouse", "Mean |change|": "mean_abs_change",
+                                          "Largest |change|": "max_abs_change", "Component": "component",
+                                          "Level": "level", "Top kept": "top_kept"})
+        df["level"] = df["level"].astype(str)
+        self.tables["influence"].append(add_key_columns(df, key))
+
+    def add_rarefaction(self, key, df_report):
+        """
+        add_rarefaction : adds the stability of the ranking of a cell type at lower sequencing depths
+            inputs:
+                key : table_key of the ranking
+                df_report : dataframe with one row per depth
+        """
+        df = df_report.drop(columns="Cell type").rename(columns={
+            "Depth": "depth", "Draws": "draws", "Mice below depth": "mice_below_depth",
+            "Top Jaccard mean": "top_jaccard_mean", "Top Jaccard min": "top_jaccard_min",
+            "Bottom Jaccard mean": "bottom_jaccard_mean", "Bottom Jaccard min": "bottom_jaccard_min",
+            "Mean |net change|": "mean_abs_net_change"})
+        self.tables["rarefaction"].append(add_key_columns(df.reset_index(drop=True), key))
+
+    def enrichment_table(self):
+        """
+        enrichment_table : every enrichment table collected, in one long-format table
+            output:
+                df_enrichment : dataframe with one row per ranking and component level
+        """
+        if len(self.tables["enrichment"]) == 0:
+            return pd.DataFrame(columns=KEY_COLUMNS + ["component", "level"])
+        return pd.concat(self.tables["enrichment"], ignore_index=True)
+
+    def write(self, destination_file, export_format):
+        """
+        write : writes every collected table next to the excel spreadsheet
+            inputs:
+                destination_file : directory of the excel spreadsheet created
+                export_format : "parquet" or "feather"
+            output:
+                list_files : list of the files written
+        """
+        check_export_format(export_format)
+        base_name = destination_file[:-len(".xlsx")] if destination_file.endswith(".xlsx") else destination_file
+
+        list_files = []
+        for name, list_df in self.tables.items():
+            if len(list_df) == 0:
+                continue
+            df = pd.concat(list_df, ignore_index=True)
+            file_path = base_name + " - " + name + "." + export_format
+            if export_format == "parquet":
+                df.to_parquet(file_path, index=False)
+            else:
+                df.to_feather(file_path)
+            list_files.append(file_path)
+
+        return list_files
+
+
+def add_key_columns(df, key):
+    """
+    add_key_columns : places the key columns in front of a long-format table
+        inputs:
+            df : long-format dataframe
+            key : table_key of the table
+        output:
+            df : dataframe starting with the key columns
+    """
+    for index, column in enumerate(KEY_COLUMNS):
+        value = key[column]
+        df.insert(index, column, pd.Series([value] * len(df), index=df.index, dtype="object"))
+
+    return df
+
+
+def table_column(df, col_num):
+    """
+    table_column : numeric values of a column of an enrichment table
+        inputs:
+            df : enrichment table
+            col_num : column number
+        output:
+            values : array of floats
+    """
+    return pd.to_numeric(df.iloc[:, col_num]).to_numpy(dtype=float)
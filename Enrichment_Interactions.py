@@ -0,0 +1,176 @@
+# Enrichment_Interactions: enrichment of combinations of components (pairs or triples), counted for many rankings at
+# once with combined integer codes and bincount, in the same tables as the enrichment of single components
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+INTERACTION_ORDERS = [2, 3]
+LEVEL_SEPARATOR = " / "
+COMPONENT_SEPARATOR = " x "
+
+
+def component_codes(df_formulations, dict_components):
+    """
+    component_codes : integer code of the level of every LNP for each component, -1 if the LNP has none of the levels
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            dict_components : a dictionary containing list of all the component mole ratios and types
+        output:
+            d_codes : dictionary with an array of codes by component
+            d_levels : dictionary with the list of levels by component, in the order of the codes
+    """
+    d_codes = {}
+    d_levels = {}
+    for component, levels in dict_components.items():
+        levels = [level for level in levels if level != "TOTAL"]
+        codes = np.full(len(df_formulations), -1)
+        for code, level in reversed(list(enumerate(levels))):  # first matching level wins, as in calculate_enrichment
+            codes[df_formulations[component].eq(level).to_numpy()] = code
+        d_codes[component] = codes
+        d_levels[component] = levels
+
+    return d_codes, d_levels
+
+
+def combined_codes(d_codes, d_levels, combination):
+    """
+    combined_codes : one integer code per LNP for the combination of the levels of several components
+        inputs:
+            d_codes : dictionary with an array of codes by component
+            d_levels : dictionary with the list of levels by component
+            combination : tuple of components
+        output:
+            codes : array of combined codes, -1 if the LNP lacks a level of one of the components
+            n_codes : number of possible combined codes
+    """
+    codes = np.zeros(len(d_codes[combination[0]]), dtype=int)
+    valid = np.ones(len(codes), dtype=bool)
+    n_codes = 1
+    for component in combination:
+        codes = codes * len(d_levels[component]) + d_codes[component]
+        valid &= d_codes[component] >= 0
+        n_codes *= len(d_levels[component])
+
+    return np.where(valid, codes, -1), n_codes
+
+
+def combination_labels(d_levels, combination, codes):
+    """
+    combination_labels : names of combined codes, levels joined by LEVEL_SEPARATOR
+        inputs:
+            d_levels : dictionary with the list of levels by component
+            combination : tuple of components
+            codes : array of combined codes
+        output:
+            labels : list of names
+    """
+    labels = []
+    for code in codes:
+        list_levels = []
+        for component in reversed(combination):
+            code, level_code = divmod(int(code), len(d_levels[component]))
+            list_levels.append(str(d_levels[component][level_code]))
+        labels.append(LEVEL_SEPARATOR.join(reversed(list_levels)))
+
+    return labels
+
+
+def count_codes(codes, n_codes, list_positions):
+    """
+    count_codes : counts of every combined code among the LNPs at given positions, for many rankings with one bincount
+        inputs:
+            codes : array of combined codes of every LNP
+            n_codes : number of possible combined codes
+            list_positions : list of arrays of positions of LNPs, one per ranking
+        output:
+            counts : matrix of counts, one row per ranking and one column per code
+    """
+    rankings = np.repeat(np.arange(len(list_positions)), [len(positions) for positions in list_positions])
+    positions = np.concatenate(list_positions).astype(int) if len(list_positions) != 0 else np.empty(0, dtype=int)
+    selected = codes[positions]
+    valid = selected >= 0
+
+    counts = np.bincount(rankings[valid] * n_codes + selected[valid], minlength=len(list_positions) * n_codes)
+    return counts.reshape(len(list_positions), n_codes)
+
+
+def count_table(name, labels, counts):
+    """
+    count_table : enrichment table of counts, same columns and TOTAL row as calculate_enrichment
+        inputs:
+            name : name of the combination of components
+            labels : names of the combinations of levels
+            counts : array of counts of each combination of levels
+        output:
+            df_table : dataframe with Total # and % of Total
+    """
+    total = int(counts.sum())
+    fractions = [round(count / total, 9) if total != 0 else 0.0 for count in counts]
+    return pd.DataFrame({name: list(labels) + ["TOTAL"], "Total #": [int(count) for count in counts] + [total],
+                         "% of Total": fractions + [round(sum(fractions))]})
+
+
+def factor_table(name, df_total, df_selected, sort_by):
+    """
+    factor_table : enrichment factors of a table of counts against the table of all LNPs, as raw_enrichment_factor
+        inputs:
+            name : name of the combination of components
+            df_total : count_table of all LNPs
+            df_selected : count_table of top or bottom performing LNPs
+            sort_by : name of the ranking
+        output:
+            df_factors : dataframe of enrichment factors
+    """
+    total_fractions = df_total["% of Total"].to_numpy(dtype=float)
+    factors = np.round(df_selected["% of Total"].to_numpy(dtype=float) / np.where(total_fractions == 0, np.nan,
+                                                                                   total_fractions), 9)
+    return pd.DataFrame({name: df_total[name].to_numpy(), sort_by: factors})
+
+
+def interaction_tables(df_formulations, dict_components, list_rankings, order=2):
+    """
+    interaction_tables : total, top and bottom enrichment and net enrichment factors of every combination of order
+                         components, for every ranking. Only combinations of levels found among all LNPs are listed
+        inputs:
+            df_formulations : dataframe with formulations sheet, in the order the positions refer to
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            list_rankings : list of (sort_by, top, bottom), with the positions of top and bottom performing LNPs
+            order : number of components combined, 2 for pairs or 3 for triples
+        output:
+            list_ranking_tables : list with, for each ranking, the dictionaries of tables by combination in the order
+                                  of ENRICHMENT_TABLE_TITLES
+    """
+    if order not in INTERACTION_ORDERS:
+        raise ValueError("Interactions must combine " + " or ".join(str(n) for n in INTERACTION_ORDERS) +
+                         " components, got " + str(order))
+
+    d_codes, d_levels = component_codes(df_formulations, dict_components)
+    list_ranking_tables = [[{} for _ in range(6)] for _ in list_rankings]
+
+    for combination in combinations(d_codes, order):
+        name = COMPONENT_SEPARATOR.join(combination)
+        codes, n_codes = combined_codes(d_codes, d_levels, combination)
+
+        total = np.bincount(codes[codes >= 0], minlength=n_codes)
+        present = np.flatnonzero(total)
+        labels = combination_labels(d_levels, combination, present)
+
+        top = count_codes(codes, n_codes, [ranking[1] for ranking in list_rankings])[:, present]
+        bottom = count_codes(codes, n_codes, [ranking[2] for ranking in list_rankings])[:, present]
+
+        df_total = count_table(name, labels, total[present])
+        for index, (sort_by, _, _) in enumerate(list_rankings):
+            df_top = count_table(name, labels, top[index])
+            df_bottom = count_table(name, labels, bottom[index])
+            df_factors_top = factor_table(name, df_total, df_top, sort_by)
+            df_factors_bottom = factor_table(name, df_total, df_bottom, sort_by)
+            df_net = pd.DataFrame({name: df_total[name].to_numpy(),
+                                   sort_by: np.round(df_factors_top[sort_by].to_numpy() -
+                                                     df_factors_bottom[sort_by].to_numpy(), 9)})
+
+            for d_tables, df in zip(list_ranking_tables[index], [df_total, df_top, df_factors_top, df_bottom,
+                                                                 df_factors_bottom, df_net]):
+                d_tables[name] = df
+
+    return list_ranking_tables
@@ -0,0 +1,310 @@
+# Enrichment_Job: job specs describing a run of run_enrichment_analysis, saved next to every workbook, and a cache of
+# results keyed on the content of the input files and the parameters, so running a spec again returns the files
+# written the first time instead of computing and writing them again
+#
+# A spec is a JSON (or YAML, with PyYAML) object with the parameters of run_enrichment_analysis, for example
+#     {"version": 1, "parameters": {"destination_folder": "results", "file_id": "run1",
+#      "formulations_sheet": "formulations.xlsx", "csv_filepath": "counts.csv", "sorted_cells": ["LH", "LE"],
+#      "number_naked_bcs": 2, "x_percent": 10, "sample_numbers": ["M1", "M2"], "remove_outlying_mouse": true,
+#      "r2_threshold": 0.8, "remove_runaways": true, "percentile": 99.9}}
+# Saved specs also hold the sha256 of the input files and the cache key of the run
+import argparse
+import copy
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import time
+
+from Enrichment_Service import CACHE_INDEX, RESULT_PREFIX
+from Enrichment_Watch import file_hash
+
+SPEC_VERSION = 1
+SPEC_SUFFIX = " - job.json"
+SPEC_FORMATS = [".json", ".yaml", ".yml"]
+INPUT_FILES = ["formulations_sheet", "csv_filepath", "raw_counts_csv"]
+LOCATION_PARAMETERS = ["destination_folder", "file_id", "workers", "memory_map_folder"]  # do not change the tables
+
+d_hashes = {}  # (path, size, modification time) : sha256, files are only hashed again when they change
+
+
+def check_spec_format(file_path):
+    """
+    check_spec_format : fails if a spec file can not be read or written
+        inputs:
+            file_path : path of the spec, ending in .json, .yaml or .yml
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in SPEC_FORMATS:
+        raise ValueError("Job specs must be one of " + ", ".join(SPEC_FORMATS) + " files, got " + str(file_path))
+    if extension != ".json" and importlib.util.find_spec("yaml") is None:
+        raise ImportError("PyYAML is required to read and write YAML job specs: 'pip3 install pyyaml'")
+
+
+def input_hash(file_path):
+    """
+    input_hash : sha256 of an input file, kept until the file changes
+        inputs:
+            file_path : path of the file
+        output:
+            digest : hexadecimal hash
+    """
+    stat = os.stat(file_path)
+    version = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+    if version not in d_hashes:
+        d_hashes[version] = file_hash(file_path).hexdigest()
+
+    return d_hashes[version]
+
+
+def all_parameters(params):
+    """
+    all_parameters : every parameter of run_enrichment_analysis, the defaults of those not given included, so a run
+                     has the same spec whether a parameter is given with its default value or left out
+        inputs:
+            params : dictionary of parameters of run_enrichment_analysis
+        output:
+            parameters : dictionary of all parameters
+    """
+    from Whole_Enrichment import run_enrichment_analysis  # pylint: disable=import-outside-toplevel
+
+    arguments = inspect.signature(run_enrichment_analysis).bind(**params)
+    arguments.apply_defaults()
+    return dict(arguments.arguments)
+
+
+def job_spec(params):
+    """
+    job_spec : spec of a run, its parameters with absolute paths, the hashes of its input files and its cache key
+        inputs:
+            params : dictionary of parameters of run_enrichment_analysis
+        output:
+            spec : dictionary that can be saved as JSON
+    """
+    parameters = json.loads(json.dumps(all_parameters(params)))  # copy, tuples become lists like in a saved spec
+    for name in INPUT_FILES + ["destination_folder", "memory_map_folder", "results_database"]:
+        if isinstance(parameters.get(name), list):
+            parameters[name] = [os.path.abspath(file_path) for file_path in parameters[name]]
+        elif parameters.get(name) is not None:
+            parameters[name] = os.path.abspath(parameters[name])
+
+    inputs = {}
+    for name in INPUT_FILES:
+        if isinstance(parameters.get(name), list):
+            inputs[name] = [input_hash(file_path) for file_path in parameters[name]]
+        elif parameters.get(name) is not None:
+            inputs[name] = input_hash(parameters[name])
+
+    key_content = {"parameters": {name: value for name, value in parameters.items()
+                                  if name not in LOCATION_PARAMETERS + INPUT_FILES}, "inputs": inputs}
+    key = hashlib.sha256(json.dumps(key_content, sort_keys=True).encode()).hexdigest()
+
+    return {"version": SPEC_VERSION, "parameters": parameters, "inputs": inputs, "key": key}
+
+
+def spec_file(destination_file):
+    """
+    spec_file : path of the spec saved next to a workbook
+        inputs:
+            destination_file : directory of the excel spreadsheet created
+        output:
+            file_path : path of the spec
+    """
+    base_name = destination_file[:-len(".xlsx")] if destination_file.endswith(".xlsx") else destination_file
+    return base_name + SPEC_SUFFIX
+
+
+def save_spec(spec, file_path):
+    """
+    save_spec : writes a spec as JSON, or as YAML for .yaml and .yml files
+        inputs:
+            spec : dictionary from job_spec
+            file_path : path of the spec
+    """
+    check_spec_format(file_path)
+    with open(file_path, "w") as file:
+        if file_path.lower().endswith(".json"):
+            json.dump(spec, file, indent=1)
+        else:
+            import yaml  # pylint: disable=import-outside-toplevel
+            yaml.safe_dump(spec, file, sort_keys=False)
+
+
+def load_spec(file_path):
+    """
+    load_spec : parameters of a spec file, relative paths are relative to the folder of the spec
+        inputs:
+            file_path : path of a spec, with a "parameters" object or only the parameters
+        output:
+            params : dictionary of parameters of run_enrichment_analysis
+    """
+    check_spec_format(file_path)
+    with open(file_path) as file:
+        if file_path.lower().endswith(".json"):
+            spec = json.load(file)
+        else:
+            import yaml  # pylint: disable=import-outside-toplevel
+            spec = yaml.safe_load(file)
+
+    if not isinstance(spec, dict):
+        raise ValueError("A job spec must be an object with the parameters of run_enrichment_analysis")
+    if spec.get("version", SPEC_VERSION) > SPEC_VERSION:
+        raise ValueError("Job spec version " + str(spec["version"]) + " is newer than " + str(SPEC_VERSION))
+
+    params = dict(spec.get("parameters", spec))
+    spec_folder = os.path.dirname(os.path.abspath(file_path))
+    for name in INPUT_FILES + ["destination_folder", "memory_map_folder", "results_database"]:
+        if isinstance(params.get(name), list):
+            params[name] = [os.path.join(spec_folder, value) for value in params[name]]
+        elif params.get(name) is not None:
+            params[name] = os.path.join(spec_folder, params[name])
+    params.setdefault("file_id", "")
+
+    return params
+
+
+class ResultCache:
+    """
+    ResultCache : files written by runs, by cache key, in a JSON index. A run is only returned while its files are
+    unchanged
+        inputs:
+            index_path : path of the index, created if it does not exist
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.d_runs = self.read()
+
+    def read(self):
+        """
+        read : runs of the index file
+            output:
+                d_runs : dictionary with the stem of the workbook and the files of each run, by cache key
+        """
+        if not os.path.isfile(self.index_path):
+            return {}
+        with open(self.index_path) as file:
+            return json.load(file)
+
+    def lookup(self, key):
+        """
+        lookup : files of a run with the same key
+            inputs:
+                key : cache key of the run
+            output:
+                run : dictionary with the stem and the files of the run, None if there is none or a file changed
+        """
+        run = self.d_runs.get(key)
+        if run is None:
+            return None
+        for file_path, size, modified in run["files"]:
+            if not os.path.isfile(file_path) or (os.path.getsize(file_path), os.path.getmtime(file_path)) != \
+                    (size, modified):
+                return None
+
+        return run
+
+    def store(self, key, stem, list_files):
+        """
+        store : adds the files of a run to the index, runs added by other processes since it was read are kept
+            inputs:
+                key : cache key of the run
+                stem : name of the workbook without extension, the files are named after it
+                list_files : list of file paths
+        """
+        self.d_runs = self.read()
+        self.d_runs[key] = {"stem": stem, "created": time.time(),
+                            "files": [[file_path, os.path.getsize(file_path), os.path.getmtime(file_path)]
+                                      for file_path in list_files]}
+
+        temporary_path = self.index_path + ".tmp" + str(os.getpid())
+        with open(temporary_path, "w") as file:
+            json.dump(self.d_runs, file, indent=1)
+        os.replace(temporary_path, self.index_path)
+
+
+def workbook_stem(file_id):
+    """
+    workbook_stem : name of the workbook of a run without extension, see create_excel_spreadsheet
+        inputs:
+            file_id : file identifier of the run
+        output:
+            stem : name
+    """
+    return RESULT_PREFIX + (" " + file_id if file_id != "" else "")
+
+
+def copy_run(run, destination_folder, file_id):
+    """
+    copy_run : copies the files of a cached run into another destination folder, or under another file identifier
+        inputs:
+            run : dictionary with the stem and the files of the run
+            destination_folder : destination folder of the new run
+            file_id : file identifier of the new run
+        output:
+            list_files : list of the file paths of the new run
+    """
+    stem = workbook_stem(file_id)
+    os.makedirs(destination_folder, exist_ok=True)
+
+    list_files = []
+    for file_path, _, _ in run["files"]:
+        name = os.path.basename(file_path)
+        new_path = os.path.join(destination_folder, stem + name[len(run["stem"]):])
+        if os.path.abspath(new_path) != os.path.abspath(file_path):
+            shutil.copy2(file_path, new_path)
+        list_files.append(new_path)
+
+    return list_files
+
+
+def run_job(params, cache_index=None, force=False):
+    """
+    run_job : runs an enrichment analysis, or returns the files of a run with the same inputs and parameters
+        inputs:
+            params : dictionary of parameters of run_enrichment_analysis
+            cache_index : path of the index of the result cache, no cache if not given
+            force : boolean to run the analysis even when the cache has it
+        output:
+            list_files : list of the files of the run, workbooks, exports and spec
+            cached : True if the files come from the cache
+    """
+    params = copy.deepcopy(params)  # the analysis sorts sorted_cells in place
+    params.setdefault("file_id", "")
+    cache = ResultCache(cache_index) if cache_index is not None else None
+    key = job_spec(params)["key"]
+
+    run = cache.lookup(key) if cache is not None and not force else None
+    if run is not None:
+        list_files = copy_run(run, params["destination_folder"], params["file_id"])
+        if list_files != [file_path for file_path, _, _ in run["files"]]:
+            # the copied spec describes the new run
+            for file_path in list_files:
+                if file_path.endswith(SPEC_SUFFIX):
+                    save_spec(job_spec(params), file_path)
+            cache.store(key, workbook_stem(params["file_id"]), list_files)
+        return list_files, True
+
+    import Whole_Enrichment  # pylint: disable=import-outside-toplevel
+
+    list_files = Whole_Enrichment.run_enrichment_analysis(**params)
+    if cache is not None:
+        cache.store(key, workbook_stem(params["file_id"]), list_files)
+
+    return list_files, False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the enrichment analysis of a job spec, from the cache if it can")
+    parser.add_argument("spec", help="job spec, a .json, .yaml or .yml file")
+    parser.add_argument("--cache-index", help="index of the result cache, " + CACHE_INDEX +
+                                              " in the destination folder by default")
+    parser.add_argument("--force", action="store_true", help="run the analysis even if the cache has it")
+    args = parser.parse_args()
+
+    job_params = load_spec(args.spec)
+    files, from_cache = run_job(job_params, args.cache_index or os.path.join(job_params["destination_folder"],
+                                                                             CACHE_INDEX), args.force)
+    print(("Found in the cache: " if from_cache else "Wrote: ") + ", ".join(files))
@@ -0,0 +1,286 @@
+# Enrichment_Meta_Analysis: combines the enrichment of every component level across many experiments. Experiments are
+# read one at a time, from long-format enrichment files (--export-format) or from results databases
+# (--results-database), on a pool of threads that only reads a few experiments ahead, and are folded into running sums
+# by scope, organ, cell type, component and level, so memory depends on the number of levels and not on the number of
+# experiments. A level missing from the formulations of an experiment is left out of that experiment only
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Enrichment_Export import KEY_COLUMNS
+from Enrichment_Results_Store import ResultsStore
+from Enrichment_Statistics import benjamini_hochberg, log_factorials
+
+GROUP_COLUMNS = ["scope", "organ", "cell_type", "component", "level"]
+WEIGHTS = ["lnps", "equal"]
+META_COLUMNS = ["experiments", "coverage", "lnps", "net_enrichment_mean", "net_enrichment_sd", "net_enrichment_min",
+                "net_enrichment_max", "experiments_enriched", "p_combined", "q_combined"]
+SUMS = {"experiments": "sum", "lnps": "sum", "weight": "sum", "weighted_sum": "sum", "weighted_squares": "sum",
+        "net_min": "min", "net_max": "max", "enriched": "sum", "fisher": "sum", "n_p": "sum"}
+DATABASE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+def fisher_combined(statistics, n_p):
+    """
+    fisher_combined : combined p-values of Fisher's method, the chi-square survival function with 2k degrees of freedom
+                      has the closed form exp(-x/2) * sum over i < k of (x/2)^i / i!
+        inputs:
+            statistics : array of sums of -2 log(p) over the experiments of each row
+            n_p : array of numbers of p-values of each row
+        output:
+            p_combined : array of combined p-values, NaN for rows without p-values
+    """
+    statistics = np.asarray(statistics, dtype=float)
+    n_p = np.asarray(n_p, dtype=int)
+    p_combined = np.full(len(n_p), np.nan)
+    tested = n_p > 0
+    if not tested.any():
+        return p_combined
+
+    half = statistics[tested] / 2
+    steps = np.arange(n_p[tested].max())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_terms = steps * np.log(half)[:, np.newaxis] - log_factorials(len(steps))[steps]
+    log_terms[:, 0] = 0  # (x/2)^0 / 0! is 1, even when x is 0
+    log_terms[steps >= n_p[tested][:, np.newaxis]] = -np.inf
+
+    largest = log_terms.max(axis=1)
+    log_sums = largest + np.log(np.exp(log_terms - largest[:, np.newaxis]).sum(axis=1))
+    p_combined[tested] = np.minimum(np.exp(log_sums - half), 1)
+
+    return p_combined
+
+
+def source_readers(list_sources, columns):
+    """
+    source_readers : one reader per experiment of the sources, so experiments can be read separately
+        inputs:
+            list_sources : paths of long-format enrichment files (parquet or feather) and of results databases
+            columns : enrichment columns needed, columns missing from an experiment are read as NaN
+        output:
+            list_readers : list of (experiment, function, arguments)
+    """
+    list_readers = []
+    for source in list_sources:
+        if source.lower().endswith(DATABASE_EXTENSIONS):
+            store = ResultsStore(source)
+            experiments = store.experiments()["name"].tolist()
+            store.close()
+            list_readers += [(experiment, read_database, (source, experiment, columns)) for experiment in experiments]
+        else:
+            experiment = os.path.basename(source).rsplit(".", 1)[0]
+            if experiment.endswith(" - enrichment"):
+                experiment = experiment[:-len(" - enrichment")]
+            list_readers.append((experiment, read_export, (source, columns)))
+
+    return list_readers
+
+
+def read_export(file_path, columns):
+    """
+    read_export : reads the columns needed from a long-format enrichment file
+        inputs:
+            file_path : path of a parquet or feather file written by LongFormatExport
+            columns : enrichment columns needed
+        output:
+            df : long-format enrichment table
+    """
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if file_path.lower().endswith(".parquet"):
+        available = pyarrow.parquet.ParquetFile(file_path).schema_arrow.names
+        read = pyarrow.parquet.read_table
+    else:
+        available = pyarrow.ipc.open_file(file_path).schema.names
+        read = pyarrow.feather.read_table
+    names = KEY_COLUMNS + ["component", "level"] + columns
+    df = read(file_path, columns=[name for name in names if name in available]).to_pandas()
+
+    return df.reindex(columns=names)
+
+
+def read_database(database_path, experiment, columns):
+    """
+    read_database : reads the enrichment rows of one experiment of a results database, on its own connection so
+                    experiments can be read from several threads
+        inputs:
+            database_path : path of the results database
+            experiment : name of the experiment
+            columns : enrichment columns needed
+        output:
+            df : long-format enrichment table
+    """
+    store = ResultsStore(database_path)
+    try:
+        return store.query(experiment=experiment, columns=columns).drop(columns="experiment")
+    finally:
+        store.close()
+
+
+def stream_experiments(list_readers, workers):
+    """
+    stream_experiments : reads experiments on a pool of threads, never more than workers ahead of the one used
+        inputs:
+            list_readers : list of (experiment, function, arguments) from source_readers
+            workers : number of threads
+        output:
+            generator of (experiment, long-format enrichment table), in the order of list_readers
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for experiment, function, arguments in list_readers:
+            pending.append((experiment, executor.submit(function, *arguments)))
+            if len(pending) > workers:
+                experiment_read, future = pending.popleft()
+                yield experiment_read, future.result()
+        while len(pending) != 0:
+            experiment_read, future = pending.popleft()
+            yield experiment_read, future.result()
+
+
+class MetaAnalysis:
+    """
+    MetaAnalysis : running sums of the enrichment of every component level over experiments
+        inputs:
+            weight : "lnps" weighs each experiment by the number of LNPs with the level, "equal" weighs experiments
+                     equally (default = "lnps")
+            p_column : p-values combined with Fisher's method, "p_net", "p_empirical", "p_top" or "p_bottom"
+                       (default = "p_net")
+            scopes : scopes of the rankings combined, sample and mouse rankings are left out by default because their
+                     IDs are not shared between experiments
+    """
+
+    def __init__(self, weight="lnps", p_column="p_net", scopes=("overall", "organ", "cell_type")):
+        if weight not in WEIGHTS:
+            raise ValueError("Weight must be one of " + ", ".join(WEIGHTS) + ", got " + str(weight))
+        self.weight = weight
+        self.p_column = p_column
+        self.scopes = list(scopes)
+        self.list_experiments = []
+        self.df_sums = None
+
+    def columns(self):
+        """
+        columns : enrichment columns read from each experiment
+            output:
+                columns : list of column names
+        """
+        return ["total_count", "net_enrichment", self.p_column]
+
+    def add(self, experiment, df_enrichment):
+        """
+        add : folds the enrichment table of one experiment into the running sums
+            inputs:
+                experiment : name of the experiment
+                df_enrichment : long-format enrichment table of the experiment
+        """
+        df = df_enrichment[df_enrichment["scope"].isin(self.scopes)]
+        groups = df[GROUP_COLUMNS].astype(object).where(df[GROUP_COLUMNS].notna(), "").astype(str)
+
+        lnps = pd.to_numeric(df["total_count"]).to_numpy(dtype=float)
+        net = pd.to_numeric(df["net_enrichment"]).to_numpy(dtype=float)
+        p_values = pd.to_numeric(df[self.p_column]).to_numpy(dtype=float)
+        valid = ~np.isnan(net)
+        weights = np.where(valid, np.nan_to_num(lnps) if self.weight == "lnps" else 1.0, 0)
+        net_valid = np.where(valid, net, 0)
+        tested = ~np.isnan(p_values)
+
+        df_partial = groups.assign(experiments=1, lnps=np.nan_to_num(lnps), weight=weights,
+                                   weighted_sum=weights * net_valid, weighted_squares=weights * net_valid ** 2,
+                                   net_min=net, net_max=net, enriched=(net_valid > 0).astype(int),
+                                   fisher=np.where(tested, -2 * np.log(np.clip(p_values, 1e-300, 1)), 0),
+                                   n_p=tested.astype(int))
+
+        if self.df_sums is not None:
+            df_partial = pd.concat([self.df_sums, df_partial], ignore_index=True)
+        self.df_sums = df_partial.groupby(GROUP_COLUMNS, sort=False).agg(SUMS).reset_index()
+        self.list_experiments.append(experiment)
+
+    def result(self, min_experiments=1):
+        """
+        result : combined enrichment of every component level
+            inputs:
+                min_experiments : levels found in fewer experiments are left out (default = 1)
+            output:
+                df_meta : dataframe with one row per scope, organ, cell type and level, columns GROUP_COLUMNS and
+                          META_COLUMNS
+        """
+        if self.df_sums is None:
+            return pd.DataFrame(columns=GROUP_COLUMNS + META_COLUMNS)
+
+        df = self.df_sums[self.df_sums["experiments"] >= min_experiments]
+        weight = df["weight"].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(weight > 0, df["weighted_sum"] / weight, np.nan)
+            variance = np.where(weight > 0, df["weighted_squares"] / weight - mean ** 2, np.nan)
+
+        df_meta = df[GROUP_COLUMNS].replace("", np.nan)
+        df_meta["experiments"] = df["experiments"].to_numpy()
+        df_meta["coverage"] = df["experiments"].to_numpy() / len(self.list_experiments)
+        df_meta["lnps"] = df["lnps"].to_numpy()
+        df_meta["net_enrichment_mean"] = mean
+        df_meta["net_enrichment_sd"] = np.where(df["experiments"] > 1, np.sqrt(np.maximum(variance, 0)), 0)
+        df_meta["net_enrichment_min"] = df["net_min"].to_numpy()
+        df_meta["net_enrichment_max"] = df["net_max"].to_numpy()
+        df_meta["experiments_enriched"] = df["enriched"].to_numpy()
+        df_meta["p_combined"] = fisher_combined(df["fisher"], df["n_p"])
+
+        # q-values within each ranking, like the q-values of a single run
+        df_meta["q_combined"] = np.nan
+        for _, index in df_meta.groupby(["scope", "organ", "cell_type"], dropna=False, sort=False).groups.items():
+            df_meta.loc[index, "q_combined"] = benjamini_hochberg(df_meta.loc[index, "p_combined"])
+
+        return df_meta.sort_values(["scope", "organ", "cell_type", "component"], kind="stable").reset_index(drop=True)
+
+
+def run_meta_analysis(list_sources, weight="lnps", p_column="p_net", scopes=("overall", "organ", "cell_type"),
+                      min_experiments=1, workers=4):
+    """
+    run_meta_analysis : combines the enrichment of many experiments, read one at a time
+        inputs:
+            list_sources : paths of long-format enrichment files (parquet or feather) and of results databases
+            weight : "lnps" or "equal" (default = "lnps")
+            p_column : p-values combined with Fisher's method (default = "p_net")
+            scopes : scopes of the rankings combined (default = overall, organ and cell type)
+            min_experiments : levels found in fewer experiments are left out (default = 1)
+            workers : number of threads reading experiments (default = 4)
+        output:
+            df_meta : dataframe with the combined enrichment of every level
+            list_experiments : names of the experiments combined
+    """
+    meta_analysis = MetaAnalysis(weight, p_column, scopes)
+    for experiment, df_enrichment in stream_experiments(source_readers(list_sources, meta_analysis.columns()),
+                                                        workers):
+        meta_analysis.add(experiment, df_enrichment)
+
+    return meta_analysis.result(min_experiments), meta_analysis.list_experiments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combines the enrichment of component levels across experiments")
+    parser.add_argument("sources", nargs="+",
+                        help="long-format enrichment files (parquet or feather) or results databases (.db)")
+    parser.add_argument("--output", required=True, help="combined table, an excel (.xlsx) or csv file")
+    parser.add_argument("--weight", choices=WEIGHTS, default="lnps",
+                        help="weigh experiments by the number of LNPs with the level, or equally")
+    parser.add_argument("--p-column", default="p_net", choices=["p_net", "p_empirical", "p_top", "p_bottom"],
+                        help="p-values combined with Fisher's method")
+    parser.add_argument("--scopes", default="overall,organ,cell_type",
+                        help="comma separated scopes of the rankings combined")
+    parser.add_argument("--min-experiments", type=int, default=1, help="leave out levels found in fewer experiments")
+    parser.add_argument("--workers", type=int, default=4, help="number of threads reading experiments")
+    args = parser.parse_args()
+
+    df_result, experiments_combined = run_meta_analysis(args.sources, args.weight, args.p_column,
+                                                        args.scopes.split(","), args.min_experiments, args.workers)
+    if args.output.lower().endswith(".xlsx"):
+        df_result.to_excel(args.output, sheet_name="Meta-Analysis", index=False)
+    else:
+        df_result.to_csv(args.output, index=False)
+    print("Combined " + str(len(experiments_combined)) + " experiments into " + args.output)
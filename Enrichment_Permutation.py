@@ -0,0 +1,165 @@
+# Enrichment_Permutation: empirical p-values of net enrichment factors from random rankings of the LNPs, counted with
+# matrix products of random top/bottom selections and one-hot component matrices, over a pool of processes
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+
+import numpy as np
+
+EMPIRICAL_P_COLUMN = "empirical p"
+CHUNK_PERMUTATIONS = 500  # permutations per task, each task has its own seed so results do not depend on the workers
+MAX_BATCH_CELLS = 2 ** 22  # largest selection matrix (permutations x LNPs) built at once
+
+
+def one_hot_components(df_formulations, dict_components):
+    """
+    one_hot_components : matrix with one row per LNP and one column per level of each component, 1 where the LNP has
+                         the level, the same matching calculate_enrichment does
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            dict_components : a dictionary containing list of all the component mole ratios and types
+        output:
+            one_hot : matrix of floats
+            boundaries : array with the first column of each component
+    """
+    columns = []
+    boundaries = []
+    for component, levels in dict_components.items():
+        boundaries.append(len(columns))
+        for level in levels:
+            if level != "TOTAL":
+                columns.append(df_formulations[component].eq(level).to_numpy())
+
+    return np.array(columns, dtype=float).T.reshape(len(df_formulations), len(columns)), np.array(boundaries)
+
+
+def net_enrichment(top_counts, bottom_counts, total_counts, boundaries):
+    """
+    net_enrichment : net enrichment factors of every level from counts of the levels, fractions are taken within each
+                     component like calculate_enrichment
+        inputs:
+            top_counts : matrix of counts among top performing LNPs, one row per ranking
+            bottom_counts : matrix of counts among bottom performing LNPs, one row per ranking
+            total_counts : array of counts among all LNPs
+            boundaries : array with the first column of each component
+        output:
+            net : matrix of net enrichment factors
+    """
+    def fractions(counts):
+        sums = np.add.reduceat(counts, boundaries, axis=-1)
+        sizes = np.diff(np.append(boundaries, counts.shape[-1]))
+        sums = np.repeat(sums, sizes, axis=-1)
+        return counts / np.where(sums == 0, 1, sums)
+
+    total_fraction = fractions(total_counts)
+    total_fraction = np.where(total_fraction == 0, np.nan, total_fraction)
+
+    return (fractions(top_counts) - fractions(bottom_counts)) / total_fraction
+
+
+def permutation_chunk(one_hot, boundaries, top_size, bottom_start, n_permutations, seed_sequence):
+    """
+    permutation_chunk : net enrichment factors of random rankings of the LNPs
+        inputs:
+            one_hot : one-hot matrix of the components
+            boundaries : array with the first column of each component
+            top_size : number of top performing LNPs
+            bottom_start : rank of the first bottom performing LNP, the bottom goes to the last LNP
+            n_permutations : number of random rankings
+            seed_sequence : numpy SeedSequence of the chunk
+        output:
+            null : matrix of net enrichment factors, one row per random ranking
+    """
+    rng = np.random.default_rng(seed_sequence)
+    n_lnps = len(one_hot)
+    total_counts = one_hot.sum(axis=0)
+    batch = max(1, MAX_BATCH_CELLS // max(n_lnps, 1))
+
+    list_null = []
+    for start in range(0, n_permutations, batch):
+        size = min(batch, n_permutations - start)
+        order = np.argsort(rng.random((size, n_lnps)), axis=1)
+
+        # selection matrices, one row per random ranking, multiplied with the one-hot matrix to count levels
+        selection = np.zeros((2 * size, n_lnps))
+        np.put_along_axis(selection[:size], order[:, :top_size], 1, axis=1)
+        np.put_along_axis(selection[size:], order[:, bottom_start:], 1, axis=1)
+        counts = selection @ one_hot
+
+        list_null.append(net_enrichment(counts[:size], counts[size:], total_counts, boundaries))
+
+    return np.concatenate(list_null)
+
+
+class PermutationTest:
+    """
+    PermutationTest : null distributions of net enrichment factors from random rankings of the LNPs. Rankings of the
+    same formulations with top and bottom sets of the same sizes share a null distribution, which is computed once
+        inputs:
+            n_permutations : number of random rankings
+            seed : seed of the random rankings, the same seed gives the same p-values
+            workers : number of processes computing random rankings, all cores if not given
+    """
+
+    def __init__(self, n_permutations, seed=0, workers=None):
+        self.n_permutations = n_permutations
+        self.seed = seed
+        self.workers = workers
+        self.d_nulls = {}
+
+    def null(self, one_hot, boundaries, top_size, bottom_start):
+        """
+        null : null distribution of net enrichment factors, computed in chunks over a pool of processes
+            inputs:
+                one_hot : one-hot matrix of the components
+                boundaries : array with the first column of each component
+                top_size : number of top performing LNPs
+                bottom_start : rank of the first bottom performing LNP
+            output:
+                null : matrix of net enrichment factors, one row per random ranking
+        """
+        key = (hashlib.sha1(one_hot.tobytes()).hexdigest(), one_hot.shape, tuple(boundaries), top_size, bottom_start)
+        if key not in self.d_nulls:
+            chunks = range(0, self.n_permutations, CHUNK_PERMUTATIONS)
+            seed_sequences = np.random.SeedSequence(self.seed).spawn(len(chunks))
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(permutation_chunk, one_hot, boundaries, top_size, bottom_start,
+                                           min(CHUNK_PERMUTATIONS, self.n_permutations - start), seed_sequence)
+                           for start, seed_sequence in zip(chunks, seed_sequences)]
+                self.d_nulls[key] = np.concatenate([future.result() for future in futures])
+
+        return self.d_nulls[key]
+
+    def empirical_p_values(self, df_formulations, dict_components, top, bottom):
+        """
+        empirical_p_values : two-sided empirical p-values of the net enrichment factors of a ranking, the fraction of
+                             random rankings with a net enrichment factor at least as far from zero
+            inputs:
+                df_formulations : dataframe with formulations sheet, as ranked
+                dict_components : a dictionary containing list of all the component mole ratios and types
+                top : positions of top performing LNPs
+                bottom : positions of bottom performing LNPs, at the end of the ranking
+            output:
+                d_p_values : dictionary with an array of p-values by component, one per level
+        """
+        one_hot, boundaries = one_hot_components(df_formulations, dict_components)
+        null = self.null(one_hot, boundaries, len(top), len(one_hot) - len(bottom))
+
+        observed = net_enrichment(one_hot[top].sum(axis=0), one_hot[bottom].sum(axis=0), one_hot.sum(axis=0),
+                                  boundaries)
+        as_extreme = np.abs(null) >= np.abs(observed) - 1e-12
+        p_values = (1 + as_extreme.sum(axis=0)) / (1 + len(null))
+        p_values = np.where(np.isnan(observed), np.nan, p_values)
+
+        return dict(zip(dict_components, np.split(p_values, boundaries[1:])))
+
+
+def add_empirical_p_column(d_df_net_enrichment, d_p_values):
+    """
+    add_empirical_p_column : adds empirical p-values to tables of net enrichment factors, the TOTAL rows are left empty
+        inputs:
+            d_df_net_enrichment : dictionary with tables of net enrichment factors by component
+            d_p_values : dictionary with an array of p-values by component, one per level
+    """
+    for component, df in d_df_net_enrichment.items():
+        p_values = list(d_p_values[component])
+        df[EMPIRICAL_P_COLUMN] = p_values + [np.nan] * (len(df) - len(p_values))
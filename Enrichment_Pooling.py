@@ -0,0 +1,93 @@
+# Enrichment_Pooling: pools the normalized counts of an injection sequenced over several lanes or runs. Counts files are
+# read on a pool of threads and joined on their barcodes as they arrive, a sample found in several files gets the sum
+# or the mean of its counts, and every sample is renormalized to 100 once all files are pooled
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+POOL_METHODS = ["sum", "mean"]
+
+
+def check_pool_method(method):
+    """
+    check_pool_method : fails before any file is read if the pooling method is unknown
+        inputs:
+            method : "sum" or "mean"
+    """
+    if method not in POOL_METHODS:
+        raise ValueError("Pool method must be one of " + ", ".join(POOL_METHODS) + ", got " + str(method))
+
+
+def read_counts_file(csv_filepath, sample_columns):
+    """
+    read_counts_file : reads the barcodes and sample columns of a csv file of normalized counts
+        inputs:
+            csv_filepath : file path to csv file, the first column holds the barcodes
+            sample_columns : function giving the names of the sample columns from the names of the csv columns
+        output:
+            df_counts : dataframe of counts indexed by barcode, missing counts are 0 and repeated barcodes are added
+    """
+    columns = pd.read_csv(csv_filepath, sep=',', header=0, nrows=0).columns.tolist()
+    list_samples = sample_columns(columns)
+    df_counts = pd.read_csv(csv_filepath, sep=',', header=0, usecols=[columns[0]] + list_samples,
+                            index_col=columns[0])[list_samples].fillna(0).astype(float)
+    df_counts.index.name = "BC"
+
+    if not df_counts.index.is_unique:
+        df_counts = df_counts.groupby(level=0, sort=False).sum()
+    return df_counts
+
+
+def read_counts_files(list_csv_files, sample_columns, workers):
+    """
+    read_counts_files : reads csv files of normalized counts on a pool of threads, never more than workers files
+                        ahead of the one used
+        inputs:
+            list_csv_files : file paths to csv files of normalized counts
+            sample_columns : function giving the names of the sample columns from the names of the csv columns
+            workers : number of threads
+        output:
+            generator of dataframes of counts indexed by barcode, in the order of list_csv_files
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for csv_filepath in list_csv_files:
+            pending.append(executor.submit(read_counts_file, csv_filepath, sample_columns))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while len(pending) != 0:
+            yield pending.popleft().result()
+
+
+def pool_counts(list_csv_files, sample_columns, method="sum", workers=None):
+    """
+    pool_counts : joins the normalized counts of several csv files on their barcodes, a file at a time in the order
+                  given, while the next files are read. A barcode missing from a file has no counts in it
+        inputs:
+            list_csv_files : file paths to csv files of normalized counts
+            sample_columns : function giving the names of the sample columns from the names of the csv columns
+            method : "sum" adds the counts of a sample found in several files, "mean" averages them over the files
+                     that have the sample (default = "sum")
+            workers : number of threads reading files, one per file up to 8 if not given
+        output:
+            df_norm_counts : dataframe with a BC column and one column per sample, each sample sums to 100
+    """
+    check_pool_method(method)
+    workers = workers or min(len(list_csv_files), 8)
+
+    df_pooled = None
+    files_by_sample = pd.Series(dtype=float)
+    for df_counts in read_counts_files(list_csv_files, sample_columns, workers):
+        # hash join on the barcodes, only the running sums are kept
+        df_pooled = df_counts if df_pooled is None else df_pooled.add(df_counts, fill_value=0)
+        files_by_sample = files_by_sample.add(pd.Series(1.0, index=df_counts.columns), fill_value=0)
+
+    df_pooled = df_pooled.fillna(0)
+    if method == "mean":
+        df_pooled = df_pooled / files_by_sample[df_pooled.columns]
+
+    sums = df_pooled.sum(axis=0)
+    df_pooled = df_pooled / sums.where(sums != 0, 1) * 100
+
+    return df_pooled.reset_index()
@@ -0,0 +1,179 @@
+# Enrichment_Rarefaction: robustness of the cell type rankings to sequencing depth. Raw counts of every sample are
+# subsampled to a depth with multinomial draws, renormalized like renormalize_counts, and the top and bottom performing
+# LNPs of every draw are compared with those of the full raw counts. Draws are ranked together and run over a pool of
+# processes
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Enrichment_Permutation import one_hot_components
+from Enrichment_Sensitivity import ranked_net_enrichment
+
+CHUNK_DRAWS = 10  # draws per task, each task has its own seed so results do not depend on the workers
+RAREFACTION_COLUMNS = ["Cell type", "Depth", "Draws", "Mice below depth", "Top Jaccard mean", "Top Jaccard min",
+                       "Bottom Jaccard mean", "Bottom Jaccard min", "Mean |net change|"]
+
+
+def subsample_counts(raw, depth, n_draws, rng):
+    """
+    subsample_counts : multinomial subsamples of the raw counts of every sample, each drawn n_draws times at once
+        inputs:
+            raw : matrix of raw counts, one row per barcode and one column per sample
+            depth : number of reads drawn from each sample
+            n_draws : number of subsamples
+            rng : numpy Generator
+        output:
+            draws : array of counts, one matrix like raw per subsample
+    """
+    draws = np.zeros((n_draws,) + raw.shape)
+    totals = raw.sum(axis=0)
+    for col in range(raw.shape[1]):
+        if totals[col] > 0:
+            draws[:, :, col] = rng.multinomial(depth, raw[:, col] / totals[col], size=n_draws)
+
+    return draws
+
+
+def cell_type_averages(counts, rows, d_columns):
+    """
+    cell_type_averages : counts of the LNPs renormalized to 100 in every sample, like renormalize_counts, and averaged
+                         over the mice of each cell type
+        inputs:
+            counts : array of counts, one matrix (barcodes x samples) per draw
+            rows : positions of the LNPs among the barcodes
+            d_columns : dictionary with the positions of the samples of each cell type
+        output:
+            d_values : dictionary with a matrix of averages by cell type, one column per draw
+    """
+    counts = counts[:, rows, :]
+    sums = counts.sum(axis=1, keepdims=True)
+    norm = counts / np.where(sums == 0, np.nan, sums) * 100
+
+    return {cell_type: norm[:, :, columns].mean(axis=2).T for cell_type, columns in d_columns.items()}
+
+
+def jaccard(positions, reference):
+    """
+    jaccard : overlap of sets of LNPs with a reference set, the size of the intersection over the size of the union
+        inputs:
+            positions : matrix of positions of LNPs, one row per set
+            reference : array of positions of the reference LNPs
+        output:
+            overlaps : array of overlaps, one per set
+    """
+    intersection = np.isin(positions, reference).sum(axis=1)
+    union = positions.shape[1] + len(reference) - intersection
+    return intersection / np.where(union == 0, np.nan, union)
+
+
+def rarefaction_chunk(raw, rows, d_columns, one_hot, boundaries, d_reference, depth, n_draws, x_percent,
+                      number_naked_bcs, seed_sequence):
+    """
+    rarefaction_chunk : stability of the rankings of every cell type over subsamples of the raw counts at one depth
+        inputs:
+            raw : matrix of raw counts, one row per barcode and one column per sample
+            rows : positions of the LNPs among the barcodes
+            d_columns : dictionary with the positions of the samples of each cell type
+            one_hot : one-hot matrix of the components of the LNPs
+            boundaries : array with the first column of each component
+            d_reference : dictionary with (net, top, bottom) of the full raw counts by cell type
+            depth : number of reads drawn from each sample
+            n_draws : number of subsamples
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            seed_sequence : numpy SeedSequence of the chunk
+        output:
+            d_stability : dictionary with a matrix by cell type, one row per draw with the Jaccard overlap of the top
+                          and of the bottom performing LNPs and the mean absolute change of the net enrichment factors
+    """
+    rng = np.random.default_rng(seed_sequence)
+    d_values = cell_type_averages(subsample_counts(raw, depth, n_draws, rng), rows, d_columns)
+
+    d_stability = {}
+    for cell_type, values in d_values.items():
+        reference_net, reference_top, reference_bottom = d_reference[cell_type]
+        net, tops, bottoms = ranked_net_enrichment(one_hot, boundaries, values, x_percent, number_naked_bcs)
+        change = np.abs(net - reference_net)
+        change = np.where(np.isnan(change), 0, change).sum(axis=1) / max((~np.isnan(reference_net)).sum(), 1)
+        d_stability[cell_type] = np.column_stack([jaccard(tops, reference_top), jaccard(bottoms, reference_bottom),
+                                                  change])
+
+    return d_stability
+
+
+class RarefactionTest:
+    """
+    RarefactionTest : how stable the top and bottom performing LNPs of each cell type are when the raw counts are
+    subsampled to lower sequencing depths
+        inputs:
+            depths : list of numbers of reads drawn from each sample, the smallest depth of the mice if not given
+            n_draws : number of subsamples at each depth
+            seed : seed of the subsamples, the same seed gives the same report
+            workers : number of processes computing subsamples, all cores if not given
+    """
+
+    def __init__(self, depths=None, n_draws=100, seed=0, workers=None):
+        self.depths = depths
+        self.n_draws = n_draws
+        self.seed = seed
+        self.workers = workers
+
+    def stability(self, df_merged, df_raw_counts, dict_components, d_samples_by_cell_type, x_percent,
+                  number_naked_bcs):
+        """
+        stability : report of the stability of the ranking of every cell type at every depth
+            inputs:
+                df_merged : dataframe containing formulation information and normalized counts
+                df_raw_counts : dataframe with raw counts, barcodes in the BC column and one column per sample
+                dict_components : a dictionary containing list of all the component mole ratios and types
+                d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+                x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+                number_naked_bcs : user specified number of naked barcodes
+            output:
+                df_report : dataframe with one row per cell type and depth, columns RAREFACTION_COLUMNS
+        """
+        samples = [sample for list_samples in d_samples_by_cell_type.values() for sample in list_samples]
+        missing = [sample for sample in samples if sample not in df_raw_counts.columns]
+        if len(missing) != 0:
+            raise ValueError("Raw counts are missing samples: " + ", ".join(missing))
+
+        barcode_rows = pd.Series(range(len(df_raw_counts)), index=df_raw_counts["BC"])
+        missing = [barcode for barcode in df_merged["BC"] if barcode not in barcode_rows.index]
+        if len(missing) != 0:
+            raise ValueError("Raw counts are missing barcodes: " + ", ".join(str(barcode) for barcode in missing))
+
+        raw = df_raw_counts[samples].fillna(0).to_numpy(dtype=float)
+        rows = barcode_rows[df_merged["BC"]].to_numpy()
+        d_columns = {}
+        for cell_type, list_samples in d_samples_by_cell_type.items():
+            if len(list_samples) != 0:
+                d_columns[cell_type] = [samples.index(sample) for sample in list_samples]
+
+        one_hot, boundaries = one_hot_components(df_merged, dict_components)
+        d_reference = {}
+        for cell_type, values in cell_type_averages(raw[np.newaxis], rows, d_columns).items():
+            net, tops, bottoms = ranked_net_enrichment(one_hot, boundaries, values, x_percent, number_naked_bcs)
+            d_reference[cell_type] = (net[0], tops[0], bottoms[0])
+
+        sample_depths = raw.sum(axis=0)
+        depths = self.depths or [int(sample_depths.min())]
+        chunks = [(depth, start) for depth in depths for start in range(0, self.n_draws, CHUNK_DRAWS)]
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(len(chunks))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(rarefaction_chunk, raw, rows, d_columns, one_hot, boundaries, d_reference,
+                                       depth, min(CHUNK_DRAWS, self.n_draws - start), x_percent, number_naked_bcs,
+                                       seed_sequence)
+                       for (depth, start), seed_sequence in zip(chunks, seed_sequences)]
+            list_results = [future.result() for future in futures]
+
+        report = []
+        for depth in depths:
+            results = [result for (chunk_depth, _), result in zip(chunks, list_results) if chunk_depth == depth]
+            for cell_type, columns in d_columns.items():
+                stability = np.concatenate([result[cell_type] for result in results])
+                report.append([cell_type, depth, len(stability), int((sample_depths[columns] < depth).sum()),
+                               np.nanmean(stability[:, 0]), np.nanmin(stability[:, 0]), np.nanmean(stability[:, 1]),
+                               np.nanmin(stability[:, 1]), np.nanmean(stability[:, 2])])
+
+        return pd.DataFrame(report, columns=RAREFACTION_COLUMNS)
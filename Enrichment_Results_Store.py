@@ -0,0 +1,186 @@
+# Enrichment_Results_Store: SQLite database collecting the enrichment tables of every run, so a component level can be
+# compared across experiments without opening their workbooks. Experiments, rankings and component levels have their
+# own tables and every enrichment row points to one ranking and one level
+import sqlite3
+import time
+
+import pandas as pd
+
+ENRICHMENT_COLUMNS = ["total_count", "total_fraction", "top_count", "top_fraction", "enrichment_top", "bottom_count",
+                      "bottom_fraction", "depletion_bottom", "net_enrichment", "p_top", "q_top", "p_bottom", "q_bottom",
+                      "p_net", "q_net", "weighted_enrichment", "p_weighted_enrichment", "running_sum",
+                      "p_running_sum", "p_empirical", "ci_low", "ci_high"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    workbook TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS rankings (
+    id INTEGER PRIMARY KEY,
+    experiment_id INTEGER NOT NULL REFERENCES experiments(id),
+    scope TEXT NOT NULL,
+    organ TEXT,
+    cell_type TEXT,
+    sample TEXT
+);
+CREATE TABLE IF NOT EXISTS levels (
+    id INTEGER PRIMARY KEY,
+    component TEXT NOT NULL,
+    level TEXT NOT NULL,
+    UNIQUE (component, level)
+);
+CREATE TABLE IF NOT EXISTS enrichment (
+    level_id INTEGER NOT NULL REFERENCES levels(id),
+    ranking_id INTEGER NOT NULL REFERENCES rankings(id),
+    """ + ",\n    ".join(column + " REAL" for column in ENRICHMENT_COLUMNS) + """,
+    PRIMARY KEY (level_id, ranking_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rankings_experiment ON rankings (experiment_id);
+CREATE INDEX IF NOT EXISTS rankings_organ_cell_type ON rankings (organ, cell_type);
+CREATE INDEX IF NOT EXISTS rankings_cell_type ON rankings (cell_type);
+CREATE INDEX IF NOT EXISTS enrichment_ranking ON enrichment (ranking_id);
+"""
+
+
+class ResultsStore:
+    """
+    ResultsStore : SQLite database of the enrichment tables of many runs
+        inputs:
+            database_path : path of the database file, created if it does not exist
+    """
+
+    def __init__(self, database_path):
+        self.connection = sqlite3.connect(database_path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """
+        close : closes the database
+        """
+        self.connection.close()
+
+    def add_run(self, experiment, df_enrichment, workbook=None):
+        """
+        add_run : adds the enrichment tables of a run, replacing the tables of an experiment of the same name
+            inputs:
+                experiment : name of the experiment
+                df_enrichment : long-format enrichment table of LongFormatExport
+                workbook : path of the workbook of the run (optional input)
+        """
+        with self.connection:
+            self.delete_rows(experiment)
+            experiment_id = self.connection.execute(
+                "INSERT INTO experiments (name, workbook, created) VALUES (?, ?, ?)",
+                (experiment, workbook, time.time())).lastrowid
+
+            # one row per ranking and per level, the enrichment rows refer to them
+            keys = ["scope", "organ", "cell_type", "sample"]
+            df_rankings = df_enrichment[keys].drop_duplicates()
+            ranking_ids = {}
+            for row in df_rankings.itertuples(index=False):
+                values = tuple(None if pd.isna(value) else value for value in row)
+                ranking_ids[values] = self.connection.execute(
+                    "INSERT INTO rankings (experiment_id, scope, organ, cell_type, sample) VALUES (?, ?, ?, ?, ?)",
+                    (experiment_id,) + values).lastrowid
+
+            df_levels = df_enrichment[["component", "level"]].astype(str).drop_duplicates()
+            self.connection.executemany("INSERT OR IGNORE INTO levels (component, level) VALUES (?, ?)",
+                                        df_levels.itertuples(index=False))
+            level_ids = {(component, level): level_id for level_id, component, level in
+                         self.connection.execute("SELECT id, component, level FROM levels")}
+
+            df = df_enrichment.reindex(columns=keys + ["component", "level"] + ENRICHMENT_COLUMNS)
+            ranking_column = [ranking_ids[tuple(None if pd.isna(value) else value for value in row)]
+                              for row in df[keys].itertuples(index=False)]
+            level_column = [level_ids[(str(component), str(level))]
+                            for component, level in zip(df["component"], df["level"])]
+            values = df[ENRICHMENT_COLUMNS].astype(float)
+            rows = zip(level_column, ranking_column,
+                       *[[None if pd.isna(value) else value for value in values[column]] for column in
+                         ENRICHMENT_COLUMNS])
+            self.connection.executemany("INSERT OR REPLACE INTO enrichment (level_id, ranking_id, " +
+                                        ", ".join(ENRICHMENT_COLUMNS) + ") VALUES (" +
+                                        ", ".join(["?"] * (len(ENRICHMENT_COLUMNS) + 2)) + ")", rows)
+
+    def delete_experiment(self, experiment):
+        """
+        delete_experiment : removes an experiment and its tables
+            inputs:
+                experiment : name of the experiment
+        """
+        with self.connection:
+            self.delete_rows(experiment)
+
+    def delete_rows(self, experiment):
+        """
+        delete_rows : deletes the rows of an experiment in the transaction of the caller
+            inputs:
+                experiment : name of the experiment
+        """
+        self.connection.execute("DELETE FROM enrichment WHERE ranking_id IN (SELECT rankings.id FROM rankings "
+                                "JOIN experiments ON experiments.id = rankings.experiment_id "
+                                "WHERE experiments.name = ?)", (experiment,))
+        self.connection.execute("DELETE FROM rankings WHERE experiment_id IN (SELECT id FROM experiments "
+                                "WHERE name = ?)", (experiment,))
+        self.connection.execute("DELETE FROM experiments WHERE name = ?", (experiment,))
+
+    def experiments(self):
+        """
+        experiments : experiments of the database
+            output:
+                df_experiments : dataframe with the name, workbook and creation time of every experiment
+        """
+        return pd.read_sql_query("SELECT name, workbook, created FROM experiments ORDER BY name", self.connection)
+
+    def query(self, component=None, level=None, organ=None, cell_type=None, scope=None, experiment=None,
+              columns=None):
+        """
+        query : enrichment rows matching every filter given, across experiments
+            inputs:
+                component : name of the component (optional input)
+                level : level of the component, compared as text like in the workbooks (optional input)
+                organ : organ of the rankings (optional input)
+                cell_type : cell type of the rankings (optional input)
+                scope : "overall", "organ", "cell_type", "sample" or "mouse" (optional input)
+                experiment : name of the experiment (optional input)
+                columns : enrichment columns returned, all if not given (optional input)
+            output:
+                df : dataframe with the experiment, ranking, component, level and enrichment columns
+        """
+        columns = columns or ENRICHMENT_COLUMNS
+        unknown = [column for column in columns if column not in ENRICHMENT_COLUMNS]
+        if len(unknown) != 0:
+            raise ValueError("Unknown enrichment columns: " + ", ".join(unknown))
+
+        filters = [("levels.component", component), ("levels.level", None if level is None else str(level)),
+                   ("rankings.organ", organ), ("rankings.cell_type", cell_type), ("rankings.scope", scope),
+                   ("experiments.name", experiment)]
+        conditions = [name + " = ?" for name, value in filters if value is not None]
+        sql = ("SELECT experiments.name AS experiment, rankings.scope, rankings.organ, rankings.cell_type, "
+               "rankings.sample, levels.component, levels.level, " +
+               ", ".join("enrichment." + column for column in columns) +
+               " FROM enrichment JOIN levels ON levels.id = enrichment.level_id"
+               " JOIN rankings ON rankings.id = enrichment.ranking_id"
+               " JOIN experiments ON experiments.id = rankings.experiment_id" +
+               (" WHERE " + " AND ".join(conditions) if len(conditions) != 0 else "") +
+               " ORDER BY experiments.name, rankings.scope, rankings.organ, rankings.cell_type, rankings.sample")
+
+        return pd.read_sql_query(sql, self.connection, params=[value for _, value in filters if value is not None])
+
+    def net_enrichment(self, component, level, organ=None, cell_type=None, scope=None):
+        """
+        net_enrichment : net enrichment factors of a component level across all experiments
+            inputs:
+                component : name of the component
+                level : level of the component
+                organ : organ of the rankings (optional input)
+                cell_type : cell type of the rankings (optional input)
+                scope : "overall", "organ", "cell_type", "sample" or "mouse" (optional input)
+            output:
+                df : dataframe with one row per experiment and ranking
+        """
+        return self.query(component, level, organ, cell_type, scope,
+                          columns=["net_enrichment", "enrichment_top", "depletion_bottom", "p_net", "q_net"])
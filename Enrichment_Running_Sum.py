@@ -0,0 +1,106 @@
+# Enrichment_Running_Sum: threshold-free enrichment of component levels along rankings, the running-sum (Kolmogorov-
+# Smirnov) score used by gene set enrichment analysis, computed with cumulative sums over rank-ordered one-hot matrices
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from Enrichment_Permutation import EMPIRICAL_P_COLUMN, one_hot_components
+
+RUNNING_SUM_TITLE = "Running-Sum Enrichment"
+MAX_BATCH_CELLS = 2 ** 24  # largest rank-ordered one-hot array (rankings x LNPs x levels) built at once
+
+
+def running_sum_scores(one_hot, orders):
+    """
+    running_sum_scores : running-sum score of every level along every ranking. Walking down a ranking the sum goes up
+                         at the LNPs with the level and down at the others, the score is its largest deviation from
+                         zero, positive when the level is found among the best performing LNPs
+        inputs:
+            one_hot : one-hot matrix of the components, one row per LNP
+            orders : matrix of positions of the LNPs from best to worst, one row per ranking
+        output:
+            scores : matrix of scores, one row per ranking and one column per level, NaN for levels held by all or no
+                     LNPs
+    """
+    orders = np.asarray(orders, dtype=int).reshape(-1, one_hot.shape[0])
+    n_lnps, n_levels = one_hot.shape
+    n_hits = one_hot.sum(axis=0)
+    hit_step = 1 / np.where(n_hits == 0, 1, n_hits)
+    miss_step = 1 / np.where(n_hits == n_lnps, 1, n_lnps - n_hits)
+
+    scores = np.empty((len(orders), n_levels))
+    batch = max(1, MAX_BATCH_CELLS // max(n_lnps * n_levels, 1))
+    for start in range(0, len(orders), batch):
+        indicator = one_hot[orders[start:start + batch]]
+        running = np.cumsum(indicator * (hit_step + miss_step) - miss_step, axis=1)
+        largest = np.abs(running).argmax(axis=1)
+        scores[start:start + batch] = np.take_along_axis(running, largest[:, np.newaxis, :], axis=1)[:, 0, :]
+
+    scores[:, (n_hits == 0) | (n_hits == n_lnps)] = np.nan
+    return scores
+
+
+class RunningSumTest:
+    """
+    RunningSumTest : running-sum scores of rankings and their empirical p-values from a pool of random rankings. The
+    pool is shared by every ranking of the same formulations and computed once
+        inputs:
+            n_permutations : number of random rankings of the pool, no p-values if 0
+            seed : seed of the random rankings, the same seed gives the same p-values
+    """
+
+    def __init__(self, n_permutations=0, seed=0):
+        self.n_permutations = n_permutations
+        self.seed = seed
+        self.d_nulls = {}
+
+    def null(self, one_hot):
+        """
+        null : running-sum scores of random rankings of the LNPs
+            inputs:
+                one_hot : one-hot matrix of the components
+            output:
+                null : matrix of scores, one row per random ranking
+        """
+        key = (hashlib.sha1(one_hot.tobytes()).hexdigest(), one_hot.shape)
+        if key not in self.d_nulls:
+            rng = np.random.default_rng(np.random.SeedSequence(self.seed))
+            orders = np.argsort(rng.random((self.n_permutations, len(one_hot))), axis=1)
+            self.d_nulls[key] = running_sum_scores(one_hot, orders)
+
+        return self.d_nulls[key]
+
+    def tables(self, views, dict_components):
+        """
+        tables : running-sum enrichment tables of rankings of the same formulations, all scored at once
+            inputs:
+                views : list of RankedView sharing their formulations
+                dict_components : a dictionary containing list of all the component mole ratios and types
+            output:
+                list_tables : list with a dictionary of tables by component for each view, with the score and, when
+                              there is a pool of random rankings, its two-sided empirical p-value
+        """
+        one_hot, boundaries = one_hot_components(views[0].df_formulations, dict_components)
+        scores = running_sum_scores(one_hot, np.array([view.order for view in views]))
+
+        p_values = None
+        if self.n_permutations > 0:
+            null = np.abs(self.null(one_hot))
+            p_values = np.array([(1 + (null >= np.abs(row) - 1e-12).sum(axis=0)) / (1 + len(null)) for row in scores])
+            p_values = np.where(np.isnan(scores), np.nan, p_values)
+
+        sizes = np.diff(np.append(boundaries, one_hot.shape[1]))
+        list_tables = []
+        for index, view in enumerate(views):
+            d_tables = {}
+            for component, start, size in zip(dict_components, boundaries, sizes):
+                levels = [level for level in dict_components[component] if level != "TOTAL"]
+                df = pd.DataFrame({component: levels + ["TOTAL"],
+                                   view.sort_by: list(np.round(scores[index, start:start + size], 9)) + [np.nan]})
+                if p_values is not None:
+                    df[EMPIRICAL_P_COLUMN] = list(p_values[index, start:start + size]) + [np.nan]
+                d_tables[component] = df
+            list_tables.append(d_tables)
+
+        return list_tables
@@ -0,0 +1,99 @@
+# Enrichment_Sensitivity: leave-one-mouse-out sensitivity of the cell type rankings, the averages without each mouse are
+# taken from the sum of all mice minus that mouse, and every average is ranked and counted at once
+import math
+
+import numpy as np
+import pandas as pd
+
+from Enrichment_Permutation import net_enrichment, one_hot_components
+
+
+def ranked_net_enrichment(one_hot, boundaries, values, x_percent, number_naked_bcs):
+    """
+    ranked_net_enrichment : net enrichment factors of rankings by each column of values, top and bottom performing
+                            LNPs selected as in top_and_bottom_percent
+        inputs:
+            one_hot : one-hot matrix of the components
+            boundaries : array with the first column of each component
+            values : matrix of normalized counts, one column per ranking
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+        output:
+            net : matrix of net enrichment factors, one row per ranking
+            tops : matrix of positions of the top performing LNPs, one row per ranking
+            bottoms : matrix of positions of the bottom performing LNPs, one row per ranking
+    """
+    n_lnps = len(one_hot)
+    total_lnp = n_lnps - number_naked_bcs
+    values_x_percent = math.ceil(total_lnp * (x_percent / 100))
+
+    # NaN last, like sort_values
+    orders = np.argsort(-np.where(np.isnan(values), -np.inf, values), axis=0, kind="stable").T
+    tops = orders[:, :values_x_percent]
+    bottoms = orders[:, total_lnp - values_x_percent:]
+
+    net = net_enrichment(one_hot[tops].sum(axis=1), one_hot[bottoms].sum(axis=1), one_hot.sum(axis=0), boundaries)
+    return net, tops, bottoms
+
+
+def leave_one_out(df_formulations, dict_components, df_samples, x_percent, number_naked_bcs):
+    """
+    leave_one_out : how much each mouse drives the average ranking of a cell type. The average without each mouse is
+    the sum of all mice minus that mouse over the mice with counts, every average is re-ranked and its net enrichment
+    factors compared with those of the average of all mice
+        inputs:
+            df_formulations : dataframe with formulations sheet, aligned with df_samples
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            df_samples : dataframe with the normalized counts of each mouse of the cell type
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+        output:
+            df_influence : dataframe with one row per mouse, the mean and largest absolute change of the net
+                           enrichment factors without it, the level that changes most and the share of top performing
+                           LNPs kept
+            df_changes : dataframe with one row per mouse and level, the net enrichment factors with all mice and
+                         without the mouse
+    """
+    samples = df_samples.columns.tolist()
+    block = df_samples.to_numpy(dtype=float)
+    present = ~np.isnan(block)
+    total = np.nansum(block, axis=1)
+    counts = present.sum(axis=1)
+
+    # incremental aggregates: the average of all mice, then each mouse subtracted from the sum. Missing counts are
+    # left out like in the mean of avg_cell_type, an LNP without counts in the mice kept has no average
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = np.column_stack([np.where(counts != 0, total / counts, np.nan)] +
+                                 [np.where(counts - present[:, col] != 0,
+                                           (total - np.where(present[:, col], block[:, col], 0)) /
+                                           (counts - present[:, col]), np.nan)
+                                  for col in range(len(samples))])
+
+    one_hot, boundaries = one_hot_components(df_formulations, dict_components)
+    net, tops, _ = ranked_net_enrichment(one_hot, boundaries, values, x_percent, number_naked_bcs)
+    changes = net[1:] - net[0]
+
+    list_levels = []
+    for component in dict_components:
+        list_levels += [(component, level) for level in dict_components[component] if level != "TOTAL"]
+
+    rows = []
+    for index, sample in enumerate(samples):
+        change = np.abs(changes[index])
+        largest = int(np.nanargmax(change)) if not np.all(np.isnan(change)) else None
+        kept = len(np.intersect1d(tops[0], tops[index + 1])) / tops.shape[1] if tops.shape[1] != 0 else np.nan
+        rows.append([sample, np.nanmean(change) if largest is not None else np.nan,
+                     change[largest] if largest is not None else np.nan,
+                     list_levels[largest][0] if largest is not None else None,
+                     list_levels[largest][1] if largest is not None else None, kept])
+    df_influence = pd.DataFrame(rows, columns=["Mouse left out", "Mean |change|", "Largest |change|", "Component",
+                                               "Level", "Top kept"])
+
+    df_changes = pd.DataFrame({"Mouse left out": np.repeat(samples, len(list_levels)),
+                               "Component": [component for component, _ in list_levels] * len(samples),
+                               "Level": [level for _, level in list_levels] * len(samples),
+                               "Net, all mice": np.tile(net[0], len(samples)),
+                               "Net, left out": net[1:].ravel(),
+                               "Change": changes.ravel()})
+
+    return df_influence, df_changes
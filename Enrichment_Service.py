@@ -0,0 +1,437 @@
+# Enrichment_Service: local HTTP service running enrichment analyses for everyone using a workstation. Jobs take the
+# parameters of run_enrichment_analysis as JSON, wait in one queue and run on a bounded pool of worker processes that
+# have already imported the analysis, with endpoints to follow, cancel and download them. A job with the same input
+# files and parameters as an earlier job gets the files of the earlier one from the result cache of Enrichment_Job
+#
+#     POST /jobs                  submit a job, returns its id
+#     GET  /jobs                  status of every job
+#     GET  /jobs/<id>             status of a job
+#     POST /jobs/<id>/cancel      cancel a queued or running job
+#     GET  /jobs/<id>/result      zip file with the workbooks and exports of a finished job
+import argparse
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from urllib import error, request
+import uuid
+import zipfile
+
+DEFAULT_PORT = 8765
+RESULT_PREFIX = "Whole Enrichment Analysis"  # name of the workbooks written by create_excel_spreadsheet
+POLL_SECONDS = 0.5
+CACHE_INDEX = ".enrichment_cache.json"  # index of the result cache of Enrichment_Job, in the jobs folder
+
+
+def job_parameters(params, jobs_folder, job_id):
+    """
+    job_parameters : checks that a job has the required parameters of run_enrichment_analysis, unknown parameters are
+                     caught by the worker that has it imported, jobs without destination folder write to their own
+                     folder
+        inputs:
+            params : dictionary of parameters sent by the client
+            jobs_folder : folder of the service where jobs without destination folder write
+            job_id : id of the job
+        output:
+            params : dictionary of parameters ready for run_enrichment_analysis
+    """
+    if not isinstance(params, dict):
+        raise ValueError("A job must be a JSON object with the parameters of run_enrichment_analysis")
+
+    params = dict(params)
+    if params.get("destination_folder") is None:
+        params["destination_folder"] = os.path.join(jobs_folder, job_id)
+        os.makedirs(params["destination_folder"], exist_ok=True)
+    params.setdefault("file_id", "")
+
+    required = ["destination_folder", "file_id", "formulations_sheet", "csv_filepath", "sorted_cells",
+                "number_naked_bcs", "x_percent", "sample_numbers", "remove_outlying_mouse", "r2_threshold",
+                "remove_runaways", "percentile"]
+    missing = [name for name in required if name not in params]
+    if len(missing) != 0:
+        raise ValueError("Missing parameters: " + ", ".join(missing))
+
+    return params
+
+
+def worker_loop(connection, cache_index=None):
+    """
+    worker_loop : body of a worker process, imports the analysis once and runs the jobs it receives until it gets None,
+                  a job with the same inputs and parameters as an earlier one gets the files of the earlier one
+        inputs:
+            connection : end of the pipe shared with the service
+            cache_index : path of the index of the result cache, no cache if not given
+    """
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()  # cancelling a job stops the processes the analysis started too
+
+    import Whole_Enrichment  # pylint: disable=import-outside-toplevel
+    from Enrichment_Job import run_job  # pylint: disable=import-outside-toplevel
+
+    signature = inspect.signature(Whole_Enrichment.run_enrichment_analysis)
+    connection.send(("ready", None, None))
+    while True:
+        params = connection.recv()
+        if params is None:
+            return
+
+        log = io.StringIO()
+        try:
+            unknown = [name for name in params if name not in signature.parameters]
+            if len(unknown) != 0:
+                raise ValueError("Unknown parameters: " + ", ".join(unknown))
+            with redirect_stdout(log):
+                list_files, cached = run_job(params, cache_index)
+                if cached:
+                    print("Found in the cache, no analysis was run")
+            connection.send(("done", list_files, log.getvalue()))
+        except Exception:  # pylint: disable=broad-except
+            connection.send(("failed", traceback.format_exc(), log.getvalue()))
+
+
+class Worker:
+    """
+    Worker : a warm worker process and the pipe to it
+        inputs:
+            cache_index : path of the index of the result cache, no cache if not given
+    """
+
+    def __init__(self, cache_index=None):
+        self.connection, child_connection = multiprocessing.Pipe()
+        # not a daemon, the analysis starts its own process pools
+        self.process = multiprocessing.Process(target=worker_loop, args=(child_connection, cache_index),
+                                               daemon=False)
+        self.process.start()
+        self.connection.recv()  # waits until the analysis is imported
+
+    def stop(self):
+        """
+        stop : stops the worker process and every process it started
+        """
+        if self.process.is_alive():
+            if hasattr(os, "killpg"):
+                try:
+                    os.killpg(self.process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            else:
+                self.process.terminate()
+        self.process.join()
+
+
+class EnrichmentService:
+    """
+    EnrichmentService : queue of enrichment jobs run by a bounded pool of warm worker processes
+        inputs:
+            jobs_folder : folder where jobs without destination folder write
+            workers : number of jobs run at the same time (default = 1)
+    """
+
+    def __init__(self, jobs_folder, workers=1):
+        self.jobs_folder = jobs_folder
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        os.makedirs(jobs_folder, exist_ok=True)
+
+        self.cache_index = os.path.join(jobs_folder, CACHE_INDEX)
+        self.workers = [Worker(self.cache_index) for _ in range(workers)]
+        for slot in range(workers):
+            threading.Thread(target=self.run_worker, args=(slot,), daemon=True).start()
+
+    def submit(self, params):
+        """
+        submit : adds a job at the end of the queue
+            inputs:
+                params : dictionary of parameters of run_enrichment_analysis
+            output:
+                job : status of the job
+        """
+        job_id = uuid.uuid4().hex[:12]
+        params = job_parameters(params, self.jobs_folder, job_id)
+        with self.lock:
+            self.jobs[job_id] = {"id": job_id, "status": "queued", "params": params, "submitted": time.time(),
+                                 "started": None, "finished": None, "files": [], "error": None, "log": ""}
+        self.queue.put(job_id)
+        return self.status(job_id)
+
+    def status(self, job_id=None):
+        """
+        status : status of a job, or of every job
+            inputs:
+                job_id : id of the job, every job if not given
+            output:
+                job : dictionary with the status of the job, or list of them
+        """
+        with self.lock:
+            if job_id is None:
+                return [dict(job) for job in self.jobs.values()]
+            if job_id not in self.jobs:
+                raise KeyError(job_id)
+            job = dict(self.jobs[job_id])
+            if job["status"] == "queued":
+                job["position"] = [queued_id for queued_id in list(self.queue.queue)
+                                   if self.jobs[queued_id]["status"] == "queued"].index(job_id) + 1
+        return job
+
+    def cancel(self, job_id):
+        """
+        cancel : cancels a queued job, or stops a running one
+            inputs:
+                job_id : id of the job
+            output:
+                job : status of the job
+        """
+        with self.lock:
+            job = self.jobs[job_id]
+            if job["status"] in ["queued", "running"]:
+                job["status"] = "cancelling" if job["status"] == "running" else "cancelled"
+        return self.status(job_id)
+
+    def run_worker(self, slot):
+        """
+        run_worker : takes jobs from the queue and runs them on one warm worker process, restarted after a cancel
+            inputs:
+                slot : position of the worker in self.workers
+        """
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                job = self.jobs[job_id]
+                if job["status"] != "queued":
+                    continue
+                job["status"] = "running"
+                job["started"] = time.time()
+
+            self.workers[slot].connection.send(job["params"])
+            outcome = None
+            while outcome is None:
+                if self.workers[slot].connection.poll(POLL_SECONDS):
+                    try:
+                        outcome = self.workers[slot].connection.recv()
+                    except EOFError:
+                        outcome = ("failed", "The worker process stopped", "")
+                        self.restart(slot)
+                elif job["status"] == "cancelling":
+                    outcome = ("cancelled", None, "")
+                    self.restart(slot)
+
+            # a job finishing while it is cancelled keeps its outcome
+            state, result, log = outcome
+            with self.lock:
+                job["finished"] = time.time()
+                job["status"] = state
+                job["log"] = log
+                if state == "done":
+                    job["files"] = result
+                elif state == "failed":
+                    job["error"] = result
+
+    def restart(self, slot):
+        """
+        restart : replaces a worker process by a new warm one
+            inputs:
+                slot : position of the worker in self.workers
+        """
+        self.workers[slot].stop()
+        self.workers[slot] = Worker(self.cache_index)
+
+    def shutdown(self):
+        """
+        shutdown : stops every worker process, running jobs included
+        """
+        for worker in self.workers:
+            worker.stop()
+
+    def result(self, job_id):
+        """
+        result : zip file with the files written by a finished job
+            inputs:
+                job_id : id of the job
+            output:
+                content : bytes of the zip file
+        """
+        job = self.status(job_id)
+        if job["status"] != "done":
+            raise ValueError("Job " + job_id + " is " + job["status"])
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for file_path in job["files"]:
+                archive.write(file_path, os.path.basename(file_path))
+        return buffer.getvalue()
+
+
+def make_handler(service):
+    """
+    make_handler : request handler class of the HTTP endpoints of a service
+        inputs:
+            service : EnrichmentService
+        output:
+            handler : BaseHTTPRequestHandler subclass
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def send_json(self, code, content):
+            body = json.dumps(content).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def route(self, method):
+            parts = [part for part in self.path.split("/") if part != ""]
+            try:
+                if method == "POST" and parts == ["jobs"]:
+                    length = int(self.headers.get("Content-Length", 0))
+                    return self.send_json(202, service.submit(json.loads(self.rfile.read(length) or b"null")))
+                if method == "GET" and parts == ["jobs"]:
+                    return self.send_json(200, service.status())
+                if method == "GET" and len(parts) == 2 and parts[0] == "jobs":
+                    return self.send_json(200, service.status(parts[1]))
+                if method == "POST" and len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+                    return self.send_json(200, service.cancel(parts[1]))
+                if method == "GET" and len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+                    content = service.result(parts[1])
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/zip")
+                    self.send_header("Content-Disposition", "attachment; filename=" + parts[1] + ".zip")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    return self.wfile.write(content)
+                return self.send_json(404, {"error": "Unknown endpoint " + method + " " + self.path})
+            except KeyError as key:
+                return self.send_json(404, {"error": "Unknown job " + str(key)})
+            except ValueError as value_error:
+                return self.send_json(409 if parts[-1:] == ["result"] else 400, {"error": str(value_error)})
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self.route("GET")
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            self.route("POST")
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
+
+
+def stop_on_sigterm():
+    """
+    stop_on_sigterm : stops the program like Ctrl+C does when it is terminated, so the workers are stopped with it
+    """
+    def interrupt(signum, frame):  # pylint: disable=unused-argument
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, interrupt)
+
+
+def serve(jobs_folder, workers=1, port=DEFAULT_PORT):
+    """
+    serve : runs the service on this computer until interrupted
+        inputs:
+            jobs_folder : folder where jobs without destination folder write
+            workers : number of jobs run at the same time (default = 1)
+            port : port of the service (default = 8765)
+    """
+    stop_on_sigterm()
+    service = EnrichmentService(jobs_folder, workers)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(service))
+    print("Enrichment service on http://127.0.0.1:" + str(port) + " with " + str(workers) + " workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+def call_service(url, method="GET", content=None):
+    """
+    call_service : sends a request to the service
+        inputs:
+            url : url of the endpoint
+            method : "GET" or "POST"
+            content : dictionary sent as JSON (optional input)
+        output:
+            response : decoded JSON response, or bytes for a zip file
+    """
+    data = json.dumps(content).encode() if content is not None else (b"" if method == "POST" else None)
+    req = request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with request.urlopen(req) as response:
+            body = response.read()
+            if response.headers.get("Content-Type") == "application/zip":
+                return body
+            return json.loads(body)
+    except error.HTTPError as http_error:
+        raise ValueError(json.loads(http_error.read()).get("error", str(http_error))) from None
+
+
+def submit_job(service_url, **params):
+    """
+    submit_job : submits an enrichment analysis to a service
+        inputs:
+            service_url : url of the service, like http://127.0.0.1:8765
+            params : parameters of run_enrichment_analysis
+        output:
+            job : status of the job
+    """
+    return call_service(service_url.rstrip("/") + "/jobs", "POST", params)
+
+
+def job_status(service_url, job_id):
+    """
+    job_status : status of a job of a service
+        inputs:
+            service_url : url of the service
+            job_id : id of the job
+        output:
+            job : status of the job
+    """
+    return call_service(service_url.rstrip("/") + "/jobs/" + job_id)
+
+
+def cancel_job(service_url, job_id):
+    """
+    cancel_job : cancels a job of a service
+        inputs:
+            service_url : url of the service
+            job_id : id of the job
+        output:
+            job : status of the job
+    """
+    return call_service(service_url.rstrip("/") + "/jobs/" + job_id + "/cancel", "POST")
+
+
+def download_result(service_url, job_id, destination_file):
+    """
+    download_result : saves the zip file of a finished job
+        inputs:
+            service_url : url of the service
+            job_id : id of the job
+            destination_file : path of the zip file
+    """
+    with open(destination_file, "wb") as file:
+        file.write(call_service(service_url.rstrip("/") + "/jobs/" + job_id + "/result"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local service running enrichment analyses")
+    parser.add_argument("--jobs-folder", default="enrichment_jobs", help="folder of jobs without destination folder")
+    parser.add_argument("--workers", type=int, default=1, help="number of jobs run at the same time")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port on 127.0.0.1")
+    args = parser.parse_args()
+    serve(args.jobs_folder, args.workers, args.port)
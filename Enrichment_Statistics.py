@@ -0,0 +1,197 @@
+# Enrichment_Statistics: significance of the enrichment tables created by Whole_Enrichment.py, hypergeometric tests
+# computed for every level of every component of a ranking at once
+import numpy as np
+import pandas as pd
+
+SIGNIFICANCE_COLUMNS = ["p-value", "q-value"]
+
+
+def log_factorials(n):
+    """
+    log_factorials : table of log(i!) for i from 0 to n
+        inputs:
+            n : largest integer of the table
+        output:
+            log_factorial : array of n + 1 floats
+    """
+    return np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, n + 1)))])
+
+
+def hypergeometric_pmf(population, successes, draws):
+    """
+    hypergeometric_pmf : probabilities of drawing 0 to max(draws) successes, one row per test
+        inputs:
+            population : array with the number of LNPs of each test
+            successes : array with the number of LNPs of the level tested
+            draws : array with the number of LNPs drawn (top or bottom performing)
+        output:
+            support : array of numbers of successes drawn, one per column
+            pmf : matrix of probabilities, zero outside of the support of each test
+    """
+    population, successes, draws = (np.asarray(array, dtype=int) for array in (population, successes, draws))
+    log_factorial = log_factorials(int(population.max(initial=0)))
+
+    support = np.arange(int(draws.max(initial=0)) + 1)
+    j = support[np.newaxis, :]
+    n_population, n_successes, n_draws = population[:, np.newaxis], successes[:, np.newaxis], draws[:, np.newaxis]
+    valid = (j <= np.minimum(n_successes, n_draws)) & (j >= n_draws + n_successes - n_population)
+
+    # indices are clipped where the probability is zero so that every lookup is within the table
+    def lf(values):
+        return log_factorial[np.clip(values, 0, len(log_factorial) - 1)]
+
+    log_pmf = (lf(n_successes) - lf(j) - lf(n_successes - j) +
+               lf(n_population - n_successes) - lf(n_draws - j) - lf(n_population - n_successes - n_draws + j) -
+               (lf(n_population) - lf(n_draws) - lf(n_population - n_draws)))
+
+    return support, np.where(valid, np.exp(np.where(valid, log_pmf, 0)), 0)
+
+
+def hypergeometric_sf(drawn, population, successes, draws):
+    """
+    hypergeometric_sf : one-sided p-values of drawing at least as many successes as drawn, the Fisher exact test of
+                        over-representation
+        inputs:
+            drawn : array with the number of LNPs of the level among those drawn
+            population : array with the number of LNPs of each test
+            successes : array with the number of LNPs of the level tested
+            draws : array with the number of LNPs drawn
+        output:
+            p_values : array of p-values
+    """
+    support, pmf = hypergeometric_pmf(population, successes, draws)
+    tail = support[np.newaxis, :] >= np.asarray(drawn, dtype=int)[:, np.newaxis]
+
+    return np.minimum(np.where(tail, pmf, 0).sum(axis=1), 1)
+
+
+def fisher_two_sided(drawn, population, successes, draws):
+    """
+    fisher_two_sided : two-sided p-values of the Fisher exact test, summing every outcome as or less likely than drawn
+        inputs:
+            drawn : array with the number of LNPs of the level among those drawn
+            population : array with the number of LNPs of each test
+            successes : array with the number of LNPs of the level tested
+            draws : array with the number of LNPs drawn
+        output:
+            p_values : array of p-values
+    """
+    support, pmf = hypergeometric_pmf(population, successes, draws)
+    drawn = np.asarray(drawn, dtype=int)
+    pmf_drawn = pmf[np.arange(len(drawn)), np.clip(drawn, 0, len(support) - 1)]
+    as_likely = pmf <= pmf_drawn[:, np.newaxis] * (1 + 1e-7)
+
+    return np.minimum(np.where(as_likely, pmf, 0).sum(axis=1), 1)
+
+
+def benjamini_hochberg(p_values):
+    """
+    benjamini_hochberg : q-values controlling the false discovery rate, NaN p-values are left out
+        inputs:
+            p_values : array of p-values
+        output:
+            q_values : array of q-values
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if len(tested) == 0:
+        return q_values
+
+    order = tested[np.argsort(p_values[tested], kind="stable")]
+    ranked = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+
+    return q_values
+
+
+def table_counts(d_tables):
+    """
+    table_counts : counts of every level of every component, and the total, from enrichment tables
+        inputs:
+            d_tables : dictionary with enrichment tables by component, as made by calculate_enrichment
+        output:
+            counts : array with the count of each row of each table, tables one after the other
+            totals : array with the TOTAL count of the table of each row
+            is_level : array of booleans, False for the TOTAL rows
+    """
+    list_counts, list_totals, list_is_level = [], [], []
+    for component, df in d_tables.items():
+        counts = pd.to_numeric(df["Total #"]).to_numpy(dtype=int)
+        is_level = df[component].astype(str).to_numpy() != "TOTAL"
+        list_counts.append(counts)
+        list_totals.append(np.full(len(counts), counts[~is_level].sum() if (~is_level).any() else counts.sum()))
+        list_is_level.append(is_level)
+
+    if len(list_counts) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=bool)
+
+    return np.concatenate(list_counts), np.concatenate(list_totals), np.concatenate(list_is_level)
+
+
+def split_by_table(values, d_tables):
+    """
+    split_by_table : splits an array of values of the rows of all tables back into one array per component
+        inputs:
+            values : array with one value per row, tables one after the other
+            d_tables : dictionary with enrichment tables by component
+        output:
+            d_values : dictionary with an array of values by component
+    """
+    d_values = {}
+    start = 0
+    for component, df in d_tables.items():
+        d_values[component] = values[start:start + len(df)]
+        start += len(df)
+
+    return d_values
+
+
+def enrichment_significance(d_total, d_top, d_bottom):
+    """
+    enrichment_significance : p-values and q-values of the top and bottom enrichment and of the net enrichment of every
+    level of every component of a ranking, all levels tested at once. Top and bottom performing LNPs are tested for
+    over-representation against all LNPs, the net enrichment compares top and bottom performing LNPs with a two-sided
+    Fisher exact test, which needs them apart: its p-values are NaN when they overlap, above 50 percent of the LNPs.
+    q-values are adjusted over all levels of all components
+        inputs:
+            d_total : dictionary with enrichment tables of all LNPs by component
+            d_top : dictionary with enrichment tables of top performing LNPs by component
+            d_bottom : dictionary with enrichment tables of bottom performing LNPs by component
+        output:
+            d_significance : dictionary with "top", "bottom" and "net" dictionaries of (p_values, q_values) by
+                             component, NaN on the TOTAL rows
+    """
+    total, population, is_level = table_counts(d_total)
+    top, draws_top, _ = table_counts(d_top)
+    bottom, draws_bottom, _ = table_counts(d_bottom)
+
+    # top and bottom performing LNPs overlap when there are more of them than LNPs
+    apart = draws_top + draws_bottom <= population
+
+    d_p_values = {"top": hypergeometric_sf(top, population, total, draws_top),
+                  "bottom": hypergeometric_sf(bottom, population, total, draws_bottom),
+                  "net": np.where(apart, fisher_two_sided(top, draws_top + draws_bottom, top + bottom, draws_top),
+                                  np.nan)}
+
+    d_significance = {}
+    for name, p_values in d_p_values.items():
+        p_values = np.where(is_level, p_values, np.nan)
+        d_p = split_by_table(p_values, d_total)
+        d_q = split_by_table(benjamini_hochberg(p_values), d_total)
+        d_significance[name] = {component: (d_p[component], d_q[component]) for component in d_total}
+
+    return d_significance
+
+
+def add_significance_columns(d_tables, d_significance):
+    """
+    add_significance_columns : adds p-value and q-value columns to tables of enrichment factors
+        inputs:
+            d_tables : dictionary with tables of enrichment factors by component
+            d_significance : dictionary of (p_values, q_values) by component
+    """
+    for component, df in d_tables.items():
+        p_values, q_values = d_significance[component]
+        df[SIGNIFICANCE_COLUMNS[0]] = p_values
+        df[SIGNIFICANCE_COLUMNS[1]] = q_values
@@ -0,0 +1,190 @@
+# Enrichment_Validation: checks of the formulation sheet and normalized counts run before any heavy work, so every
+# problem is reported at once, in milliseconds, before a workbook is started. Each check runs on whole columns
+import numpy as np
+import pandas as pd
+
+FORMULATION_COLUMNS = 11  # LNP, BC, 8 components and Notes, divide_samples_by_cell_type relies on it
+NAKED_LABEL = "naked"
+MIN_ENRICHMENT_WIDTH = 21  # columns of the Total, Top, Enrichment-Top, Bottom, Depletion-Bottom and Net tables
+LISTED = 5  # values listed in a message, the rest are counted
+
+
+def listed(values):
+    """
+    listed : first values of a list for a message, with the number of values left out
+        inputs:
+            values : list of values
+        output:
+            text : values separated by commas
+    """
+    text = ", ".join(str(value) for value in values[:LISTED])
+    if len(values) > LISTED:
+        text += " and " + str(len(values) - LISTED) + " more"
+    return text
+
+
+def formulation_problems(df_formulations, list_components, number_naked_bcs):
+    """
+    formulation_problems : problems of the formulation sheet, its barcodes, components and naked barcodes
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            list_components : list of the components used to formulate LNPs
+            number_naked_bcs : user specified number of naked barcodes
+        output:
+            list_problems : list of messages
+    """
+    list_problems = []
+    if len(df_formulations.columns) != FORMULATION_COLUMNS:
+        list_problems.append("The Formulations sheet has " + str(len(df_formulations.columns)) + " columns, " +
+                             str(FORMULATION_COLUMNS) + " are expected: LNP, barcode, 8 components and notes")
+
+    duplicated = df_formulations["BC"][df_formulations["BC"].duplicated()].unique().tolist()
+    if len(duplicated) != 0:
+        list_problems.append("Barcodes found more than once in the Formulations sheet: " + listed(duplicated))
+
+    n_lnps = len(df_formulations) - number_naked_bcs
+    if number_naked_bcs < 0 or n_lnps < 1:
+        list_problems.append("The number of naked barcodes must be between 0 and " + str(len(df_formulations) - 1) +
+                             ", got " + str(number_naked_bcs))
+        return list_problems
+
+    # every LNP needs a level of every component
+    df_components = df_formulations[list_components]
+    missing = df_components.iloc[:n_lnps].isna()
+    for component in missing.columns[missing.any().to_numpy()]:
+        lnps = df_formulations["LNP"].iloc[:n_lnps][missing[component].to_numpy()].tolist()
+        list_problems.append("Component " + str(component) + " has no value for LNPs " + listed(lnps))
+
+    # naked barcodes are the last rows, labelled naked when the sheet labels them
+    is_naked = df_components.astype(str).apply(lambda column: column.str.strip().str.lower() == NAKED_LABEL)
+    naked_rows = np.flatnonzero(is_naked.any(axis=1).to_numpy())
+    if len(naked_rows) != 0 and len(naked_rows) != number_naked_bcs:
+        list_problems.append("The Formulations sheet has " + str(len(naked_rows)) + " naked barcodes, the number of "
+                             "naked barcodes given is " + str(number_naked_bcs))
+    elif len(naked_rows) != 0 and naked_rows.min() < n_lnps:
+        list_problems.append("Naked barcodes must be the last rows of the Formulations sheet, found at rows " +
+                             listed((naked_rows + 2).tolist()))
+
+    return list_problems
+
+
+def count_problems(df_formulations, barcodes, df_counts, sample_columns, sorted_cells, sample_numbers):
+    """
+    count_problems : problems of the normalized counts, no barcode that merges, samples and cell types without a
+                     match, and counts that are not numbers
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            barcodes : barcodes of the normalized counts
+            df_counts : dataframe with the normalized counts, None if they are only on disk
+            sample_columns : names of the sample columns of the normalized counts
+            sorted_cells : user specified list of the sorted cell types
+            sample_numbers : numbers with sample values for an experiment
+        output:
+            list_problems : list of messages
+            list_warnings : list of messages about barcodes of the Formulations sheet left out by the merge
+    """
+    list_problems = []
+    list_warnings = []
+
+    merged = df_formulations["BC"].isin(pd.Index(barcodes)).to_numpy()
+    if not merged.any():
+        list_problems.append("No barcode of the Formulations sheet is in the normalized counts")
+    elif not merged.all():
+        list_warnings.append(str((~merged).sum()) + " of " + str(len(merged)) + " barcodes of the Formulations sheet "
+                             "are not in the normalized counts and are left out: " +
+                             listed(df_formulations["BC"][~merged].tolist()))
+
+    columns = pd.Index(sample_columns, dtype=object).astype(str)
+    matched = [any(columns.str.contains(str(sample_num), regex=False)) for sample_num in sample_numbers]
+    unmatched = [sample_num for sample_num, found in zip(sample_numbers, matched) if not found]
+    if len(unmatched) != 0:
+        list_problems.append("Sample numbers that match no column of the normalized counts: " + listed(unmatched))
+
+    empty = [cell_type for cell_type in sorted_cells if not columns.str.contains(cell_type, regex=False).any()]
+    if len(empty) != 0:
+        list_problems.append("Cell types without samples: " + listed(empty))
+
+    if df_counts is not None and len(sample_columns) != 0:
+        df_values = df_counts[list(sample_columns)]
+        not_numeric = [column for column, dtype in df_values.dtypes.items() if not pd.api.types.is_numeric_dtype(dtype)]
+        if len(not_numeric) != 0:
+            list_problems.append("Sample columns with values that are not numbers: " + listed(not_numeric))
+        values = df_values.drop(columns=not_numeric).to_numpy(dtype=float)
+        negative = (values < 0).any(axis=0)
+        if negative.any():
+            list_problems.append("Sample columns with negative counts: " +
+                                 listed(df_values.drop(columns=not_numeric).columns[negative].tolist()))
+
+    return list_problems, list_warnings
+
+
+def width_problems(df_formulations, sample_columns, sorted_cells, max_sheet_columns):
+    """
+    width_problems : rankings too wide for a sheet, a section holds the ranked table and the top and bottom tables, one
+                     column per formulation column and per sample of the cell type, and the enrichment tables
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            sample_columns : names of the sample columns of the normalized counts
+            sorted_cells : user specified list of the sorted cell types
+            max_sheet_columns : column budget of a sheet
+        output:
+            list_problems : list of messages
+    """
+    columns = pd.Index(sample_columns, dtype=object).astype(str)
+    list_problems = []
+    for cell_type in sorted_cells:
+        n_samples = int(columns.str.contains(cell_type, regex=False).sum())
+        if n_samples == 0:
+            continue  # reported as a cell type without samples
+        width = 2 * (len(df_formulations.columns) + n_samples + 1) + MIN_ENRICHMENT_WIDTH
+        if width > max_sheet_columns:
+            list_problems.append("The rankings of " + cell_type + " need at least " + str(width) +
+                                 " columns, more than the " + str(max_sheet_columns) + " of a sheet")
+
+    return list_problems
+
+
+def validate_inputs(df_formulations, list_components, barcodes, df_counts, sample_columns, sorted_cells,
+                    sample_numbers, number_naked_bcs, x_percent, max_sheet_columns):
+    """
+    validate_inputs : every problem of the inputs of an analysis
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            list_components : list of the components used to formulate LNPs
+            barcodes : barcodes of the normalized counts
+            df_counts : dataframe with the normalized counts, None if they are only on disk
+            sample_columns : names of the sample columns of the normalized counts
+            sorted_cells : user specified list of the sorted cell types
+            sample_numbers : numbers with sample values for an experiment
+            number_naked_bcs : user specified number of naked barcodes
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            max_sheet_columns : column budget of a sheet
+        output:
+            list_problems : list of messages, empty if the inputs are valid
+            list_warnings : list of messages about inputs that are valid but may be a mistake
+    """
+    list_problems = []
+    if not 0 < x_percent < 100:
+        list_problems.append("The top/bottom percent must be between 0 and 100, got " + str(x_percent))
+
+    list_problems += formulation_problems(df_formulations, list_components, number_naked_bcs)
+    problems, list_warnings = count_problems(df_formulations, barcodes, df_counts, sample_columns, sorted_cells,
+                                             sample_numbers)
+    list_problems += problems + width_problems(df_formulations, sample_columns, sorted_cells, max_sheet_columns)
+
+    return list_problems, list_warnings
+
+
+def check_inputs(df_formulations, list_components, barcodes, df_counts, sample_columns, sorted_cells, sample_numbers,
+                 number_naked_bcs, x_percent, max_sheet_columns):
+    """
+    check_inputs : fails with every problem of the inputs of an analysis and prints the warnings, see validate_inputs
+                   for the inputs
+    """
+    list_problems, list_warnings = validate_inputs(df_formulations, list_components, barcodes, df_counts,
+                                                   sample_columns, sorted_cells, sample_numbers, number_naked_bcs,
+                                                   x_percent, max_sheet_columns)
+    for warning in list_warnings:
+        print("Warning:", warning)
+    if len(list_problems) != 0:
+        raise ValueError("Invalid inputs:\n- " + "\n- ".join(list_problems))
@@ -0,0 +1,238 @@
+# Enrichment_Watch: watches a folder where normalized counts are dropped and runs an enrichment analysis for every new
+# csv file on the warm worker pool of Enrichment_Service. A csv file is paired with the job spec of the same name
+# (run.csv with run.json) or with the spec of the folder (enrichment_job.json), waits until it stops changing and is
+# skipped when a file with the same content and spec was already processed
+#
+# A job spec is a JSON object with the parameters of run_enrichment_analysis but csv_filepath, for example
+#     {"formulations_sheet": "formulations.xlsx", "sorted_cells": ["LH", "LE"], "number_naked_bcs": 2,
+#      "x_percent": 10, "sample_numbers": ["M1", "M2"], "remove_outlying_mouse": true, "r2_threshold": 0.8,
+#      "remove_runaways": true, "percentile": 99.9}
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from Enrichment_Service import EnrichmentService, stop_on_sigterm
+
+FOLDER_SPEC = "enrichment_job.json"
+STATE_FILE = ".enrichment_processed.json"
+RESULTS_FOLDER = "results"
+
+
+def file_hash(file_path, hasher=None):
+    """
+    file_hash : sha256 of the content of a file, read in blocks
+        inputs:
+            file_path : path of the file
+            hasher : hashlib object to update instead of a new one (optional input)
+        output:
+            hasher : hashlib object with the content of the file
+    """
+    hasher = hasher or hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            hasher.update(block)
+
+    return hasher
+
+
+def find_spec(csv_path):
+    """
+    find_spec : job spec of a csv file, the spec of the same name first, then the spec of the folder
+        inputs:
+            csv_path : path of the csv file
+        output:
+            spec_path : path of the job spec, None if there is none
+    """
+    for spec_path in [os.path.splitext(csv_path)[0] + ".json",
+                      os.path.join(os.path.dirname(csv_path), FOLDER_SPEC)]:
+        if os.path.isfile(spec_path):
+            return spec_path
+
+    return None
+
+
+def job_from_spec(spec_path, csv_path, results_folder):
+    """
+    job_from_spec : parameters of run_enrichment_analysis for a csv file, relative paths of the spec are relative to
+                    its folder, results go to a folder named after the csv file unless the spec has a destination folder
+        inputs:
+            spec_path : path of the job spec
+            csv_path : path of the csv file
+            results_folder : folder of the results of the watched folder
+        output:
+            params : dictionary of parameters
+    """
+    with open(spec_path) as file:
+        params = json.load(file)
+
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    spec_folder = os.path.dirname(os.path.abspath(spec_path))
+    for name in ["formulations_sheet", "destination_folder", "memory_map_folder", "raw_counts_csv"]:
+        if params.get(name) is not None:
+            params[name] = os.path.join(spec_folder, params[name])
+
+    params["csv_filepath"] = os.path.abspath(csv_path)
+    params.setdefault("file_id", stem)
+    if params.get("destination_folder") is None:
+        params["destination_folder"] = os.path.join(results_folder, stem)
+    os.makedirs(params["destination_folder"], exist_ok=True)
+
+    return params
+
+
+class FolderWatcher:
+    """
+    FolderWatcher : finds new csv files in a folder, waits until they are fully written and runs their analyses
+        inputs:
+            folder : watched folder
+            service : EnrichmentService running the analyses
+            settle_seconds : seconds a csv file must stay unchanged before it is processed (default = 10)
+            results_folder : folder of the results, "results" in the watched folder if not given
+    """
+
+    def __init__(self, folder, service, settle_seconds=10, results_folder=None):
+        self.folder = folder
+        self.service = service
+        self.settle_seconds = settle_seconds
+        self.results_folder = results_folder or os.path.join(folder, RESULTS_FOLDER)
+        self.state_path = os.path.join(folder, STATE_FILE)
+        self.d_seen = {}  # csv path : (size, modification time, time of the last change)
+        self.d_running = {}  # job id : content key
+        self.d_keys = {}  # csv path : (sizes and modification times of the csv file and its spec, content key)
+
+        self.d_state = {}
+        if os.path.isfile(self.state_path):
+            with open(self.state_path) as file:
+                self.d_state = json.load(file)
+
+    def save_state(self):
+        """
+        save_state : saves the processed files next to the csv files, replaced at once so a crash can not corrupt it
+        """
+        temporary_path = self.state_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.d_state, file, indent=1)
+        os.replace(temporary_path, self.state_path)
+
+    def settled_files(self):
+        """
+        settled_files : csv files of the folder that did not change for settle_seconds
+            output:
+                list_files : list of paths
+        """
+        now = time.time()
+        list_files = []
+        for name in sorted(os.listdir(self.folder)):
+            csv_path = os.path.join(self.folder, name)
+            if not name.lower().endswith(".csv") or not os.path.isfile(csv_path):
+                continue
+
+            stat = os.stat(csv_path)
+            size, modified, changed = self.d_seen.get(csv_path, (None, None, now))
+            if (stat.st_size, stat.st_mtime) != (size, modified):
+                changed = now  # still being written, or new
+            self.d_seen[csv_path] = (stat.st_size, stat.st_mtime, changed)
+
+            if now - changed >= self.settle_seconds:
+                list_files.append(csv_path)
+
+        return list_files
+
+    def content_key(self, csv_path, spec_path):
+        """
+        content_key : hash of the content of a csv file and its spec, only computed again when one of them changes
+            inputs:
+                csv_path : path of the csv file
+                spec_path : path of the job spec
+            output:
+                key : hexadecimal hash
+        """
+        version = tuple((os.stat(file_path).st_size, os.stat(file_path).st_mtime, file_path)
+                        for file_path in [csv_path, spec_path])
+        if self.d_keys.get(csv_path, (None, None))[0] != version:
+            self.d_keys[csv_path] = (version, file_hash(spec_path, file_hash(csv_path)).hexdigest())
+
+        return self.d_keys[csv_path][1]
+
+    def scan(self):
+        """
+        scan : submits the analyses of the settled csv files that were not processed yet
+            output:
+                list_jobs : list of the jobs submitted
+        """
+        list_jobs = []
+        for csv_path in self.settled_files():
+            spec_path = find_spec(csv_path)
+            if spec_path is None:
+                continue
+
+            key = self.content_key(csv_path, spec_path)
+            if key in self.d_running.values() or \
+                    self.d_state.get(key, {}).get("status") in ["done", "failed", "cancelled"]:
+                continue
+
+            try:
+                job = self.service.submit(job_from_spec(spec_path, csv_path, self.results_folder))
+            except (ValueError, OSError) as spec_error:
+                self.d_state[key] = {"csv": csv_path, "spec": spec_path, "status": "failed", "error": str(spec_error)}
+                print("Could not submit " + csv_path + ": " + str(spec_error))
+                continue
+
+            self.d_running[job["id"]] = key
+            self.d_state[key] = {"csv": csv_path, "spec": spec_path, "status": "queued", "job": job["id"]}
+            print("Submitted " + csv_path + " as job " + job["id"])
+            list_jobs.append(job)
+
+        if len(list_jobs) != 0:
+            self.save_state()
+        return list_jobs
+
+    def update(self):
+        """
+        update : records the jobs that finished
+        """
+        finished = False
+        for job_id, key in list(self.d_running.items()):
+            job = self.service.status(job_id)
+            self.d_state[key]["status"] = job["status"]
+            if job["status"] in ["done", "failed", "cancelled"]:
+                self.d_state[key].update({"files": job["files"], "error": job["error"], "finished": job["finished"]})
+                del self.d_running[job_id]
+                finished = True
+                print("Job " + job_id + " " + job["status"] + ": " + self.d_state[key]["csv"])
+
+        if finished:
+            self.save_state()
+
+    def run_forever(self, interval=5):
+        """
+        run_forever : scans the folder and records finished jobs until interrupted
+            inputs:
+                interval : seconds between two scans (default = 5)
+        """
+        while True:
+            self.update()
+            self.scan()
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs an enrichment analysis for every csv file dropped in a folder")
+    parser.add_argument("folder", help="watched folder")
+    parser.add_argument("--workers", type=int, default=1, help="number of analyses run at the same time")
+    parser.add_argument("--settle-seconds", type=float, default=10, help="seconds a csv file must stay unchanged")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between two scans")
+    parser.add_argument("--results-folder", help="folder of the results, 'results' in the watched folder by default")
+    args = parser.parse_args()
+
+    stop_on_sigterm()
+    results_folder = args.results_folder or os.path.join(args.folder, RESULTS_FOLDER)
+    enrichment_service = EnrichmentService(results_folder, args.workers)
+    try:
+        FolderWatcher(args.folder, enrichment_service, args.settle_seconds, results_folder).run_forever(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        enrichment_service.shutdown()
@@ -0,0 +1,45 @@
+# Enrichment_Weighted: count-weighted enrichment, the share of the normalized counts taken by the LNPs of a component
+# level over their share of LNPs, for many rankings with one matrix product
+import numpy as np
+import pandas as pd
+
+from Enrichment_Permutation import one_hot_components
+
+WEIGHTED_TITLE = "Weighted Enrichment"
+
+
+def weighted_enrichment(df_formulations, dict_components, df_values):
+    """
+    weighted_enrichment : count-weighted enrichment of every level of every component for every column of df_values,
+                          1 when the level takes the same share of the normalized counts as of the LNPs
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            df_values : dataframe of normalized counts aligned with df_formulations, one column per ranking
+        output:
+            d_weighted : dictionary with, for each column of df_values, a dictionary of tables by component with the
+                         same rows as the enrichment tables
+    """
+    one_hot, boundaries = one_hot_components(df_formulations, dict_components)
+    values = np.nan_to_num(df_values.to_numpy(dtype=float))
+
+    # counts of every level for every column at once, then shares within each component
+    level_counts = one_hot.T @ values
+    level_lnps = one_hot.sum(axis=0)
+    sizes = np.diff(np.append(boundaries, one_hot.shape[1]))
+    count_sums = np.repeat(np.add.reduceat(level_counts, boundaries, axis=0), sizes, axis=0)
+    lnp_sums = np.repeat(np.add.reduceat(level_lnps, boundaries), sizes)
+
+    count_share = level_counts / np.where(count_sums == 0, np.nan, count_sums)
+    lnp_share = level_lnps / np.where(lnp_sums == 0, np.nan, lnp_sums)
+    scores = np.round(count_share / np.where(lnp_share == 0, np.nan, lnp_share)[:, np.newaxis], 9)
+
+    d_weighted = {}
+    for col, column in enumerate(df_values.columns):
+        d_weighted[column] = {}
+        for component, start, size in zip(dict_components, boundaries, sizes):
+            levels = [level for level in dict_components[component] if level != "TOTAL"]
+            d_weighted[column][component] = pd.DataFrame({component: levels + ["TOTAL"],
+                                                          column: list(scores[start:start + size, col]) + [1.0]})
+
+    return d_weighted
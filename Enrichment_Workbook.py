@@ -0,0 +1,235 @@
+# Enrichment_Workbook: layout of the excel sheets created by Whole_Enrichment.py and their writing, in a single
+# workbook or in shards written by separate processes
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import pandas as pd
+
+EXCEL_MAX_COLUMNS = 16384
+SHARD_BY = ["organ", "cell_type"]
+
+
+class SheetLayout:
+    """
+    SheetLayout : tables of an excel sheet and where they go. Tables are grouped in sections placed side by side, one
+    section per ranking, and a sheet wider than the column budget is split between sections
+        inputs:
+            sheet_name : name of the sheet
+            organ : organ of the sheet, used to shard workbooks by organ (optional input)
+    """
+
+    def __init__(self, sheet_name, organ=None):
+        self.sheet_name = sheet_name
+        self.organ = organ
+        self.group = sheet_name  # sheets split from this one stay in the same workbook
+        self.sections = []
+
+    @property
+    def width(self):
+        """
+        width : number of columns used by the sheet
+        """
+        return max(sum(section[2] for section in self.sections) - 1, 0)
+
+    def add_section(self, blocks, titles, width):
+        """
+        add_section : places a section to the right of the last one
+            inputs:
+                blocks : list of (table, startrow, startcol) relative to the section, a table is a dataframe or a
+                         (RankedView, positions) tuple materialized at write time
+                titles : list of (row, col, text) relative to the section
+                width : number of columns taken by the section, including the column after it
+        """
+        self.sections.append((blocks, titles, width))
+
+    def split(self, max_columns=EXCEL_MAX_COLUMNS):
+        """
+        split : splits the sheet between sections so that no sheet uses more than max_columns
+            inputs:
+                max_columns : column budget of a sheet
+            output:
+                list_layouts : list of sheet layouts, the first one keeps the name of the sheet
+        """
+        list_layouts = [SheetLayout(self.sheet_name, self.organ)]
+        used = 0
+        for blocks, titles, width in self.sections:
+            if width - 1 > max_columns:
+                raise ValueError("A section of sheet " + self.sheet_name + " needs " + str(width - 1) +
+                                 " columns, more than the budget of " + str(max_columns))
+            if used != 0 and used + width - 1 > max_columns:
+                layout = SheetLayout(split_sheet_name(self.sheet_name, len(list_layouts) + 1), self.organ)
+                list_layouts.append(layout)
+                used = 0
+            list_layouts[-1].add_section(blocks, titles, width)
+            used += width
+
+        for layout in list_layouts:
+            layout.group = self.group
+
+        return list_layouts
+
+    def write(self, writer):
+        """
+        write : writes every table and title of the sheet
+            inputs:
+                writer : open excel writer
+        """
+        current_col = 0
+        for blocks, titles, width in self.sections:
+            for table, startrow, startcol in blocks:
+                materialize(table).to_excel(writer, sheet_name=self.sheet_name, startrow=startrow,
+                                            startcol=current_col + startcol, index=False)
+
+            sheet = writer.sheets[self.sheet_name]
+            for row, col, text in titles:
+                sheet.cell(row=row + 1, column=current_col + col + 1).value = text
+
+            current_col += width
+
+
+def materialize(table):
+    """
+    materialize : builds the dataframe of a table of a sheet layout
+        inputs:
+            table : dataframe or (RankedView, positions) tuple
+        output:
+            df : dataframe
+    """
+    if isinstance(table, tuple):
+        view, positions = table
+        return view.table(positions)
+
+    return table
+
+
+def split_sheet_name(sheet_name, number):
+    """
+    split_sheet_name : name of a sheet split from sheet_name, within the 31 characters excel allows
+        inputs:
+            sheet_name : name of the sheet split
+            number : number of the part
+        output:
+            name : name of the part
+    """
+    suffix = " (" + str(number) + ")"
+    return sheet_name[:31 - len(suffix)] + suffix
+
+
+def split_layouts(list_layouts, max_columns=EXCEL_MAX_COLUMNS):
+    """
+    split_layouts : splits every sheet wider than the column budget
+        inputs:
+            list_layouts : list of sheet layouts
+            max_columns : column budget of a sheet
+        output:
+            list_split : list of sheet layouts within the column budget
+    """
+    list_split = []
+    for layout in list_layouts:
+        list_split += layout.split(max_columns)
+
+    return list_split
+
+
+def write_sheet_layouts(destination_file, list_layouts, max_columns=EXCEL_MAX_COLUMNS, mode="a"):
+    """
+    write_sheet_layouts : writes sheets into an excel spreadsheet
+        inputs:
+            destination_file : directory of the excel spreadsheet
+            list_layouts : list of sheet layouts
+            max_columns : column budget of a sheet
+            mode : "a" to add the sheets to an existing spreadsheet, "w" to create it
+        output:
+            list_sheets : names of the sheets written
+    """
+    list_layouts = split_layouts(list_layouts, max_columns)
+    with pd.ExcelWriter(destination_file, engine="openpyxl", mode=mode) \
+            as writer:  # pylint: disable=abstract-class-instantiated
+        for layout in list_layouts:
+            layout.write(writer)
+
+    return [layout.sheet_name for layout in list_layouts]
+
+
+def write_sharded_workbooks(destination_file, list_layouts, shard_by, max_columns=EXCEL_MAX_COLUMNS, workers=None,
+                            index_mode="a"):
+    """
+    write_sharded_workbooks : writes sheets into one workbook per organ or per cell type, each workbook in a separate
+                              process, and adds an Index sheet linking them to the excel spreadsheet. Sheets without
+                              an organ stay in the excel spreadsheet, next to the Index sheet
+        inputs:
+            destination_file : directory of the excel spreadsheet created
+            list_layouts : list of sheet layouts
+            shard_by : "organ" or "cell_type"
+            max_columns : column budget of a sheet
+            workers : number of processes writing workbooks, all cores if not given
+            index_mode : "a" to add the sheets without an organ and the Index sheet to the excel spreadsheet, "w" to
+                         replace it
+        output:
+            d_shard_files : dictionary with the sheets written in each workbook
+    """
+    d_shard_layouts = shard_layouts(destination_file, [layout for layout in list_layouts if layout.organ is not None],
+                                    shard_by, max_columns)
+
+    d_shard_files = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for shard_file, list_shard_layouts in d_shard_layouts.items():
+            futures[shard_file] = executor.submit(write_sheet_layouts, shard_file, list_shard_layouts, max_columns,
+                                                  "w")
+        for shard_file, future in futures.items():
+            d_shard_files[shard_file] = future.result()
+
+    list_main_layouts = [layout for layout in list_layouts if layout.organ is None]
+    if len(list_main_layouts) != 0:
+        write_sheet_layouts(destination_file, list_main_layouts, max_columns, index_mode)
+        index_mode = "a"
+    write_index_sheet(destination_file, d_shard_files, index_mode)
+
+    return d_shard_files
+
+
+def shard_layouts(destination_file, list_layouts, shard_by, max_columns=EXCEL_MAX_COLUMNS):
+    """
+    shard_layouts : sheets of each workbook when sheets are sharded by organ or by cell type, the workbooks are named
+                    after the excel spreadsheet
+        inputs:
+            destination_file : directory of the excel spreadsheet created
+            list_layouts : list of sheet layouts of an organ
+            shard_by : "organ" or "cell_type"
+            max_columns : column budget of a sheet
+        output:
+            d_shard_layouts : dictionary with the sheet layouts of each workbook, by file path
+    """
+    if shard_by not in SHARD_BY:
+        raise ValueError("Shards must be by one of " + ", ".join(SHARD_BY) + ", got " + str(shard_by))
+
+    base_name = destination_file[:-len(".xlsx")] if destination_file.endswith(".xlsx") else destination_file
+    d_shard_layouts = {}
+    for layout in split_layouts(list_layouts, max_columns):
+        shard = layout.organ if shard_by == "organ" else layout.group
+        d_shard_layouts.setdefault(base_name + " - " + str(shard) + ".xlsx", []).append(layout)
+
+    return d_shard_layouts
+
+
+def write_index_sheet(destination_file, d_shard_files, mode="a"):
+    """
+    write_index_sheet : adds an Index sheet with links to every sheet of every shard
+        inputs:
+            destination_file : directory of the excel spreadsheet created
+            d_shard_files : dictionary with the sheets written in each workbook
+            mode : "a" to add the sheet to the excel spreadsheet, "w" to replace it
+    """
+    rows = []
+    for shard_file, list_sheets in d_shard_files.items():
+        for sheet_name in list_sheets:
+            rows.append([path.basename(shard_file), sheet_name])
+    df_index = pd.DataFrame(rows, columns=["Workbook", "Sheet"])
+
+    with pd.ExcelWriter(destination_file, engine="openpyxl", mode=mode) \
+            as writer:  # pylint: disable=abstract-class-instantiated
+        df_index.to_excel(writer, sheet_name="Index", index=False)
+        sheet = writer.sheets["Index"]
+        for row, (file_name, sheet_name) in enumerate(rows, start=2):
+            sheet.cell(row=row, column=2).hyperlink = file_name + "#'" + sheet_name + "'!A1"
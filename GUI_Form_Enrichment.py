@@ -3,21 +3,73 @@
 # May 2021
 
 # GUI_Form_Enrichment: Graphical user interface for Formulation_Enrichment_by_Cell_Type.py
+# The analysis modules import pandas, NumPy and openpyxl, they are imported on a thread once the window is shown
 from tkinter import filedialog, Tk, StringVar, Label, Button, Entry, OptionMenu
-from os import path
+from os import environ, path
 import sys
+import threading
+import time
 
-import Whole_Enrichment.py
+import Enrichment_Service
+
+# environment variable that makes the form print its startup times and close, see Enrichment_Benchmark.py
+STARTUP_BENCHMARK_VARIABLE = "ENRICHMENT_STARTUP_BENCHMARK"
+
+# options of the sheets to create, see Whole_Enrichment.OUTPUT_PRESETS
+OUTPUT_OPTIONS = {"Full": "full", "Summary only": "summary", "Cell type averages": "averages",
+                  "No organ sheets": "no_organs"}
+
+
+class AnalysisLoader:
+    # Imports the analysis modules on a thread, the first analysis then starts with them already imported
+
+    def __init__(self):
+        self.module = None
+        self.error = None
+        self.seconds = None
+        self.thread = threading.Thread(target=self.load, daemon=True)
+
+    def start(self):
+        # Starts importing, called once the window is shown
+
+        if self.thread.ident is None:
+            self.thread.start()
+
+    def load(self):
+        # Imports Whole_Enrichment, an error is raised when the analysis is needed
+
+        start = time.perf_counter()
+        try:
+            import Whole_Enrichment  # pylint: disable=import-outside-toplevel
+            self.module = Whole_Enrichment
+        except Exception as import_error:  # pylint: disable=broad-except
+            self.error = import_error
+        self.seconds = time.perf_counter() - start
+
+    def is_ready(self):
+        # True once the import finished
+
+        return self.seconds is not None
+
+    def analysis(self):
+        # Whole_Enrichment, waits for the import if it is not finished
+
+        self.start()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.module
 
 
 class MyGUI:  # pylint: disable=too-many-instance-attributes
     # GUI for enrichment analysis by cell type
 
-    def __init__(self, master):
+    def __init__(self, master, analysis_loader=None):
         # Saves basic GUI buttons and data entries
 
         self.master = master
-        master.geometry("600x700")
+        self.analysis_loader = analysis_loader or AnalysisLoader()
+        master.geometry("600x762")
         master.title("Enrichment Analysis by Cell Type Tool")
 
         # string variables from user input
@@ -33,6 +85,8 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
         self.r2t = StringVar()  # float of r^2 threshold
         self.rra = StringVar()  # boolean remove runaways
         self.op = StringVar()  # Outliers Percentile
+        self.out = StringVar()  # sheets to create
+        self.url = StringVar()  # url of an enrichment service
 
         Label(master, text="Whole Enrichment Analysis", relief="solid", font=("arial", 16, "bold")).pack()
 
@@ -89,9 +143,20 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                                                                                                                y=394)
         Entry(master, textvariable=self.op).place(x=370, y=392)
 
+        # sheets to create
+        Label(master, text="Sheets to create", font=("arial", 12, "bold")).place(x=20, y=424)
+        out_droplist = OptionMenu(master, self.out, *OUTPUT_OPTIONS)
+        self.out.set("Full")
+        out_droplist.config(width=15)
+        out_droplist.place(x=370, y=422)
+
+        # run on an enrichment service instead of in this window
+        Label(master, text="Enrichment service URL (OPTIONAL)", font=("arial", 12, "bold")).place(x=20, y=456)
+        Entry(master, textvariable=self.url).place(x=370, y=454)
+
         Button(master, text="ENTER", width=16, fg="blue", font=("arial", 16), command=self.enrichment_analysis).place(
-            x=150, y=424)
-        Button(master, text="CANCEL", width=16, fg="blue", font=("arial", 16), command=exit1).place(x=300, y=424)
+            x=150, y=488)
+        Button(master, text="CANCEL", width=16, fg="blue", font=("arial", 16), command=exit1).place(x=300, y=488)
 
     def open_excel_file(self):
         # To open a file searcher and select a file
@@ -115,6 +180,8 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
         r2_threshold = self.r2t.get()  # r^2 threshold to remove mice
         remove_runaways = self.rra.get()  # Option to remove runaways
         percentile = self.op.get()  # Outliers Percentile
+        outputs = OUTPUT_OPTIONS[self.out.get()]  # sheets to create
+        service_url = self.url.get().strip()  # url of an enrichment service
 
         # check for errors with formulation sheet
         if self.fsp == "PY_VAR0":
@@ -132,7 +199,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                 errors = True
 
         Label(self.master, text="Invalid formulation sheet file path", fg=color1, font=("arial", 12, "bold")).place(
-            x=20, y=454)
+            x=20, y=518)
 
         # check for errors with normalized counts csv file
         if self.ncp == "PY_VAR1":
@@ -150,7 +217,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                 errors = True
 
         Label(self.master, text="Invalid normalized counts file path", fg=color2, font=("arial", 12, "bold")).place(
-            x=20, y=474)
+            x=20, y=538)
 
         if cell_types == [""]:
             color3 = "red"
@@ -159,7 +226,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
             color3 = "white"
 
         Label(self.master, text="Missing list of sorted cells", fg=color3, font=("arial", 12, "bold")).place(
-            x=20, y=494)
+            x=20, y=558)
 
         # check for errors with destination folder
         if path_exists(fold_path):
@@ -168,7 +235,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
             color4 = "red"
             errors = True
 
-        Label(self.master, text="Invalid destination folder", fg=color4, font=("arial", 12, "bold")).place(x=20, y=514)
+        Label(self.master, text="Invalid destination folder", fg=color4, font=("arial", 12, "bold")).place(x=20, y=578)
 
         # check for errors with top/bottom percent
         try:
@@ -179,7 +246,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
             errors = True
 
         Label(self.master, text="Invalid top/bottom percent, enter a value between 0.1-99.9", fg=color5,
-              font=("arial", 12, "bold")).place(x=20, y=534)
+              font=("arial", 12, "bold")).place(x=20, y=598)
 
         # check if number of naked barcodes values to check for error here
         try:
@@ -190,7 +257,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
             errors = True
 
         Label(self.master, text="Invalid number of naked barcodes", fg=color6, font=("arial", 12, "bold")).place(x=20,
-                                                                                                                 y=554)
+                                                                                                                 y=618)
         # check list of sample number for error here
         if sample_num_list != [""]:
             color7 = "white"
@@ -199,7 +266,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
             errors = True
 
         Label(self.master, text="Missing list of sample numbers", fg=color7, font=("arial", 12, "bold")).place(x=20,
-                                                                                                               y=574)
+                                                                                                               y=638)
 
         # check remove outlying mice
         r_outlying_mice = False
@@ -214,7 +281,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                 r_outlying_mice = False
 
         Label(self.master, text="Missing selection on mouse removal", fg=color8, font=("arial", 12, "bold")
-              ).place(x=20, y=594)
+              ).place(x=20, y=658)
 
         if r2_threshold == "":
             r2_threshold = 0.80
@@ -231,7 +298,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                 color9 = "white"
 
         Label(self.master, text="Enter valid r^2 threshold or leave box empty for default", fg=color9,
-              font=("arial", 12, "bold")).place(x=20, y=634)
+              font=("arial", 12, "bold")).place(x=20, y=698)
 
         # check remove outlying mice
         r_runaways = False
@@ -246,7 +313,7 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                 r_runaways = False
 
         Label(self.master, text="Missing selection on removal of runaways", fg=color10, font=("arial", 12, "bold")
-              ).place(x=20, y=614)
+              ).place(x=20, y=678)
 
         if percentile == "":
             percentile = 99.9
@@ -263,13 +330,22 @@ class MyGUI:  # pylint: disable=too-many-instance-attributes
                 color11 = "white"
 
         Label(self.master, text="Enter valid percentile or leave box empty for default", fg=color11,
-              font=("arial", 12, "bold")).place(x=20, y=654)
-
-        if not errors:
-            Whole_Enrichment.run_enrichment_analysis(fold_path, self.fid.get(), self.fsp, self.ncp,
-                                                                        cell_types, num_bcs, percent, sample_num_list,
-                                                                        r_outlying_mice, r2_threshold, r_runaways,
-                                                                        percentile)
+              font=("arial", 12, "bold")).place(x=20, y=718)
+
+        if not errors and service_url != "":
+            job = Enrichment_Service.submit_job(service_url, destination_folder=fold_path, file_id=self.fid.get(),
+                                                formulations_sheet=self.fsp, csv_filepath=self.ncp,
+                                                sorted_cells=cell_types, number_naked_bcs=num_bcs, x_percent=percent,
+                                                sample_numbers=sample_num_list, remove_outlying_mouse=r_outlying_mice,
+                                                r2_threshold=r2_threshold, remove_runaways=r_runaways,
+                                                percentile=percentile, outputs=outputs)
+            print("Submitted job " + job["id"] + ", status at " + service_url.rstrip("/") + "/jobs/" + job["id"])
+            exit1()
+        elif not errors:
+            self.analysis_loader.analysis().run_enrichment_analysis(fold_path, self.fid.get(), self.fsp, self.ncp,
+                                                                    cell_types, num_bcs, percent, sample_num_list,
+                                                                    r_outlying_mice, r2_threshold, r_runaways,
+                                                                    percentile, outputs=outputs)
             print("Enrichment analysis performed!")
             exit1()
         else:
@@ -302,6 +378,27 @@ def path_exists(path1):
     return path.exists(path1)
 
 
-root = Tk()
-my_gui = MyGUI(root)
-root.mainloop()
+def report_startup(master, analysis_loader, start):
+    # Prints when the window is shown and when the analysis is imported, then closes the window
+
+    print("window %.3f" % (time.perf_counter() - start), flush=True)
+
+    def wait_for_analysis():
+        if not analysis_loader.is_ready():
+            master.after(10, wait_for_analysis)
+            return
+        print("analysis %.3f" % (time.perf_counter() - start), flush=True)
+        master.destroy()
+
+    wait_for_analysis()
+
+
+if __name__ == "__main__":
+    startup = time.perf_counter()
+    root = Tk()
+    loader = AnalysisLoader()
+    my_gui = MyGUI(root, loader)
+    root.after_idle(loader.start)
+    if environ.get(STARTUP_BENCHMARK_VARIABLE):
+        root.after_idle(report_startup, root, loader, startup)
+    root.mainloop()
@@ -2,18 +2,56 @@
 # GitHub: @adafdelcid
 # April 2021
 
+import argparse
 import math
-from openpyxl import Workbook
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openpyxl import Workbook, load_workbook
 import pandas as pd
+from pandas.io.parsers import TextParser
 import numpy as np
-import openpyxl
+
+from Enrichment_Bootstrap import BootstrapTest, add_confidence_columns
+from Enrichment_Correlation import (CORRELATION_METHODS, REMOVAL_COLUMNS, check_correlation_method,
+                                    correlation_matrices, iterative_removal, log_pseudocount,
+                                    smallest_positive_count)
+from Enrichment_Count_Store import CHUNK_COLUMNS, CountStore
+from Enrichment_Export import EXPORT_FORMATS, LongFormatExport, check_export_format, table_key
+from Enrichment_Interactions import INTERACTION_ORDERS, interaction_tables
+from Enrichment_Job import job_spec, save_spec, spec_file
+from Enrichment_Permutation import PermutationTest, add_empirical_p_column
+from Enrichment_Pooling import POOL_METHODS, check_pool_method, pool_counts
+from Enrichment_Results_Store import ResultsStore
+from Enrichment_Rarefaction import RarefactionTest
+from Enrichment_Running_Sum import RUNNING_SUM_TITLE, RunningSumTest
+from Enrichment_Sensitivity import leave_one_out
+from Enrichment_Statistics import add_significance_columns, enrichment_significance
+from Enrichment_Validation import check_inputs
+from Enrichment_Weighted import WEIGHTED_TITLE, weighted_enrichment
+from Enrichment_Workbook import (EXCEL_MAX_COLUMNS, SHARD_BY, SheetLayout, shard_layouts, write_index_sheet,
+                                 write_sharded_workbooks, write_sheet_layouts)
 
 pd.options.mode.chained_assignment = None
 
+OUTPUTS = ["merged", "all", "cell_type_averages", "cell_type_samples", "organs"]
+OUTPUT_PRESETS = {"full": OUTPUTS,
+                  "summary": ["all"],
+                  "averages": ["merged", "all", "cell_type_averages"],
+                  "no_organs": ["merged", "all", "cell_type_averages", "cell_type_samples"]}
+ENRICHMENT_TABLE_TITLES = ["Total", "Top", "Enrichment-Top", "Bottom", "Depletion-Bottom", "Net Enrichment Factor"]
+
 
 def run_enrichment_analysis(destination_folder, file_id, formulations_sheet, csv_filepath, sorted_cells,
                             number_naked_bcs, x_percent, sample_numbers, remove_outlying_mouse, r2_threshold,
-                            remove_runaways, percentile):
+                            remove_runaways, percentile, export_format=None, shard_by=None,
+                            max_sheet_columns=EXCEL_MAX_COLUMNS, workers=None, outputs=None, memory_map_folder=None,
+                            significance=False, permutations=0, seed=0, interaction_order=None, weighted=False,
+                            running_sum=False, leave_one_out_mice=False, bootstrap=0, raw_counts_csv=None,
+                            rarefaction_depths=None, rarefaction_draws=100, correlation_method="pearson",
+                            iterative_outlier_removal=False, results_database=None, pool_method="sum",
+                            chunked=False):
     """
     run_enrichment_analysis : driver function, it uses all other functions to create enrichment analysis
         inputs:
@@ -21,7 +59,8 @@ def run_enrichment_analysis(destination_folder, file_id, formulations_sheet, csv
                                      saved
                 file_id : file identifier to be added at the end of the file name
                 formulations_sheet : file path to excel sheet of formulation sheet
-                csv_filepath : file path to csv file
+                csv_filepath : file path to csv file, or list of file paths to csv files of the same injections
+                               sequenced over several lanes or runs, joined on barcodes and pooled with pool_method
                 sorted_cells : user specified list of the sorted cell types
                 number_naked_bcs : user specified number of naked barcodes for an experiment
                 x_percent : user specified integer to find top and bottom performing LNPs (0-100)
@@ -30,89 +69,504 @@ def run_enrichment_analysis(destination_folder, file_id, formulations_sheet, csv
                 r2_threshold : r2 value used as threshold to flag outlying mice
                 remove_runaways : boolean to remove runaway LNPs
                 percentile : percentile of values accepted (default = 99.9%)
+                export_format : "parquet" or "feather" to also export every table in long format next to the excel
+                                file (optional input)
+                shard_by : "organ" or "cell_type" to write cell type and organ sheets into one workbook per organ or
+                           cell type, linked from an Index sheet (optional input)
+                max_sheet_columns : column budget of a sheet, wider sheets are split between rankings (default = 16384)
+                workers : number of processes writing sharded workbooks and running permutations, all cores if not given
+                outputs : name of an OUTPUT_PRESETS entry or list of OUTPUTS to create, tables that are not selected are
+                          not calculated (default = "full")
+                memory_map_folder : folder where the normalized counts are saved as memory-mapped matrices, read by
+                                    every stage instead of dataframes held in memory, in a subfolder of the run
+                                    removed at its end (optional input)
+                significance : boolean to add hypergeometric p-values and FDR q-values to the top, bottom and net
+                               enrichment factor tables
+                permutations : number of random rankings used to add empirical p-values to the net enrichment tables,
+                               no permutation test if 0 (default = 0)
+                seed : seed of the random rankings of the permutation test (default = 0)
+                interaction_order : 2 or 3 to add sheets with the enrichment of pairs or triples of components for
+                                    each cell type (optional input)
+                weighted : boolean to add count-weighted enrichment tables, each level's share of the normalized
+                           counts over its share of LNPs, next to the net enrichment tables
+                running_sum : boolean to add running-sum enrichment tables, threshold-free scores of each level along
+                              each ranking, with empirical p-values from a shared pool of permutations random rankings
+                leave_one_out_mice : boolean to add a Leave-One-Out sheet with the influence of each mouse on the net
+                                     enrichment factors of its cell type average
+                bootstrap : number of resamples of mice used to add confidence intervals to the net enrichment tables
+                            of the cell type averages, no bootstrap if 0 (default = 0)
+                raw_counts_csv : file path to csv file with the raw counts of the samples, adds a Rarefaction sheet
+                                 with the stability of the cell type rankings at lower sequencing depths (optional
+                                 input)
+                rarefaction_depths : list of numbers of reads drawn from each sample, the smallest depth of the mice if
+                                     not given (optional input)
+                rarefaction_draws : number of subsamples of the raw counts at each depth (default = 100)
+                correlation_method : correlation between mice used to flag outlying mice, "pearson", "spearman" or
+                                     "log-pearson" (default = "pearson")
+                iterative_outlier_removal : boolean to remove outlying mice one at a time, worst first, until no mouse
+                                            is flagged, and add an Outlier Removal sheet with the order of removal
+                                            and the r values
+                results_database : SQLite database where the enrichment tables of the run are added, under the name of
+                                   the workbook (optional input)
+                pool_method : "sum" or "mean" of the counts of a sample found in several csv files, renormalized to
+                              100 once pooled (default = "sum")
+                chunked : boolean to read, rank and write the samples of one organ at a time, with the normalized
+                          counts memory-mapped in memory_map_folder or a temporary folder, so memory depends on the
+                          largest organ. The cell type and organ sheets go into one workbook per organ, or per
+                          shard_by, linked from an Index sheet
+        output:
+                list_files : list of the files written, workbooks, long-format exports and job spec
     """
-    # order list of sorted cells alphabetically
-    sorted_cells.sort()
-
-    # create excel destination file
-    destination_file = create_excel_spreadsheet(destination_folder, file_id)
+    # the spec saved next to the workbook describes the run with the parameters as given
+    spec = job_spec(locals())
 
-    # Read formulation sheet and save as dataframe
-    df_formulations = create_df_formulation_sheet(formulations_sheet)
+    outputs = get_outputs(outputs)
+    sheet_mode = "a" if "merged" in outputs else "w"  # first sheet written replaces the empty spreadsheet
 
-    # list of components
-    list_components = df_formulations.columns.tolist()
-    list_components.pop(0)
-    list_components.pop(0)
-    list_components.pop()
+    if shard_by is not None and shard_by not in SHARD_BY:
+        raise ValueError("Shards must be by one of " + ", ".join(SHARD_BY) + ", got " + str(shard_by))
 
-    # Read CSV file and save as dataframe
-    df_norm_counts = create_df_norm_counts(csv_filepath, sample_numbers)
+    check_correlation_method(correlation_method)
+    check_pool_method(pool_method)
 
-    # Merge dataframes
-    df_merged = merge_formulations_and_norm_counts(df_formulations, df_norm_counts, destination_file,
-                                                   "Formulations + norm counts")
+    # chunked runs read the samples of each organ from memory-mapped matrices and write one workbook per organ by
+    # default
+    if chunked:
+        shard_by = shard_by or "organ"
 
-    # get ordered list of all samples
-    d_samples_by_cell_type = divide_samples_by_cell_type(df_merged, sorted_cells)
+    # the matrices of a run are saved in a folder of their own, inside memory_map_folder when given so that runs
+    # sharing it do not overwrite each other's matrices, removed at the end of the run whether it succeeds or fails
+    temporary_folder = None
+    if chunked or memory_map_folder is not None:
+        if memory_map_folder is not None:
+            os.makedirs(memory_map_folder, exist_ok=True)
+        temporary_folder = tempfile.TemporaryDirectory(prefix="enrichment_", dir=memory_map_folder)
+        memory_map_folder = temporary_folder.name
 
-    # remove outlying mice, turn into a function
-    if remove_outlying_mouse:
-        list_remove_samples = list_samples_to_remove(d_samples_by_cell_type, df_merged, r2_threshold)
-        print("Removed these samples:", list_remove_samples)
-        if len(list_remove_samples) != 0:
-            df_norm_counts = df_norm_counts.drop(list_remove_samples, axis=1)
-            df_merged = df_merged.drop(list_remove_samples, axis=1)
+    try:
+        permutation_test = None
+        if permutations > 0:
+            permutation_test = PermutationTest(permutations, seed, workers)
+
+        running_sum_test = RunningSumTest(permutations, seed) if running_sum else None
+
+        bootstrap_test = None
+        if bootstrap > 0:
+            bootstrap_test = BootstrapTest(bootstrap, seed, workers)
+
+        export = None
+        if export_format is not None:
+            check_export_format(export_format)
+        if export_format is not None or results_database is not None:
+            export = LongFormatExport()
+
+        # order list of sorted cells alphabetically
+        sorted_cells.sort()
+
+        # Read formulation sheet and CSV file at the same time, the counts as a dataframe or as a memory-mapped matrix
+        # read by every stage
+        df_formulations, df_norm_counts, count_store = load_inputs(formulations_sheet, csv_filepath, sample_numbers,
+                                                                   memory_map_folder, pool_method, workers)
+
+        # list of components
+        list_components = df_formulations.columns.tolist()
+        list_components.pop(0)
+        list_components.pop(0)
+        list_components.pop()
+
+        # every problem of the inputs is reported before any heavy work
+        if count_store is None:
+            check_inputs(df_formulations, list_components, df_norm_counts["BC"], df_norm_counts,
+                         get_columns(df_norm_counts), sorted_cells, sample_numbers, number_naked_bcs, x_percent,
+                         max_sheet_columns)
+        else:
+            check_inputs(df_formulations, list_components, count_store.barcodes, None, count_store.columns,
+                         sorted_cells, sample_numbers, number_naked_bcs, x_percent, max_sheet_columns)
 
-            for sample in list_remove_samples:
-                for cell_type, ct_samples in d_samples_by_cell_type.items():
-                    if cell_type in sample:
-                        ct_samples.remove(sample)
+        # create excel destination file
+        destination_file = create_excel_spreadsheet(destination_folder, file_id)
 
-    # remove runaways
-    if remove_runaways:
-        df_norm_counts, list_runaways = pull_out_runaways(df_norm_counts, percentile)
-        df_formulations = update_df_formulation(df_formulations, list_runaways)
+        merged_store = None
 
-        # Merge dataframes
-        df_merged = merge_formulations_and_norm_counts(df_formulations, df_norm_counts, destination_file,
-                                                       "Formulations + norm counts")
+        # Merge dataframes, the sheet is written once with the last merge
+        write_merged = "merged" in outputs and not remove_runaways
+        if count_store is None:
+            df_merged = merge_formulations_and_norm_counts(df_formulations, df_norm_counts,
+                                                           destination_file if write_merged else None,
+                                                           "Formulations + norm counts")
+        else:
+            df_merged, merged_store = merge_formulations_and_count_store(df_formulations, count_store,
+                                                                         destination_file if write_merged else None,
+                                                                         "Formulations + norm counts")
 
         # get ordered list of all samples
-        d_samples_by_cell_type = divide_samples_by_cell_type(df_merged, sorted_cells)
-
-    # divide samples by cell types
-    dict_df_avg_cell_type = df_cell_types(df_merged, d_samples_by_cell_type)
-    
-    # retrieve list of organs
-    list_organs = get_list_organs(sorted_cells)
-    
-    # organize samples by organ
-    dict_df_organs = df_by_organs(df_merged, sorted_cells, dict_df_avg_cell_type, list_organs)
-    df_overall = get_df_overall(dict_df_organs, df_formulations)
-
-    # sort normalized counts by overall average
-    df_sorted = sort_norm_counts(df_overall, -1)
-    
-    # get component information
-    dict_components = get_lists_of_components(df_formulations, list_components, number_naked_bcs)
-    
-    # dataframes for top and bottom performing LNPs
-    df_top, df_bottom = df_top_and_bottom(df_sorted, x_percent, number_naked_bcs)
-    
-    # create excel sheets
-    create_all_sheet(destination_file, dict_df_organs, df_overall, df_top, df_bottom, dict_components)
-    create_cell_type_sheets(destination_file, df_formulations, dict_df_avg_cell_type, dict_components,
-                            d_samples_by_cell_type, x_percent, number_naked_bcs)
+        d_samples_by_cell_type = divide_samples_by_cell_type(df_merged, sorted_cells, merged_store)
+
+        # remove outlying mice, turn into a function
+        outlier_layout = None
+        if remove_outlying_mouse:
+            if iterative_outlier_removal:
+                list_remove_samples, df_removal, dict_corr_matrices = list_samples_to_remove_iteratively(
+                    d_samples_by_cell_type, df_merged, r2_threshold, merged_store, correlation_method)
+                outlier_layout = outlier_removal_layout(df_removal, dict_corr_matrices)
+            else:
+                list_remove_samples = list_samples_to_remove(d_samples_by_cell_type, df_merged, r2_threshold,
+                                                             merged_store, correlation_method)
+            print("Removed these samples:", list_remove_samples)
+            if len(list_remove_samples) != 0:
+                if count_store is None:
+                    df_norm_counts = df_norm_counts.drop(list_remove_samples, axis=1)
+                    df_merged = df_merged.drop(list_remove_samples, axis=1)
+                else:
+                    list_keep_samples = [sample for sample in count_store.columns if sample not in list_remove_samples]
+                    count_store = count_store.reorder("norm_counts_no_outliers", range(len(count_store.barcodes)),
+                                                      list_keep_samples)
+                    if not remove_runaways:
+                        df_merged, merged_store = merge_formulations_and_count_store(df_formulations, count_store, None,
+                                                                                     "Formulations + norm counts")
+
+                for sample in list_remove_samples:
+                    for cell_type, ct_samples in d_samples_by_cell_type.items():
+                        if cell_type in sample:
+                            ct_samples.remove(sample)
+
+        # remove runaways
+        if remove_runaways:
+            if count_store is None:
+                df_norm_counts, list_runaways = pull_out_runaways(df_norm_counts, percentile)
+            else:
+                count_store, list_runaways = pull_out_runaways_from_store(count_store, percentile)
+            df_formulations = update_df_formulation(df_formulations, list_runaways)
+
+            # Merge dataframes
+            if count_store is None:
+                df_merged = merge_formulations_and_norm_counts(df_formulations, df_norm_counts,
+                                                               destination_file if "merged" in outputs else None,
+                                                               "Formulations + norm counts")
+            else:
+                df_merged, merged_store = merge_formulations_and_count_store(
+                    df_formulations, count_store, destination_file if "merged" in outputs else None,
+                    "Formulations + norm counts")
+
+            # get ordered list of all samples
+            d_samples_by_cell_type = divide_samples_by_cell_type(df_merged, sorted_cells, merged_store)
+
+        # get component information
+        dict_components = get_lists_of_components(df_formulations, list_components, number_naked_bcs)
+
+        # retrieve list of organs
+        list_organs = get_list_organs(sorted_cells)
+
+        dict_df_avg_cell_type = None
+        dict_df_organs = None
+        df_overall = None
+        list_layouts = [outlier_layout] if outlier_layout is not None else []
+        if chunked:
+            # one organ at a time, its sheets are written into its workbooks before the samples of the next one are read
+            dict_df_organs, df_overall, d_shard_files, leave_one_out_sheet = process_sample_groups(
+                destination_file, df_formulations, df_merged, df_norm_counts, merged_store, count_store,
+                d_samples_by_cell_type, list_organs, dict_components, sample_numbers, x_percent, number_naked_bcs,
+                outputs, shard_by, max_sheet_columns, export, significance, permutation_test, weighted,
+                running_sum_test, bootstrap_test, interaction_order, leave_one_out_mice)
+            if leave_one_out_sheet is not None:
+                list_layouts.append(leave_one_out_sheet)
+        else:
+            # divide samples by cell types
+            if outputs & {"all", "cell_type_averages", "cell_type_samples"} or interaction_order is not None or \
+                    leave_one_out_mice:
+                dict_df_avg_cell_type = df_cell_types(df_merged, d_samples_by_cell_type, merged_store)
+
+            if "all" in outputs:
+                # organize samples by organ
+                dict_df_organs = df_by_organs(df_merged, sorted_cells, dict_df_avg_cell_type, list_organs)
+                df_overall = get_df_overall(dict_df_organs, df_formulations)
+
+        if "all" in outputs:
+            # sort normalized counts by overall average
+            df_sorted = sort_norm_counts(df_overall, -1)
+
+            # dataframes for top and bottom performing LNPs
+            df_top, df_bottom = df_top_and_bottom(df_sorted, x_percent, number_naked_bcs)
+
+        if export is not None:
+            if chunked:
+                export_counts(export, df_merged, {}, None, None, df_overall)
+            else:
+                export_counts(export, df_merged, d_samples_by_cell_type, dict_df_avg_cell_type, dict_df_organs,
+                              df_overall, merged_store)
+
+        # create excel sheets
+        if "all" in outputs:
+            create_all_sheet(destination_file, dict_df_organs, df_overall, df_top, df_bottom, dict_components, export,
+                             sheet_mode, significance, permutation_test, weighted, running_sum_test)
+            sheet_mode = "a"
+
+        if outputs & {"cell_type_averages", "cell_type_samples"} and not chunked:
+            list_layouts += cell_type_sheet_layouts(df_formulations, dict_df_avg_cell_type, dict_components,
+                                                    d_samples_by_cell_type, x_percent, number_naked_bcs, export,
+                                                    include_average="cell_type_averages" in outputs,
+                                                    include_samples="cell_type_samples" in outputs,
+                                                    significance=significance, permutation_test=permutation_test,
+                                                    weighted=weighted, running_sum_test=running_sum_test,
+                                                    bootstrap_test=bootstrap_test)
+
+        if interaction_order is not None and not chunked:
+            list_layouts += interaction_sheet_layouts(df_formulations, dict_df_avg_cell_type, dict_components,
+                                                      d_samples_by_cell_type, x_percent, number_naked_bcs,
+                                                      interaction_order, export)
+
+        if leave_one_out_mice and not chunked:
+            list_layouts.append(leave_one_out_layout(df_formulations, dict_df_avg_cell_type, dict_components,
+                                                     d_samples_by_cell_type, x_percent, number_naked_bcs, export))
+
+        if raw_counts_csv is not None:
+            list_layouts.append(rarefaction_layout(df_merged, create_df_norm_counts(raw_counts_csv, sample_numbers),
+                                                   dict_components, d_samples_by_cell_type, x_percent,
+                                                   number_naked_bcs, RarefactionTest(rarefaction_depths,
+                                                                                     rarefaction_draws, seed, workers),
+                                                   export))
+
+        if "organs" in outputs and not chunked:
+            d_organ_sheet_columns = get_column_names_organ_sheets(d_samples_by_cell_type, list_organs, sample_numbers)
+
+            if count_store is not None:
+                df_norm_counts = count_store.frame()
+            list_layouts += organ_sheet_layouts(df_formulations, df_norm_counts, dict_components, d_organ_sheet_columns,
+                                                x_percent, number_naked_bcs, export, significance, permutation_test,
+                                                weighted, running_sum_test)
+
+        list_files = [destination_file]
+        if chunked:
+            # sheets that are not by organ stay in the excel spreadsheet, next to the Index of the workbooks
+            if len(list_layouts) != 0:
+                write_sheet_layouts(destination_file, list_layouts, max_sheet_columns, sheet_mode)
+                sheet_mode = "a"
+            if len(d_shard_files) != 0:
+                write_index_sheet(destination_file, d_shard_files, sheet_mode)
+                print("Wrote workbooks:", list(d_shard_files))
+                list_files += list(d_shard_files)
+        elif len(list_layouts) != 0:
+            if shard_by is None:
+                write_sheet_layouts(destination_file, list_layouts, max_sheet_columns, sheet_mode)
+            else:
+                d_shard_files = write_sharded_workbooks(destination_file, list_layouts, shard_by, max_sheet_columns,
+                                                        workers, sheet_mode)
+                print("Wrote workbooks:", list(d_shard_files))
+                list_files += list(d_shard_files)
+
+        if export_format is not None:
+            list_export_files = export.write(destination_file, export_format)
+            print("Exported long-format tables:", list_export_files)
+            list_files += list_export_files
+
+        if results_database is not None:
+            store_results(results_database, destination_file, export)
+
+        save_spec(spec, spec_file(destination_file))
+        list_files.append(spec_file(destination_file))
+
+        return list_files
+    finally:
+        if temporary_folder is not None:
+            temporary_folder.cleanup()
+
+
+def store_results(results_database, destination_file, export):
+    """
+    store_results : adds the enrichment tables of a run to a SQLite results database
+        inputs:
+            results_database : path of the database
+            destination_file : directory of the excel spreadsheet created, its name names the experiment
+            export : LongFormatExport with the tables of the run
+    """
+    experiment = os.path.splitext(os.path.basename(destination_file))[0]
+    store = ResultsStore(results_database)
+    try:
+        store.add_run(experiment, export.enrichment_table(), os.path.abspath(destination_file))
+    finally:
+        store.close()
+    print("Stored enrichment tables of " + experiment + " in " + results_database)
+
+
+def get_outputs(outputs):
+    """
+    get_outputs : set of outputs to create
+        inputs:
+            outputs : name of an OUTPUT_PRESETS entry or list of OUTPUTS, all outputs if None
+        output:
+            set_outputs : set of names of the outputs to create
+    """
+    if outputs is None:
+        outputs = "full"
+    if isinstance(outputs, str):
+        if outputs not in OUTPUT_PRESETS:
+            raise ValueError("Outputs must be one of " + ", ".join(OUTPUT_PRESETS) + ", got " + outputs)
+        outputs = OUTPUT_PRESETS[outputs]
+
+    set_outputs = set(outputs)
+    unknown = set_outputs - set(OUTPUTS)
+    if len(unknown) != 0:
+        raise ValueError("Unknown outputs: " + ", ".join(sorted(unknown)) + ", choose from " + ", ".join(OUTPUTS))
+    if len(set_outputs) == 0:
+        raise ValueError("At least one output must be selected")
+
+    return set_outputs
 
+
+def export_counts(export, df_merged, d_samples_by_cell_type, dict_df_avg_cell_type, dict_df_organs, df_overall,
+                  count_store=None):
+    """
+    export_counts : adds normalized counts of every sample and the cell type, organ and overall averages to the
+                    long-format export
+        inputs:
+            export : LongFormatExport collecting the tables
+            df_merged : dataframe containing formulation information and normalized counts
+            d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            dict_df_avg_cell_type : dictionary with averaged dataframes of each cell type, None if not calculated
+            dict_df_organs : dictionary containing dataframes of all organs, None if not calculated
+            df_overall : dataframe with overall average, None if not calculated
+            count_store : CountStore with the normalized counts of df_merged, read instead of df_merged (optional input)
+    """
+    for cell_type, samples in d_samples_by_cell_type.items():
+        for sample in samples:
+            export.add_counts(table_key("sample", cell_type[0], cell_type, sample), df_merged,
+                              get_df_cell_type(df_merged, [sample], count_store)[sample])
+
+    if dict_df_avg_cell_type is not None:
+        for cell_type, df_cell_type in dict_df_avg_cell_type.items():
+            export.add_counts(table_key("cell_type", cell_type[0], cell_type), df_merged, df_cell_type[cell_type],
+                              std=df_cell_type["std"])
+
+    if dict_df_organs is not None:
+        for organ, df_organ in dict_df_organs.items():
+            export.add_counts(table_key("organ", organ), df_merged, df_organ[organ + "-AVG"])
+
+    if df_overall is not None:
+        export.add_counts(table_key("overall"), df_overall, df_overall["Overall-AVG"])
+
+
+def process_sample_groups(destination_file, df_formulations, df_merged, df_norm_counts, merged_store, count_store,
+                          d_samples_by_cell_type, list_organs, dict_components, sample_numbers, x_percent,
+                          number_naked_bcs, outputs, shard_by, max_sheet_columns=EXCEL_MAX_COLUMNS, export=None,
+                          significance=False, permutation_test=None, weighted=False, running_sum_test=None,
+                          bootstrap_test=None, interaction_order=None, leave_one_out_mice=False):
+    """
+    process_sample_groups : creates the cell type and organ sheets one organ at a time. Only the samples of the organ
+                            are read, its averages, rankings and enrichment tables are calculated and its sheets are
+                            written into its workbooks before the next organ is read, so memory depends on the largest
+                            organ. The overall average is a running sum of the organ averages
+        inputs:
+            destination_file : directory of the excel spreadsheet created, the workbooks are named after it
+            df_formulations : dataframe with formulations sheet
+            df_merged : dataframe containing formulation information and normalized counts
+            df_norm_counts : dataframe with normalized counts, None with a count_store
+            merged_store : CountStore with the normalized counts of df_merged (optional input)
+            count_store : CountStore with normalized counts, read instead of df_norm_counts (optional input)
+            d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            list_organs : list of organs sorted
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            sample_numbers : numbers with sample values for an experiment
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            outputs : set of OUTPUTS to create
+            shard_by : "organ" or "cell_type", workbooks the sheets are written into
+            max_sheet_columns : column budget of a sheet
+            export : LongFormatExport collecting the tables (optional input)
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            weighted : boolean to add count-weighted enrichment tables next to the net enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
+            bootstrap_test : BootstrapTest adding confidence intervals to the net enrichment tables of the averages
+                             (optional input)
+            interaction_order : 2 or 3 to add sheets with the enrichment of combinations of components (optional input)
+            leave_one_out_mice : boolean to lay out the Leave-One-Out sheet, a section per cell type
+        output:
+            dict_df_organs : dictionary containing dataframes of all organs, None if "all" is not in outputs
+            df_overall : dataframe with overall average, None if "all" is not in outputs
+            d_shard_files : dictionary with the sheets written in each workbook
+            leave_one_out_sheet : layout of the Leave-One-Out sheet, None if not asked for
+    """
+    dict_cells_by_organs = get_dict_cells_organs(list(d_samples_by_cell_type), list_organs)
     d_organ_sheet_columns = get_column_names_organ_sheets(d_samples_by_cell_type, list_organs, sample_numbers)
+    averages = outputs & {"all", "cell_type_averages", "cell_type_samples"} or interaction_order is not None or \
+        leave_one_out_mice
 
-    create_organ_sheet(destination_file, df_formulations, df_norm_counts, dict_components, d_organ_sheet_columns,
-                       x_percent, number_naked_bcs)
+    dict_df_organs = {} if "all" in outputs else None
+    overall_sum = None
+    overall_count = None
+    d_shard_files = {}
+    leave_one_out_sheet = SheetLayout("Leave-One-Out") if leave_one_out_mice else None
+
+    for organ in list_organs:
+        d_group_samples = {cell_type: d_samples_by_cell_type[cell_type] for cell_type in dict_cells_by_organs[organ]}
+
+        d_group_avg = None
+        if averages:
+            d_group_avg = df_cell_types(df_merged, d_group_samples, merged_store)
+
+        list_group_layouts = []
+        if outputs & {"cell_type_averages", "cell_type_samples"}:
+            list_group_layouts += cell_type_sheet_layouts(df_formulations, d_group_avg, dict_components,
+                                                          d_group_samples, x_percent, number_naked_bcs, export,
+                                                          include_average="cell_type_averages" in outputs,
+                                                          include_samples="cell_type_samples" in outputs,
+                                                          significance=significance,
+                                                          permutation_test=permutation_test, weighted=weighted,
+                                                          running_sum_test=running_sum_test,
+                                                          bootstrap_test=bootstrap_test)
+
+        if interaction_order is not None:
+            list_group_layouts += interaction_sheet_layouts(df_formulations, d_group_avg, dict_components,
+                                                            d_group_samples, x_percent, number_naked_bcs,
+                                                            interaction_order, export)
+
+        if leave_one_out_mice:
+            leave_one_out_sheet.sections += leave_one_out_layout(df_formulations, d_group_avg, dict_components,
+                                                                 d_group_samples, x_percent, number_naked_bcs,
+                                                                 export).sections
+
+        if "organs" in outputs:
+            organ_columns = list(dict.fromkeys(sample for samples in d_organ_sheet_columns[organ].values()
+                                               for sample in samples))
+            list_group_layouts += organ_sheet_layouts(df_formulations,
+                                                      get_df_cell_type(df_norm_counts, organ_columns, count_store),
+                                                      dict_components, {organ: d_organ_sheet_columns[organ]},
+                                                      x_percent, number_naked_bcs, export, significance,
+                                                      permutation_test, weighted, running_sum_test)
+
+        d_df_organ = None
+        if dict_df_organs is not None:
+            d_df_organ = df_by_organs(df_merged, dict_cells_by_organs[organ], d_group_avg, [organ])
+            dict_df_organs[organ] = d_df_organ[organ]
+
+            # running sum of the organ averages, missing averages are left out like in get_df_overall
+            organ_avg = dict_df_organs[organ][organ + "-AVG"]
+            overall_sum = organ_avg.fillna(0) if overall_sum is None else overall_sum + organ_avg.fillna(0)
+            overall_count = organ_avg.notna().astype(int) if overall_count is None else \
+                overall_count + organ_avg.notna()
+
+        if export is not None:
+            export_counts(export, df_merged, d_group_samples, d_group_avg, d_df_organ, None, merged_store)
+
+        for shard_file, list_shard_layouts in shard_layouts(destination_file, list_group_layouts, shard_by,
+                                                            max_sheet_columns).items():
+            d_shard_files[shard_file] = write_sheet_layouts(shard_file, list_shard_layouts, max_sheet_columns, "w")
+
+        # the samples of the organ and the tables laid out from them are released before the next organ is read
+        del d_group_avg, list_group_layouts
+
+    df_overall = None
+    if dict_df_organs is not None:
+        df_overall = pd.concat([df_formulations] + [dict_df_organs[organ][organ + "-AVG"] for organ in dict_df_organs],
+                               axis=1)
+        df_overall["Overall-AVG"] = overall_sum / overall_count.where(overall_count != 0)
+
+    return dict_df_organs, df_overall, d_shard_files, leave_one_out_sheet
 
 
 def create_organ_sheet(destination_file, df_formulations, df_norm_counts, dict_components, d_organ_sheet_columns,
-                       x_percent, number_naked_bcs):
+                       x_percent, number_naked_bcs, export=None, significance=False, permutation_test=None,
+                       weighted=False, running_sum_test=None):
     """
     create_organ_sheet : creates excel sheets for organs with data organized by mouse for all cell types in that organ
         inputs:
@@ -123,89 +577,67 @@ def create_organ_sheet(destination_file, df_formulations, df_norm_counts, dict_c
             d_organ_sheet_columns : creates a dictionary with the name of the columns for each organ sheet
             x_percent : user specified integer to find top and bottom performing LNPs (0-100)
             number_naked_bcs : user specified number of naked barcodes for an experiment
+            export : LongFormatExport collecting the tables (optional input)
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            weighted : boolean to add count-weighted enrichment tables next to the net enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
     """
-    positions_dict = {}
-    with pd.ExcelWriter(destination_file, engine="openpyxl", mode="a") \
-            as writer:  # pylint: disable=abstract-class-instantiated
-        for organ in d_organ_sheet_columns:
-            current_col = 0  # variable to place formulation enrichments by mole ratio
-
-            positions_organ_samples = {}
-            for sample_num in d_organ_sheet_columns[organ]:
-                df_mouse = df_norm_counts[d_organ_sheet_columns[organ][sample_num]]
-                avg = df_mouse.mean(axis=1)
-
-                # sorted averaged cell type dataframe
-                temp_df = pd.concat([df_formulations, df_mouse], axis=1)
-                avg_col_name = sample_num + "-AVG"
-                temp_df[avg_col_name] = avg
-
-                df_sorted_avg = sort_norm_counts(temp_df, -1)  # sort by avg
-
-                df_sorted_avg.to_excel(writer, sheet_name=organ, startrow=0, startcol=current_col, index=False)
-
-                # top & bottom
-                df_top_avg, df_bottom_avg = df_top_and_bottom(df_sorted_avg, x_percent, number_naked_bcs)
-
-                d_df_avg_components_top, d_df_avg_components_bottom = top_bottom_enrichment(df_sorted_avg,
-                                                                                            dict_components, df_top_avg,
-                                                                                            df_bottom_avg)
-                # total
-                dict_df_component_enrichments = get_overall_enrichment(df_sorted_avg, dict_components)
-
-                d_df_component_net_enrichment, d_df_enrichment_factors_top, d_df_enrichment_factors_bottom = \
-                    net_enrichment_factor(dict_df_component_enrichments, d_df_avg_components_top,
-                                          d_df_avg_components_bottom, sort_by=avg_col_name)
-
-                current_col += len(temp_df.columns) + 1
-
-                df_top_avg.to_excel(writer, sheet_name=organ, startrow=0, startcol=current_col, index=False)
-
-                current_row = len(df_top_avg) + 2
+    write_sheet_layouts(destination_file, organ_sheet_layouts(df_formulations, df_norm_counts, dict_components,
+                                                              d_organ_sheet_columns, x_percent, number_naked_bcs,
+                                                              export, significance, permutation_test, weighted,
+                                                              running_sum_test))
 
-                df_bottom_avg.to_excel(writer, sheet_name=organ, startrow=current_row, startcol=current_col,
-                                       index=False)
 
-                current_col += len(df_top_avg.columns) + 1
-                current_row = 1
-                start_col_enrichment_tables = current_col + 1
-
-                positions_organ_samples[sample_num] = start_col_enrichment_tables
+def organ_sheet_layouts(df_formulations, df_norm_counts, dict_components, d_organ_sheet_columns, x_percent,
+                        number_naked_bcs, export=None, significance=False, permutation_test=None, weighted=False,
+                        running_sum_test=None):
+    """
+    organ_sheet_layouts : lays out the sheets for organs with data organized by mouse for all cell types in that organ
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            df_norm_counts : dataframe with normalized counts
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            d_organ_sheet_columns : creates a dictionary with the name of the columns for each organ sheet
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes for an experiment
+            export : LongFormatExport collecting the tables (optional input)
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            weighted : boolean to add count-weighted enrichment tables next to the net enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
+        output:
+            list_layouts : list of sheet layouts, one per organ
+    """
+    # the enrichment of all LNPs does not depend on how they are ranked
+    dict_df_component_enrichments = get_overall_enrichment(df_formulations, dict_components)
 
-                for component in dict_df_component_enrichments:
-                    dict_df_component_enrichments[component].to_excel(writer, sheet_name=organ, startrow=current_row,
-                                                                      startcol=current_col, index=False)
-                    d_df_avg_components_top[component].to_excel(writer, sheet_name=organ, startrow=current_row,
-                                                                startcol=current_col + 4, index=False)
-                    d_df_enrichment_factors_top[component].to_excel(writer, sheet_name=organ, startrow=current_row,
-                                                                    startcol=current_col + 8, index=False)
-                    d_df_avg_components_bottom[component].to_excel(writer, sheet_name=organ, startrow=current_row,
-                                                                   startcol=current_col + 11, index=False)
-                    d_df_enrichment_factors_bottom[component].to_excel(writer, sheet_name=organ, startrow=current_row,
-                                                                       startcol=current_col + 15, index=False)
-                    d_df_component_net_enrichment[component].to_excel(writer, sheet_name=organ, startrow=current_row,
-                                                                      startcol=current_col + 18, index=False)
+    list_layouts = []
+    for organ in d_organ_sheet_columns:
+        layout = SheetLayout(organ, organ)
 
-                    current_row += len(dict_df_component_enrichments[component]) + 2
+        views = []
+        for sample_num in d_organ_sheet_columns[organ]:
+            df_mouse = df_norm_counts[d_organ_sheet_columns[organ][sample_num]]
+            avg_col_name = sample_num + "-AVG"
+            df_mouse[avg_col_name] = df_mouse.mean(axis=1)
 
-                current_col += 21
+            view = RankedView(df_formulations, df_mouse, avg_col_name)  # sort by avg
+            key = table_key("mouse", organ, sample=sample_num)
+            if export is not None:
+                export.add_counts(key, view.df_formulations, view.df_values[avg_col_name])
+            views.append((view, key))
 
-            positions_dict[organ] = positions_organ_samples
+        list_extra_tables = extra_tables_by_view([view for view, _ in views], dict_components, weighted,
+                                                 running_sum_test)
+        for (view, key), extra_tables in zip(views, list_extra_tables):
+            layout.add_section(*ranked_view_section(view, dict_components, dict_df_component_enrichments, x_percent,
+                                                    number_naked_bcs, export, key, significance, permutation_test,
+                                                    extra_tables))
 
-    xfile = openpyxl.load_workbook(destination_file)
+        list_layouts.append(layout)
 
-    for organ in d_organ_sheet_columns:
-        sheet = xfile[organ]
-        start_col_enrichment_tables = positions_dict[organ]
-        mouse_samples = d_organ_sheet_columns[organ]
-        for sample in mouse_samples:
-            sheet.cell(row=1, column=start_col_enrichment_tables[sample]).value = "Total"
-            sheet.cell(row=1, column=start_col_enrichment_tables[sample] + 4).value = "Top"
-            sheet.cell(row=1, column=start_col_enrichment_tables[sample] + 8).value = "Enrichment-Top"
-            sheet.cell(row=1, column=start_col_enrichment_tables[sample] + 11).value = "Bottom"
-            sheet.cell(row=1, column=start_col_enrichment_tables[sample] + 15).value = "Depletion-Bottom"
-            sheet.cell(row=1, column=start_col_enrichment_tables[sample] + 18).value = "Net Enrichment Factor"
-    xfile.save(destination_file)
+    return list_layouts
 
 
 def get_column_names_organ_sheets(d_samples_by_cell_type, list_organs, sample_numbers):
@@ -259,7 +691,8 @@ def get_dict_organs_by_cell_type(d_samples_by_cell_type, list_organs):
 
 
 def create_cell_type_sheets(destination_file, df_formulations, dict_df_avg_cell_type, dict_components,
-                            d_samples_by_cell_type, x_percent, number_naked_bcs):
+                            d_samples_by_cell_type, x_percent, number_naked_bcs, export=None, significance=False,
+                            permutation_test=None, weighted=False, running_sum_test=None):
     """
     create_cell_type_sheets: creates an excel sheets for all cell types with enrichment calculations for average and
         each sample
@@ -271,131 +704,328 @@ def create_cell_type_sheets(destination_file, df_formulations, dict_df_avg_cell_
             d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
             x_percent : user specified integer to find top and bottom performing LNPs (0-100)
             number_naked_bcs : user specified number of naked barcodes
+            export : LongFormatExport collecting the tables (optional input)
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            weighted : boolean to add count-weighted enrichment tables next to the net enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
         """
-    positions_dict = {}
-    with pd.ExcelWriter(destination_file, engine="openpyxl", mode="a") \
-            as writer:  # pylint: disable=abstract-class-instantiated
-        for cell_type in dict_df_avg_cell_type:
-            current_col = 0  # variable to place formulation enrichments by mole ratio
-
-            # sorted averaged cell type dataframe
-            temp_df = pd.concat([df_formulations, dict_df_avg_cell_type[cell_type]], axis=1)
-            df_sorted_avg = sort_norm_counts(temp_df, -2)  # sort by avg
-            df_sorted_avg.to_excel(writer, sheet_name=cell_type, startrow=0, startcol=current_col, index=False)
-
-            # top & bottom
-            df_top_avg, df_bottom_avg = df_top_and_bottom(df_sorted_avg, x_percent, number_naked_bcs)
-
-            d_df_avg_components_top, d_df_avg_components_bottom = top_bottom_enrichment(df_sorted_avg, dict_components,
-                                                                                        df_top_avg, df_bottom_avg)
-
-            # total
-            dict_df_component_enrichments = get_overall_enrichment(df_sorted_avg, dict_components)
-
-            d_df_component_net_enrichment, d_df_enrichment_factors_top, d_df_enrichment_factors_bottom = \
-                net_enrichment_factor(dict_df_component_enrichments, d_df_avg_components_top,
-                                      d_df_avg_components_bottom, sort_by=cell_type)
-
-            current_col += len(temp_df.columns) + 1
-
-            df_top_avg.to_excel(writer, sheet_name=cell_type, startrow=0, startcol=current_col, index=False)
-
-            current_row = len(df_top_avg) + 2
-
-            df_bottom_avg.to_excel(writer, sheet_name=cell_type, startrow=current_row, startcol=current_col,
-                                   index=False)
-
-            current_col += len(df_top_avg.columns) + 1
-            current_row = 1
-            start_col_enrichment_tables = current_col + 1
-            positions_dict[cell_type] = start_col_enrichment_tables
-
-            for component in dict_df_component_enrichments:
-                dict_df_component_enrichments[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                  startcol=current_col, index=False)
-                d_df_avg_components_top[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                            startcol=current_col + 4, index=False)
-                d_df_enrichment_factors_top[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                startcol=current_col + 8, index=False)
-                d_df_avg_components_bottom[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                               startcol=current_col + 11, index=False)
-                d_df_enrichment_factors_bottom[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                   startcol=current_col + 15, index=False)
-                d_df_component_net_enrichment[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                  startcol=current_col + 18, index=False)
-
-                current_row += len(dict_df_component_enrichments[component]) + 2
-
-            current_col += 21
-
-            for sample_cell_type in d_samples_by_cell_type[cell_type]:
-                df_sample = dict_df_avg_cell_type[cell_type][sample_cell_type]
-                temp_df = pd.concat([df_formulations, df_sample], axis=1)
-                df_sorted = sort_norm_counts(temp_df, -1)  # sort by sample
-
-                df_sorted.to_excel(writer, sheet_name=cell_type, startrow=0, startcol=current_col, index=False)
-
-                current_col += len(df_sorted.columns) + 1
-
-                # top & bottom
-                df_top_avg, df_bottom_avg = df_top_and_bottom(df_sorted, x_percent, number_naked_bcs)
-
-                d_df_avg_components_top, d_df_avg_components_bottom = top_bottom_enrichment(df_sorted,
-                                                                                            dict_components, df_top_avg,
-                                                                                            df_bottom_avg)
-
-                # total
-                dict_df_component_enrichments = get_overall_enrichment(df_sorted, dict_components)
-
-                d_df_component_net_enrichment, d_df_enrichment_factors_top, d_df_enrichment_factors_bottom = \
-                    net_enrichment_factor(dict_df_component_enrichments, d_df_avg_components_top,
-                                          d_df_avg_components_bottom, sort_by=sample_cell_type)
-
-                df_top_avg.to_excel(writer, sheet_name=cell_type, startrow=0, startcol=current_col, index=False)
-
-                current_row = len(df_top_avg) + 2
-
-                df_bottom_avg.to_excel(writer, sheet_name=cell_type, startrow=current_row, startcol=current_col,
-                                       index=False)
-
-                current_col += len(df_top_avg.columns) + 1
-                current_row = 1
-
-                for component in dict_df_component_enrichments:
-                    dict_df_component_enrichments[component].to_excel(writer, sheet_name=cell_type,
-                                                                      startrow=current_row,
-                                                                      startcol=current_col, index=False)
-                    d_df_avg_components_top[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                startcol=current_col + 4, index=False)
-                    d_df_enrichment_factors_top[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                    startcol=current_col + 8, index=False)
-                    d_df_avg_components_bottom[component].to_excel(writer, sheet_name=cell_type, startrow=current_row,
-                                                                   startcol=current_col + 11, index=False)
-                    d_df_enrichment_factors_bottom[component].to_excel(writer, sheet_name=cell_type,
-                                                                       startrow=current_row,
-                                                                       startcol=current_col + 15, index=False)
-                    d_df_component_net_enrichment[component].to_excel(writer, sheet_name=cell_type,
-                                                                      startrow=current_row,
-                                                                      startcol=current_col + 18, index=False)
+    write_sheet_layouts(destination_file, cell_type_sheet_layouts(df_formulations, dict_df_avg_cell_type,
+                                                                  dict_components, d_samples_by_cell_type, x_percent,
+                                                                  number_naked_bcs, export,
+                                                                  significance=significance,
+                                                                  permutation_test=permutation_test,
+                                                                  weighted=weighted,
+                                                                  running_sum_test=running_sum_test))
+
+
+def cell_type_sheet_layouts(df_formulations, dict_df_avg_cell_type, dict_components, d_samples_by_cell_type,
+                            x_percent, number_naked_bcs, export=None, include_average=True, include_samples=True,
+                            significance=False, permutation_test=None, weighted=False, running_sum_test=None,
+                            bootstrap_test=None):
+    """
+    cell_type_sheet_layouts : lays out the sheets for all cell types with enrichment calculations for average and each
+                              sample
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            dict_df_avg_cell_type : dictionary with averaged dataframes of each cell type
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            export : LongFormatExport collecting the tables (optional input)
+            include_average : boolean to lay out the ranking by the cell type average
+            include_samples : boolean to lay out the ranking by each sample
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            weighted : boolean to add count-weighted enrichment tables next to the net enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
+            bootstrap_test : BootstrapTest adding confidence intervals to the net enrichment tables of the averages
+                             (optional input)
+        output:
+            list_layouts : list of sheet layouts, one per cell type
+    """
+    # the enrichment of all LNPs does not depend on how they are ranked
+    dict_df_component_enrichments = get_overall_enrichment(df_formulations, dict_components)
 
-                    current_row += len(dict_df_component_enrichments[component]) + 2
-                current_col += 21
-    xfile = openpyxl.load_workbook(destination_file)
+    list_layouts = []
     for cell_type in dict_df_avg_cell_type:
-        sheet = xfile[cell_type]
-        start_col_enrichment_tables = positions_dict[cell_type]
-        for i in range(len(d_samples_by_cell_type[cell_type]) + 1):
-            sheet.cell(row=1, column=start_col_enrichment_tables).value = "Total"
-            sheet.cell(row=1, column=start_col_enrichment_tables + 4).value = "Top"
-            sheet.cell(row=1, column=start_col_enrichment_tables + 8).value = "Enrichment-Top"
-            sheet.cell(row=1, column=start_col_enrichment_tables + 11).value = "Bottom"
-            sheet.cell(row=1, column=start_col_enrichment_tables + 15).value = "Depletion-Bottom"
-            sheet.cell(row=1, column=start_col_enrichment_tables + 18).value = "Net Enrichment Factor"
-            start_col_enrichment_tables += 47
-    xfile.save(destination_file)
+        layout = SheetLayout(cell_type, cell_type[0])
+        df_cell_type = dict_df_avg_cell_type[cell_type]
+
+        # sorted averaged cell type dataframe, then each sample on its own
+        views = []
+        if include_average:
+            view = RankedView(df_formulations, df_cell_type, cell_type)
+            samples = d_samples_by_cell_type[cell_type]
+            d_intervals = None
+            if bootstrap_test is not None and len(samples) > 1:
+                d_intervals = bootstrap_test.intervals(view.df_formulations, dict_components, view.df_values[samples],
+                                                       x_percent, number_naked_bcs)
+            views.append((view, table_key("cell_type", cell_type[0], cell_type), d_intervals))
+        for sample_cell_type in d_samples_by_cell_type[cell_type] if include_samples else []:
+            views.append((RankedView(df_formulations, df_cell_type[sample_cell_type].to_frame(), sample_cell_type),
+                          table_key("sample", cell_type[0], cell_type, sample_cell_type), None))
+
+        list_extra_tables = extra_tables_by_view([view for view, _, _ in views], dict_components, weighted,
+                                                 running_sum_test)
+        for (view, key, d_intervals), extra_tables in zip(views, list_extra_tables):
+            layout.add_section(*ranked_view_section(view, dict_components, dict_df_component_enrichments, x_percent,
+                                                    number_naked_bcs, export, key, significance, permutation_test,
+                                                    extra_tables, d_intervals))
+
+        list_layouts.append(layout)
+
+    return list_layouts
+
+
+def interaction_sheet_layouts(df_formulations, dict_df_avg_cell_type, dict_components, d_samples_by_cell_type,
+                              x_percent, number_naked_bcs, order=2, export=None):
+    """
+    interaction_sheet_layouts : lays out one sheet per cell type with the enrichment of combinations of components, for
+                                the cell type average and each sample. Every ranking is counted at once
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            dict_df_avg_cell_type : dictionary with averaged dataframes of each cell type
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            order : number of components combined, 2 for pairs or 3 for triples
+            export : LongFormatExport collecting the tables (optional input)
+        output:
+            list_layouts : list of sheet layouts, one per cell type
+    """
+    list_views = []
+    for cell_type, df_cell_type in dict_df_avg_cell_type.items():
+        list_views.append((cell_type, RankedView(df_formulations, df_cell_type, cell_type),
+                           table_key("cell_type", cell_type[0], cell_type)))
+        for sample_cell_type in d_samples_by_cell_type[cell_type]:
+            list_views.append((cell_type, RankedView(df_formulations, df_cell_type[sample_cell_type].to_frame(),
+                                                     sample_cell_type),
+                               table_key("sample", cell_type[0], cell_type, sample_cell_type)))
+    if len(list_views) == 0:
+        return []
+
+    # every view ranks the same formulations, aligned with the cell type dataframes
+    list_rankings = [(view.sort_by,) + tuple(view.top_and_bottom(x_percent, number_naked_bcs))
+                     for _, view, _ in list_views]
+    list_ranking_tables = interaction_tables(list_views[0][1].df_formulations, dict_components, list_rankings, order)
+
+    d_layouts = {}
+    for (cell_type, view, key), list_tables in zip(list_views, list_ranking_tables):
+        if cell_type not in d_layouts:
+            d_layouts[cell_type] = SheetLayout(cell_type + " Interactions", cell_type[0])
+
+        # name of the ranking above the titles of the tables
+        table_blocks, titles, width = enrichment_table_blocks(0, list_tables)
+        blocks = [(table, startrow + 1, startcol) for table, startrow, startcol in table_blocks]
+        titles = [(0, 0, view.sort_by)] + [(row + 1, col, text) for row, col, text in titles]
+        d_layouts[cell_type].add_section(blocks, titles, max(width, 2))
+
+        if export is not None:
+            export.add_enrichment(key, list_tables)
+
+    return list(d_layouts.values())
+
+
+def leave_one_out_layout(df_formulations, dict_df_avg_cell_type, dict_components, d_samples_by_cell_type, x_percent,
+                         number_naked_bcs, export=None):
+    """
+    leave_one_out_layout : lays out the Leave-One-Out sheet, the influence of each mouse on the ranking by the average
+                           of its cell type, one section per cell type with more than one mouse
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            dict_df_avg_cell_type : dictionary with averaged dataframes of each cell type
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            export : LongFormatExport collecting the tables (optional input)
+        output:
+            layout : sheet layout
+    """
+    layout = SheetLayout("Leave-One-Out")
+    for cell_type, df_cell_type in dict_df_avg_cell_type.items():
+        samples = d_samples_by_cell_type[cell_type]
+        if len(samples) < 2:
+            continue
+
+        # same alignment of formulations and normalized counts as the cell type sheet
+        view = RankedView(df_formulations, df_cell_type, cell_type)
+        df_influence, df_changes = leave_one_out(view.df_formulations, dict_components, view.df_values[samples],
+                                                 x_percent, number_naked_bcs)
+
+        blocks = [(df_influence, 1, 0), (df_changes, len(df_influence) + 3, 0)]
+        layout.add_section(blocks, [(0, 0, cell_type)], len(df_changes.columns) + 1)
+
+        if export is not None:
+            export.add_influence(table_key("cell_type", cell_type[0], cell_type), df_influence)
+
+    return layout
+
+
+def rarefaction_layout(df_merged, df_raw_counts, dict_components, d_samples_by_cell_type, x_percent, number_naked_bcs,
+                       rarefaction_test, export=None):
+    """
+    rarefaction_layout : lays out the Rarefaction sheet, how stable the ranking of each cell type is when the raw
+                         counts are subsampled to lower sequencing depths
+        inputs:
+            df_merged : dataframe containing formulation information and normalized counts
+            df_raw_counts : dataframe with raw counts, barcodes in the BC column and one column per sample
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            d_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            rarefaction_test : RarefactionTest with the depths and number of draws
+            export : LongFormatExport collecting the tables (optional input)
+        output:
+            layout : sheet layout
+    """
+    df_report = rarefaction_test.stability(df_merged, df_raw_counts, dict_components, d_samples_by_cell_type,
+                                           x_percent, number_naked_bcs)
+
+    layout = SheetLayout("Rarefaction")
+    layout.add_section([(df_report, 1, 0)], [(0, 0, "Stability of top and bottom performing LNPs by depth")],
+                       len(df_report.columns) + 1)
+
+    if export is not None:
+        for cell_type, df in df_report.groupby("Cell type", sort=False):
+            export.add_rarefaction(table_key("cell_type", cell_type[0], cell_type), df)
+
+    return layout
+
+
+def ranked_view_section(view, dict_components, dict_df_component_enrichments, x_percent, number_naked_bcs,
+                        export=None, key=None, significance=False, permutation_test=None, extra_tables=None,
+                        d_intervals=None):
+    """
+    ranked_view_section : lays out the sorted table, top and bottom tables and enrichment tables of a ranking side by
+                          side
+        inputs:
+            view : RankedView of the formulations by the column to sort by
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            dict_df_component_enrichments : dictionary with enrichment tables of all LNPs
+            x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+            number_naked_bcs : user specified number of naked barcodes
+            export : LongFormatExport collecting the tables (optional input)
+            key : table_key of the ranking, used by export
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            extra_tables : dictionary with, for each title, a dictionary of tables by component placed after the net
+                           enrichment tables (optional input)
+            d_intervals : dictionary with bootstrap confidence intervals of the net enrichment factors by component
+                          (optional input)
+        output:
+            blocks : list of (table, startrow, startcol) of the section
+            titles : list of (row, col, text) of the section
+            width : number of columns taken by the section, including the column after it
+    """
+    # tables are materialized from the view when the sheet is written
+    blocks = [((view, None), 0, 0)]
+    current_col = view.width + 1
+
+    # top & bottom
+    top, bottom = view.top_and_bottom(x_percent, number_naked_bcs)
+    blocks.append(((view, top), 0, current_col))
+    blocks.append(((view, bottom), len(top) + 2, current_col))
+    current_col += view.width + 1
+
+    d_df_components_top, d_df_components_bottom = top_bottom_enrichment(None, dict_components,
+                                                                        view.rows(top, dict_components),
+                                                                        view.rows(bottom, dict_components))
+
+    d_df_component_net_enrichment, d_df_enrichment_factors_top, d_df_enrichment_factors_bottom = \
+        net_enrichment_factor(dict_df_component_enrichments, d_df_components_top, d_df_components_bottom,
+                              sort_by=view.sort_by, significance=significance)
+    if permutation_test is not None:
+        add_empirical_p_column(d_df_component_net_enrichment,
+                               permutation_test.empirical_p_values(view.df_formulations, dict_components, top, bottom))
+    if d_intervals is not None:
+        add_confidence_columns(d_df_component_net_enrichment, d_intervals)
+
+    list_tables = [dict_df_component_enrichments, d_df_components_top, d_df_enrichment_factors_top,
+                   d_df_components_bottom, d_df_enrichment_factors_bottom, d_df_component_net_enrichment]
+    extra_tables = extra_tables or {}
+    table_blocks, titles, width = enrichment_table_blocks(current_col, list_tables + list(extra_tables.values()),
+                                                          ENRICHMENT_TABLE_TITLES + list(extra_tables))
+
+    if export is not None:
+        export.add_ranking(key, view, top, bottom)
+        export.add_enrichment(key, list_tables, extra_tables)
+
+    return blocks + table_blocks, titles, current_col + width
+
+
+def extra_tables_by_view(views, dict_components, weighted=False, running_sum_test=None):
+    """
+    extra_tables_by_view : optional enrichment tables of rankings of the same formulations, each kind computed for all
+                           rankings together
+        inputs:
+            views : list of RankedView sharing their formulations
+            dict_components : a dictionary containing list of all the component mole ratios and types
+            weighted : boolean to add count-weighted enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
+        output:
+            list_extra_tables : list with, for each view, a dictionary with a dictionary of tables by component for
+                                each title
+    """
+    list_extra_tables = [{} for _ in views]
+    if len(views) == 0:
+        return list_extra_tables
 
+    if weighted:
+        df_values = pd.concat([view.df_values[[view.sort_by]] for view in views], axis=1)
+        d_weighted = weighted_enrichment(views[0].df_formulations, dict_components, df_values)
+        for extra_tables, view in zip(list_extra_tables, views):
+            extra_tables[WEIGHTED_TITLE] = d_weighted[view.sort_by]
 
-def create_all_sheet(destination_file, dict_df_organs, df_overall, df_top, df_bottom, dict_components):
+    if running_sum_test is not None:
+        for extra_tables, running_sum_tables in zip(list_extra_tables, running_sum_test.tables(views,
+                                                                                               dict_components)):
+            extra_tables[RUNNING_SUM_TITLE] = running_sum_tables
+
+    return list_extra_tables
+
+
+def enrichment_table_blocks(current_col, list_tables, list_titles=None):
+    """
+    enrichment_table_blocks : lays out enrichment tables side by side, one row of tables per component, with their
+                              titles in the first row
+        inputs:
+            current_col : column where the first table is placed
+            list_tables : dictionaries of tables by component, in the order of ENRICHMENT_TABLE_TITLES
+            list_titles : titles of the tables, ENRICHMENT_TABLE_TITLES if not given
+        output:
+            blocks : list of (table, startrow, startcol) of the tables
+            titles : list of (row, col, text) of the titles
+            width : number of columns taken by the tables, including the column after them
+    """
+    blocks = []
+    current_row = 1
+    width = 0
+    for component in list_tables[0]:
+        col = current_col
+        for dict_tables in list_tables:
+            blocks.append((dict_tables[component], current_row, col))
+            col += len(dict_tables[component].columns) + 1
+        width = col - current_col
+        current_row += len(list_tables[0][component]) + 2
+
+    # titles go above the tables of the first component
+    titles = []
+    col = current_col
+    component = next(iter(list_tables[0]), None)
+    for title, dict_tables in zip(list_titles or ENRICHMENT_TABLE_TITLES, list_tables):
+        titles.append((0, col, title))
+        if component is not None:
+            col += len(dict_tables[component].columns) + 1
+
+    return blocks, titles, width
+
+
+def create_all_sheet(destination_file, dict_df_organs, df_overall, df_top, df_bottom, dict_components, export=None,
+                     mode="a", significance=False, permutation_test=None, weighted=False, running_sum_test=None):
     """
     create_all_sheet: creates an excel sheet named All saved at the destination_file with dataframes of organs with
                         averaged cell
@@ -407,6 +1037,12 @@ def create_all_sheet(destination_file, dict_df_organs, df_overall, df_top, df_bo
             df_top : dataframe top performing LNPs
             df_bottom : dataframe bottom performing LNPs
             dict_components : a dictionary containing list of all the component mole ratios and types
+            export : LongFormatExport collecting the tables (optional input)
+            mode : "a" to add the sheet to the excel spreadsheet, "w" to replace it
+            significance : boolean to add p-values and q-values to the enrichment factor tables
+            permutation_test : PermutationTest adding empirical p-values to the net enrichment tables (optional input)
+            weighted : boolean to add count-weighted enrichment tables next to the net enrichment tables
+            running_sum_test : RunningSumTest adding running-sum enrichment tables (optional input)
     """
     # top & bottom
     d_df_components_top, d_df_components_bottom = top_bottom_enrichment(df_overall, dict_components, df_top, df_bottom)
@@ -416,60 +1052,115 @@ def create_all_sheet(destination_file, dict_df_organs, df_overall, df_top, df_bo
 
     d_df_component_net_enrichment, d_df_enrichment_factors_top, d_df_enrichment_factors_bottom = \
         net_enrichment_factor(dict_df_component_enrichments, d_df_components_top, d_df_components_bottom,
-                              sort_by="Overall-AVG")
+                              sort_by="Overall-AVG", significance=significance)
+
+    # same ranking as df_top and df_bottom, which are taken from df_overall sorted by overall average
+    view = RankedView(df_overall.drop("Overall-AVG", axis=1), df_overall[["Overall-AVG"]], "Overall-AVG")
+    top, bottom = view.order[:len(df_top)], view.order[len(view.order) - len(df_bottom):]
+    if permutation_test is not None:
+        add_empirical_p_column(d_df_component_net_enrichment,
+                               permutation_test.empirical_p_values(view.df_formulations, dict_components, top, bottom))
+
+    blocks = []
+    current_col = 0  # variable to place formulation enrichments by mole ratio
+
+    for component in dict_df_organs:
+        blocks.append((dict_df_organs[component], 0, current_col))
+        current_col += len(dict_df_organs[component].columns) + 1
+
+    blocks.append((df_overall, 0, current_col))
+    current_col += len(df_overall.columns) + 1
+
+    blocks.append((df_top, 0, current_col))
+    blocks.append((df_bottom, len(df_top) + 2, current_col))
+    current_col += len(df_top.columns) + 1
+
+    list_tables = [dict_df_component_enrichments, d_df_components_top, d_df_enrichment_factors_top,
+                   d_df_components_bottom, d_df_enrichment_factors_bottom, d_df_component_net_enrichment]
+    extra_tables = extra_tables_by_view([view], dict_components, weighted, running_sum_test)[0]
+    table_blocks, titles, width = enrichment_table_blocks(current_col, list_tables + list(extra_tables.values()),
+                                                          ENRICHMENT_TABLE_TITLES + list(extra_tables))
 
-    with pd.ExcelWriter(destination_file, engine="openpyxl", mode="a") \
-            as writer:  # pylint: disable=abstract-class-instantiated
+    # the All sheet is a single section, it is never split
+    layout = SheetLayout("All")
+    layout.add_section(blocks + table_blocks, titles, current_col + width)
+    write_sheet_layouts(destination_file, [layout], EXCEL_MAX_COLUMNS, mode)
 
-        current_col = 0  # variable to place formulation enrichments by mole ratio
-        my_sheet_name = "All"
+    if export is not None:
+        key = table_key("overall")
+        export.add_ranking(key, view, top, bottom)
+        export.add_enrichment(key, list_tables, extra_tables)
 
-        for component in dict_df_organs:
-            dict_df_organs[component].to_excel(writer, sheet_name=my_sheet_name, startrow=0, startcol=current_col,
-                                               index=False)
 
-            current_col += len(dict_df_organs[component].columns) + 1
+class RankedView:
+    """
+    RankedView : ranking of the formulations by one column of normalized counts. The formulation table is shared by
+    every view and only the permutation that sorts it is kept, rows are materialized when a table is written
+        inputs:
+            df_formulations : dataframe with formulations sheet
+            df_values : dataframe with the normalized counts placed next to the formulations
+            sort_by : name of the column of df_values to sort by, in descending order
+    """
 
-        df_overall.to_excel(writer, sheet_name=my_sheet_name, startrow=0, startcol=current_col, index=False)
+    def __init__(self, df_formulations, df_values, sort_by):
+        if not df_values.index.equals(df_formulations.index):
+            # same alignment as concatenating both dataframes side by side
+            index = df_formulations.index.union(df_values.index)
+            df_formulations = df_formulations.reindex(index)
+            df_values = df_values.reindex(index)
 
-        current_col += len(df_overall.columns) + 1
+        self.df_formulations = df_formulations
+        self.df_values = df_values
+        self.sort_by = sort_by
+        self.width = len(df_formulations.columns) + len(df_values.columns)
 
-        df_top.to_excel(writer, sheet_name=my_sheet_name, startrow=0, startcol=current_col, index=False)
+        labels = df_values[[sort_by]].sort_values(by=sort_by, ascending=False).index
+        self.order = df_values.index.get_indexer(labels)
 
-        current_row = len(df_top) + 2
+    def top_and_bottom(self, x_percent, number_naked_bcs):
+        """
+        top_and_bottom : positions of the best and worst performing LNPs, same selection as top_and_bottom_percent
+            inputs:
+                x_percent : user specified integer to find top and bottom performing LNPs (0-100)
+                number_naked_bcs : user specified number of naked barcodes
+            output:
+                top : positions of top performing LNPs
+                bottom : positions of bottom performing LNPs
+        """
+        total_lnp = len(self.order) - number_naked_bcs
+        values_x_percent = math.ceil(total_lnp * (x_percent / 100))
 
-        df_bottom.to_excel(writer, sheet_name=my_sheet_name, startrow=current_row, startcol=current_col, index=False)
+        top = self.order[:values_x_percent]
+        bottom = self.order[total_lnp - values_x_percent:total_lnp + number_naked_bcs]
 
-        current_col += len(df_top.columns) + 1
-        current_row = 1
-        start_col_enrichment_tables = current_col + 1
+        return top, bottom
 
-        for component in dict_df_component_enrichments:
+    def rows(self, positions, dict_components):
+        """
+        rows : component columns of the LNPs at given positions, without building a dataframe
+            inputs:
+                positions : positions of the LNPs in the formulations sheet
+                dict_components : a dictionary containing list of all the component mole ratios and types
+            output:
+                dict_rows : dictionary with an array of values for each component
+        """
+        return {component: self.df_formulations[component].to_numpy()[positions] for component in dict_components}
 
-            dict_df_component_enrichments[component].to_excel(writer, sheet_name=my_sheet_name, startrow=current_row,
-                                                              startcol=current_col, index=False)
-            d_df_components_top[component].to_excel(writer, sheet_name=my_sheet_name, startrow=current_row,
-                                                    startcol=current_col + 4, index=False)
-            d_df_enrichment_factors_top[component].to_excel(writer, sheet_name=my_sheet_name, startrow=current_row,
-                                                            startcol=current_col + 8, index=False)
-            d_df_components_bottom[component].to_excel(writer, sheet_name=my_sheet_name, startrow=current_row,
-                                                       startcol=current_col + 11, index=False)
-            d_df_enrichment_factors_bottom[component].to_excel(writer, sheet_name=my_sheet_name, startrow=current_row,
-                                                               startcol=current_col + 15, index=False)
-            d_df_component_net_enrichment[component].to_excel(writer, sheet_name=my_sheet_name, startrow=current_row,
-                                                              startcol=current_col + 18, index=False)
+    def table(self, positions=None):
+        """
+        table : materializes formulations and normalized counts of the LNPs at given positions
+            inputs:
+                positions : positions of the LNPs in the formulations sheet, all LNPs sorted if not given
+            output:
+                df_table : dataframe with formulations and normalized counts in the order of positions
+        """
+        if positions is None:
+            positions = self.order
 
-            current_row += len(dict_df_component_enrichments[component]) + 2
+        df_table = pd.concat([self.df_formulations.take(positions).reset_index(drop=True),
+                              self.df_values.take(positions).reset_index(drop=True)], axis=1)
 
-    xfile = openpyxl.load_workbook(destination_file)
-    sheet = xfile[my_sheet_name]
-    sheet.cell(row=1, column=start_col_enrichment_tables).value = "Total"
-    sheet.cell(row=1, column=start_col_enrichment_tables + 4).value = "Top"
-    sheet.cell(row=1, column=start_col_enrichment_tables + 8).value = "Enrichment-Top"
-    sheet.cell(row=1, column=start_col_enrichment_tables + 11).value = "Bottom"
-    sheet.cell(row=1, column=start_col_enrichment_tables + 15).value = "Depletion-Bottom"
-    sheet.cell(row=1, column=start_col_enrichment_tables + 18).value = "Net Enrichment Factor"
-    xfile.save(destination_file)
+        return df_table
 
 
 def dict_list_to_dict_df(dict_list, sort_by="AVG"):
@@ -489,7 +1180,8 @@ def dict_list_to_dict_df(dict_list, sort_by="AVG"):
     return dict_df
 
 
-def net_enrichment_factor(dict_df_component_enrichments, d_df_components_top, d_df_components_bottom, sort_by="AVG"):
+def net_enrichment_factor(dict_df_component_enrichments, d_df_components_top, d_df_components_bottom, sort_by="AVG",
+                          significance=False):
     """
     net_enrichment_factor: creates dataframes for best and worst performing LNPs, counts and their formulations
         inputs:
@@ -497,6 +1189,7 @@ def net_enrichment_factor(dict_df_component_enrichments, d_df_components_top, d_
             d_df_components_top : dictionary containing dataframes with enrichment analysis of top performing LNPs
             d_df_components_bottom : dictionary containing dataframes with enrichment analysis of bottom performing LNPs
             sort_by : user specified cell type to sort by, default is "AVG"
+            significance : boolean to add p-values and q-values of every level to the tables of enrichment factors
         output:
             d_df_component_net_enrichment : dictionary with dataframes of net enrichment factors by component type or
                                              mole ratio
@@ -529,6 +1222,13 @@ def net_enrichment_factor(dict_df_component_enrichments, d_df_components_top, d_
     dict_df_raw_enrichment_top = dict_list_to_dict_df(d_raw_enrichment_factors_top, sort_by)
     dict_df_raw_enrichment_bottom = dict_list_to_dict_df(d_raw_enrichment_factors_bottom, sort_by)
 
+    if significance:
+        d_significance = enrichment_significance(dict_df_component_enrichments, d_df_components_top,
+                                                 d_df_components_bottom)
+        add_significance_columns(dict_df_raw_enrichment_top, d_significance["top"])
+        add_significance_columns(dict_df_raw_enrichment_bottom, d_significance["bottom"])
+        add_significance_columns(d_df_component_net_enrichment, d_significance["net"])
+
     return d_df_component_net_enrichment, dict_df_raw_enrichment_top, dict_df_raw_enrichment_bottom
 
 
@@ -691,7 +1391,7 @@ def calculate_enrichment(component, component_list, df):
     """
 
     component_total = [0] * len(component_list)
-    for bc_x in df[component].values:
+    for bc_x in np.asarray(df[component]):
         for index, value in enumerate(component_list):
             if bc_x == value:
                 component_total[index] += 1
@@ -894,32 +1594,34 @@ def get_list_organs(sorted_cells):
     return list_organs
 
 
-def df_cell_types(df_merged, list_samples_by_cell_type):
+def df_cell_types(df_merged, list_samples_by_cell_type, count_store=None):
     """
     df_cell_types: gets dataframe of each cell type
         inputs :
             df_merged : dataframe containing formulation information and normalized counts
             list_samples_by_cell_type : lists of samples IDs by sorted cell type
+            count_store : CountStore with the normalized counts of df_merged, read instead of df_merged (optional input)
         output :
             dict_df_avg_cell_type : dictionary with averaged dataframes of each cell type
 
     df columns titles like: LNP#   Sample1   Sample2   SampleN   Average   Stdev
     """
-    dict_df_avg_cell_type = avg_cell_type(df_merged, list_samples_by_cell_type)
+    dict_df_avg_cell_type = avg_cell_type(df_merged, list_samples_by_cell_type, count_store)
     df1 = df_merged["LNP"].to_frame()
     for key, value in dict_df_avg_cell_type.items():
         df = pd.concat([df1, value], axis=1)
-        value.loc[:, key] = df
+        value.loc[:, key] = df[key]
 
     return dict_df_avg_cell_type
 
 
-def avg_cell_type(df_merged, dict_samples_by_cell_type):
+def avg_cell_type(df_merged, dict_samples_by_cell_type, count_store=None):
     """
     avg_cell_type : calculates the average of each cell type
         inputs :
             df_merged : dataframe containing formulation information and normalized counts
             dict_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            count_store : CountStore with the normalized counts of df_merged, read instead of df_merged (optional input)
         outputs :
             dict_df_by_cell_type : dictionary containing dataframes for each sorted cell type and its average
             and standard deviation
@@ -927,7 +1629,8 @@ def avg_cell_type(df_merged, dict_samples_by_cell_type):
     dict_df_by_cell_type = {}
 
     for cell_type in dict_samples_by_cell_type:
-        dict_df_by_cell_type[cell_type] = get_df_cell_type(df_merged, dict_samples_by_cell_type[cell_type])
+        dict_df_by_cell_type[cell_type] = get_df_cell_type(df_merged, dict_samples_by_cell_type[cell_type],
+                                                           count_store)
 
     for cell_type, df_cell_type in dict_df_by_cell_type.items():
         avg = df_cell_type.mean(axis=1)
@@ -938,29 +1641,38 @@ def avg_cell_type(df_merged, dict_samples_by_cell_type):
     return dict_df_by_cell_type
 
 
-def get_df_cell_type(df_merged, list_samples):
+def get_df_cell_type(df_merged, list_samples, count_store=None):
     """
     get_df_cell_type : returns dataframe with only samples specified
         inputs :
             df_merged : dataframe containing formulation information and normalized counts
             list_samples : list of sample names
+            count_store : CountStore with the normalized counts of df_merged, the samples are read from the
+                          memory-mapped matrix without a copy when given (optional input)
         outputs :
             df_cell_type : a dataframe containing all samples from a specific cell type
     """
+    if count_store is not None:
+        return count_store.frame(list_samples)
+
     return df_merged[list_samples]
 
 
-def list_samples_to_remove(dict_samples_by_cell_type, df_merged, r2_threshold):
+def list_samples_to_remove(dict_samples_by_cell_type, df_merged, r2_threshold, count_store=None,
+                           correlation_method="pearson"):
     """
     list_samples_to_remove : creates a list of mice flagged as outlying
         inputs:
             dict_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
             df_merged : dataframe containing formulation information and normalized counts
             r2_threshold : r2 value used as threshold to flag outlying mice
+            count_store : CountStore with the normalized counts of df_merged, read instead of df_merged (optional input)
+            correlation_method : "pearson", "spearman" or "log-pearson" (default = "pearson")
         outputs:
             list_remove_sample : list of samples to remove based on r2_threshold
     """
-    dict_corr_matrices = calculate_corr_matrices(dict_samples_by_cell_type, df_merged)
+    dict_corr_matrices = calculate_corr_matrices(dict_samples_by_cell_type, df_merged, count_store,
+                                                 correlation_method)
     list_remove_sample = []
 
     for key, value in dict_corr_matrices.items():
@@ -985,19 +1697,81 @@ def list_samples_to_remove(dict_samples_by_cell_type, df_merged, r2_threshold):
     return list_remove_sample
 
 
-def calculate_corr_matrices(dict_samples_by_cell_type, df_merged):
+def list_samples_to_remove_iteratively(dict_samples_by_cell_type, df_merged, r2_threshold, count_store=None,
+                                       correlation_method="pearson"):
+    """
+    list_samples_to_remove_iteratively : creates a list of mice flagged as outlying, removed one at a time so that a
+                                         badly behaving mouse does not take good mice with it
+        inputs:
+            dict_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
+            df_merged : dataframe containing formulation information and normalized counts
+            r2_threshold : r2 value used as threshold to flag outlying mice
+            count_store : CountStore with the normalized counts of df_merged, read instead of df_merged (optional input)
+            correlation_method : "pearson", "spearman" or "log-pearson" (default = "pearson")
+        outputs:
+            list_remove_sample : list of samples to remove, in the order of removal
+            df_removal : dataframe with one row per sample removed, columns REMOVAL_COLUMNS
+            dict_corr_matrices : dictionary with correlation matrices for each cell type
+    """
+    dict_corr_matrices = calculate_corr_matrices(dict_samples_by_cell_type, df_merged, count_store,
+                                                 correlation_method)
+
+    rows = []
+    for key, value in dict_corr_matrices.items():
+        for step, removal in enumerate(iterative_removal(value, r2_threshold), start=1):
+            rows.append([key, step] + list(removal))
+
+    df_removal = pd.DataFrame(rows, columns=REMOVAL_COLUMNS)
+    return df_removal["Mouse removed"].tolist(), df_removal, dict_corr_matrices
+
+
+def outlier_removal_layout(df_removal, dict_corr_matrices):
+    """
+    outlier_removal_layout : lays out the Outlier Removal sheet, the mice removed in order and the correlation matrix
+                             of each cell type
+        inputs:
+            df_removal : dataframe with one row per sample removed
+            dict_corr_matrices : dictionary with correlation matrices for each cell type
+        output:
+            layout : sheet layout
+    """
+    layout = SheetLayout("Outlier Removal")
+    layout.add_section([(df_removal, 1, 0)], [(0, 0, "Mice removed, in order")], len(df_removal.columns) + 1)
+
+    for key, value in dict_corr_matrices.items():
+        df_corr = value.reset_index().rename(columns={"index": key})
+        layout.add_section([(df_corr, 1, 0)], [(0, 0, "r values, " + key)], len(df_corr.columns) + 1)
+
+    return layout
+
+
+def calculate_corr_matrices(dict_samples_by_cell_type, df_merged, count_store=None, correlation_method="pearson"):
     """
-    calculate_corr_matrices : gets correlation matrices between mice by cell type
+    calculate_corr_matrices : gets correlation matrices between mice by cell type, the samples of one cell type are
+                              read and correlated at a time
         inputs:
             dict_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
             df_merged : dataframe containing formulation information and normalized counts
+            count_store : CountStore with the normalized counts of df_merged, read instead of df_merged (optional input)
+            correlation_method : "pearson", "spearman" or "log-pearson" (default = "pearson")
         outputs:
             dict_corr_matrices: dictionary with correlation matrices for each cell type
     """
+    # the log of log-pearson adds the same pseudocount to every sample, a store is scanned for it a chunk at a time
+    pseudocount = None
+    if correlation_method == "log-pearson":
+        samples = [sample for list_samples in dict_samples_by_cell_type.values() for sample in list_samples]
+        if count_store is not None:
+            smallest = count_store.select(samples).smallest_positive()
+        else:
+            smallest = smallest_positive_count(df_merged[samples].to_numpy(dtype=float))
+        pseudocount = log_pseudocount(smallest)
+
     dict_corr_matrices = {}
-    for key, value in dict_samples_by_cell_type.items():
-        df = get_df_cell_type(df_merged, value)
-        dict_corr_matrices[key] = df.corr(method="pearson")
+    for cell_type, samples in dict_samples_by_cell_type.items():
+        block = get_df_cell_type(df_merged, samples, count_store).to_numpy(dtype=float)
+        dict_corr_matrices.update(correlation_matrices(block, samples, {cell_type: samples}, correlation_method,
+                                                       pseudocount))
 
     return dict_corr_matrices
 
@@ -1047,6 +1821,31 @@ def pull_out_runaways(df_norm_counts, percentile):
     return df_norm_counts, list_runaways
 
 
+def pull_out_runaways_from_store(count_store, percentile):
+    """
+    pull_out_runaways_from_store : removes runaways from a memory-mapped matrix of normalized counts, same as
+    pull_out_runaways, scanning the matrix a chunk of columns at a time
+        inputs:
+            count_store : CountStore with normalized counts
+            percentile : percentile used to remove outliers (default = 99.9%)
+        outputs:
+            count_store : CountStore with normalized counts of the LNPs kept, renormalized
+            list_runaways : list of runaway LNPs, listed as DNA barcodes
+    """
+    n_at_percentile = count_store.percentile(percentile)
+    is_runaway = count_store.count_at_least(n_at_percentile) > 0.5 * len(count_store.columns)
+    list_runaways = [barcode for barcode, runaway in zip(count_store.barcodes, is_runaway) if runaway]
+
+    if len(list_runaways) != 0:
+        print("Removed these runaways:", list_runaways)
+        count_store = count_store.reorder("norm_counts_no_runaways", np.flatnonzero(~is_runaway), count_store.columns,
+                                          renormalize=True)
+    else:
+        print("No runaways found.")
+
+    return count_store, list_runaways
+
+
 def renormalize_counts(df_norm_counts):
     """
      renormalize_counts : renormalize counts after runaway removal
@@ -1131,21 +1930,26 @@ def get_n_percentile(df_norm_counts, percentile):
     return n_at_percentile
 
 
-def divide_samples_by_cell_type(df_merged, sorted_cells):
+def divide_samples_by_cell_type(df_merged, sorted_cells, count_store=None):
     """
     divide_samples_by_cell_type : creates a dictionary containing cell types as keys and a list of sample IDs as the
                                     value
         inputs :
             df_merged : dataframe containing formulation information and normalized counts
             sorted_cells : user specified list of the sorted cell types
+            count_store : CountStore with the normalized counts of df_merged, its columns are the samples (optional
+                          input)
         output :
             dict_samples_by_cell_type : dictionary containing lists of samples IDs by sorted cell type
     """
     # will be a dict containing list of samples organized by cell types
     dict_samples_by_cell_type = {}
 
-    columns_df_merged = df_merged.columns.tolist()
-    columns_df_merged = columns_df_merged[11:]  # merged must include column for charge
+    if count_store is not None:
+        columns_df_merged = count_store.columns
+    else:
+        columns_df_merged = df_merged.columns.tolist()
+        columns_df_merged = columns_df_merged[11:]  # merged must include column for charge
 
     for cell_type in sorted_cells:
         samples_by_cell_type = [sample for sample in columns_df_merged if cell_type in sample]
@@ -1161,7 +1965,7 @@ def merge_formulations_and_norm_counts(df_one, df_two, destination_file, s_name)
         inputs :
             df_one : first dataframe containing formulations
             df_two : second dataframe containing norm counts
-            destination_file : directory of the excel spreadsheet created
+            destination_file : directory of the excel spreadsheet created, the sheet is not written if None
             s_name = name of sheet
         output :
             df_merged : dataframe containing formulation information and normalized counts
@@ -1179,12 +1983,53 @@ def merge_formulations_and_norm_counts(df_one, df_two, destination_file, s_name)
     df_merged = df_merged[order_columns]
 
     # append merged data frames onto spreadsheet on sheet
+    if destination_file is None:
+        return df_merged
+
     with pd.ExcelWriter(destination_file, engine="openpyxl", mode="w") as writer:
         df_merged.to_excel(writer, sheet_name=s_name, index=False)
 
     return df_merged
 
 
+def merge_formulations_and_count_store(df_formulations, count_store, destination_file, s_name):
+    """
+    merge_formulations_and_count_store : same merge as merge_formulations_and_norm_counts with the normalized counts of
+    a memory-mapped matrix. The rows of the formulations are copied into a new matrix on disk, the merged dataframe
+    only holds the formulation columns and its row positions are the rows of the new matrix, the normalized counts are
+    read from the matrix where they are used
+        inputs :
+            df_formulations : dataframe containing formulations
+            count_store : CountStore with normalized counts
+            destination_file : directory of the excel spreadsheet created, the sheet is not written if None
+            s_name = name of sheet
+        output :
+            df_merged : dataframe containing formulation information of the merged barcodes
+            merged_store : CountStore with the normalized counts of df_merged, one row per row of df_merged
+    """
+    d_rows = {}
+    for row, barcode in enumerate(count_store.barcodes):
+        d_rows.setdefault(barcode, row)
+
+    # inner merge around barcodes ("BC"), in the order of the formulations
+    list_keep = [index for index, barcode in enumerate(df_formulations["BC"]) if barcode in d_rows]
+    rows = [d_rows[barcode] for barcode in df_formulations["BC"].iloc[list_keep]]
+
+    merged_store = count_store.reorder("merged", rows, count_store.columns)
+    df_merged = df_formulations.iloc[list_keep].reset_index(drop=True)
+
+    if destination_file is not None:
+        # the sample columns are written next to the formulations a chunk at a time
+        with pd.ExcelWriter(destination_file, engine="openpyxl", mode="w") as writer:
+            df_merged.to_excel(writer, sheet_name=s_name, index=False)
+            columns = merged_store.columns
+            for start in range(0, len(columns), CHUNK_COLUMNS):
+                merged_store.frame(columns[start:start + CHUNK_COLUMNS]).to_excel(
+                    writer, sheet_name=s_name, startcol=len(df_merged.columns) + start, index=False)
+
+    return df_merged, merged_store
+
+
 def organize_cell_type(df_norm_counts):
     """
     organize_cell_type : takes in a dataframe and organizes the samples alphabetically
@@ -1216,26 +2061,29 @@ def get_columns(dataframe):
     return sample_columns
 
 
-def create_df_norm_counts(csv_filepath, sample_numbers):
+def create_df_norm_counts(csv_filepath, sample_numbers, pool_method="sum", workers=None):
     """
     create_df_norm_counts : gets csv file path with normalized counts, creates a dataframe
         inputs :
-            csv_filepath : file path to csv file
+            csv_filepath : file path to csv file, or list of file paths to csv files pooled into one dataframe
             sample_numbers : numbers with sample values for an experiment
+            pool_method : "sum" or "mean" of the counts of a sample found in several csv files (default = "sum")
+            workers : number of threads reading csv files, one per file up to 8 if not given
         output :
             df_norm_counts : dataframe with normalized counts
     """
+    if not isinstance(csv_filepath, str):
+        if len(csv_filepath) != 1:
+            return pool_counts(list(csv_filepath), lambda columns: get_sample_columns(columns, sample_numbers),
+                               pool_method, workers)
+        csv_filepath = csv_filepath[0]
+
     # Read CSV file and save as dataframe
     df_norm_counts = pd.read_csv(csv_filepath, sep=',', header=0)
 
     columns = df_norm_counts.columns.tolist()  # get names of columns
 
-    new_columns = [columns[0]]
-    for i in range(1, len(columns)):
-        for sample_num in sample_numbers:
-            if sample_num in columns[i]:
-                new_columns.append(columns[i])
-                break
+    new_columns = [columns[0]] + get_sample_columns(columns, sample_numbers)
 
     df_norm_counts = df_norm_counts[new_columns]
 
@@ -1245,16 +2093,120 @@ def create_df_norm_counts(csv_filepath, sample_numbers):
     return df_norm_counts
 
 
+def get_sample_columns(columns, sample_numbers):
+    """
+    get_sample_columns : names of the columns of the csv file that hold samples of an experiment
+        inputs :
+            columns : names of the columns of the csv file, the first one holds the barcodes
+            sample_numbers : numbers with sample values for an experiment
+        output :
+            sample_columns : list of the names of the sample columns
+    """
+    sample_columns = []
+    for i in range(1, len(columns)):
+        for sample_num in sample_numbers:
+            if sample_num in columns[i]:
+                sample_columns.append(columns[i])
+                break
+
+    return sample_columns
+
+
+def create_count_store(csv_filepath, sample_numbers, memory_map_folder, pool_method="sum", workers=None):
+    """
+    create_count_store : gets csv file path with normalized counts, writes them into a memory-mapped matrix with its
+                         sample columns organized alphabetically
+        inputs :
+            csv_filepath : file path to csv file, or list of file paths to csv files pooled into one matrix
+            sample_numbers : numbers with sample values for an experiment
+            memory_map_folder : folder where the memory-mapped matrices are saved
+            pool_method : "sum" or "mean" of the counts of a sample found in several csv files (default = "sum")
+            workers : number of threads reading csv files, one per file up to 8 if not given
+        output :
+            count_store : CountStore with normalized counts, rows in the order of the csv file
+    """
+    if not isinstance(csv_filepath, str):
+        if len(csv_filepath) != 1:
+            df_norm_counts = create_df_norm_counts(csv_filepath, sample_numbers, pool_method, workers)
+            return CountStore.from_frame(memory_map_folder, "norm_counts", df_norm_counts,
+                                         sorted(get_columns(df_norm_counts)))
+        csv_filepath = csv_filepath[0]
+
+    columns = pd.read_csv(csv_filepath, sep=',', header=0, nrows=0).columns.tolist()
+    sample_columns = get_sample_columns(columns, sample_numbers)
+    sample_columns.sort()
+
+    return CountStore.from_csv(memory_map_folder, "norm_counts", csv_filepath, sample_columns)
+
+
+def load_inputs(formulations_sheet, csv_filepath, sample_numbers, memory_map_folder=None, pool_method="sum",
+                workers=None):
+    """
+    load_inputs : reads the formulation sheet and the normalized counts on two threads at the same time and prints how
+                  long each one took
+        inputs :
+            formulations_sheet : file path to excel sheet of formulation sheet
+            csv_filepath : file path to csv file, or list of file paths to csv files pooled into one matrix
+            sample_numbers : numbers with sample values for an experiment
+            memory_map_folder : folder where the normalized counts are saved as memory-mapped matrices (optional input)
+            pool_method : "sum" or "mean" of the counts of a sample found in several csv files (default = "sum")
+            workers : number of threads reading csv files, one per file up to 8 if not given
+        output :
+            df_formulations : dataframe with formulations sheet
+            df_norm_counts : dataframe with normalized counts, None with a memory_map_folder
+            count_store : CountStore with normalized counts, None without a memory_map_folder
+    """
+    def timed(function, *args):
+        start = time.perf_counter()
+        return function(*args), time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        formulations_future = executor.submit(timed, create_df_formulation_sheet, formulations_sheet)
+        if memory_map_folder is None:
+            counts_future = executor.submit(timed, create_df_norm_counts, csv_filepath, sample_numbers, pool_method,
+                                            workers)
+        else:
+            counts_future = executor.submit(timed, create_count_store, csv_filepath, sample_numbers,
+                                            memory_map_folder, pool_method, workers)
+        df_formulations, formulations_seconds = formulations_future.result()
+        counts, counts_seconds = counts_future.result()
+
+    print("Loaded formulations in %.2f s and normalized counts in %.2f s" % (formulations_seconds, counts_seconds))
+    if memory_map_folder is None:
+        return df_formulations, counts, None
+    return df_formulations, None, counts
+
+
 def create_df_formulation_sheet(formulations_sheet):
     """
-    create_df_formulation_sheet : gets formulation sheet, creates a dataframe for formulations
+    create_df_formulation_sheet : gets formulation sheet, creates a dataframe for formulations. The workbook is opened
+    read-only, so only the Formulations sheet is parsed, row by row, whatever the other sheets hold
         inputs :
             formulations_sheet : file path to excel sheet of formulation sheet
         output :
             df_formulations : dataframe with formulations sheet
     """
-    # Turn formulation sheet into dataframe
-    df_formulations = pd.read_excel(formulations_sheet, sheet_name="Formulations", header=0)
+    workbook = load_workbook(formulations_sheet, read_only=True, data_only=True, keep_links=False)
+    try:
+        if "Formulations" not in workbook.sheetnames:
+            raise ValueError("Worksheet named 'Formulations' not found in " + str(formulations_sheet))
+        sheet = workbook["Formulations"]
+        sheet.reset_dimensions()  # some writers save wrong dimensions, rows are read until the last one
+
+        # whole numbers stored as floats are read as integers, like read_excel
+        rows = [["" if value is None else int(value) if isinstance(value, float) and value.is_integer() else value
+                 for value in row] for row in sheet.iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+    # trim empty rows at the end and pad short rows
+    while len(rows) != 0 and all(value == "" for value in rows[-1]):
+        rows.pop()
+    width = max((len(row) for row in rows), default=0)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+
+    # Turn formulation sheet into dataframe, with the type inference of read_excel
+    df_formulations = TextParser(rows, header=0).read()
 
     columns = df_formulations.columns.tolist()
     df_formulations.rename(columns={columns[0]: "LNP", columns[1]: "BC"}, inplace=True)
@@ -1284,3 +2236,83 @@ def create_excel_spreadsheet(destination_folder, file_id):
     w_b.save(destination_file)
 
     return destination_file
+
+
+def parse_arguments(argv=None):
+    """
+    parse_arguments : parses the command line arguments of an enrichment analysis
+        inputs:
+            argv : list of command line arguments, sys.argv if not given
+        output:
+            args : namespace with one attribute per argument of run_enrichment_analysis
+    """
+    parser = argparse.ArgumentParser(description="Whole enrichment analysis, by sample, cell type and organ")
+    parser.add_argument("--destination-folder", required=True, help="folder where the excel file is saved")
+    parser.add_argument("--file-id", default="", help="file identifier added at the end of the file name")
+    parser.add_argument("--formulations-sheet", required=True, help="excel file with a Formulations sheet")
+    parser.add_argument("--csv-filepath", required=True, nargs="+",
+                        help="csv file with normalized counts, or several csv files pooled on their barcodes")
+    parser.add_argument("--pool-method", choices=POOL_METHODS, default="sum",
+                        help="sum or mean of a sample found in several csv files")
+    parser.add_argument("--sorted-cells", required=True, help="sorted cell types, separated by commas")
+    parser.add_argument("--number-naked-bcs", required=True, type=int, help="number of naked barcodes")
+    parser.add_argument("--x-percent", required=True, type=float, help="top/bottom percent (0-100)")
+    parser.add_argument("--sample-numbers", required=True, help="sample numbers, separated by commas")
+    parser.add_argument("--remove-outlying-mouse", action="store_true", help="remove outlying mice")
+    parser.add_argument("--r2-threshold", type=float, default=0.80, help="r2 threshold to flag outlying mice")
+    parser.add_argument("--remove-runaways", action="store_true", help="remove runaway LNPs")
+    parser.add_argument("--percentile", type=float, default=99.9, help="percentile to flag runaways")
+    parser.add_argument("--outputs", default="full",
+                        help="one of " + ", ".join(OUTPUT_PRESETS) + " or outputs separated by commas: " +
+                             ", ".join(OUTPUTS))
+    parser.add_argument("--export-format", choices=EXPORT_FORMATS, help="also export tables in long format")
+    parser.add_argument("--shard-by", choices=SHARD_BY, help="write one workbook per organ or cell type")
+    parser.add_argument("--max-sheet-columns", type=int, default=EXCEL_MAX_COLUMNS, help="column budget of a sheet")
+    parser.add_argument("--workers", type=int, help="number of processes writing workbooks and running permutations")
+    parser.add_argument("--memory-map-folder", help="folder where normalized counts are memory-mapped")
+    parser.add_argument("--chunked", action="store_true",
+                        help="read and write the samples of one organ at a time, one workbook per organ")
+    parser.add_argument("--significance", action="store_true", help="add p-values and q-values to enrichment factors")
+    parser.add_argument("--permutations", type=int, default=0, help="random rankings for empirical p-values")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random rankings")
+    parser.add_argument("--interactions", dest="interaction_order", type=int, choices=INTERACTION_ORDERS,
+                        help="add enrichment of pairs (2) or triples (3) of components")
+    parser.add_argument("--weighted", action="store_true", help="add count-weighted enrichment tables")
+    parser.add_argument("--running-sum", action="store_true", help="add running-sum enrichment tables")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="resamples of mice for confidence intervals of net enrichment factors")
+    parser.add_argument("--correlation-method", choices=CORRELATION_METHODS, default="pearson",
+                        help="correlation between mice used to flag outlying mice")
+    parser.add_argument("--iterative-outlier-removal", action="store_true",
+                        help="remove outlying mice one at a time and report the order")
+    parser.add_argument("--results-database", help="SQLite database where the enrichment tables are added")
+    parser.add_argument("--raw-counts-csv", help="csv file with raw counts, adds a rarefaction stability report")
+    parser.add_argument("--rarefaction-depths", help="comma separated reads drawn from each sample")
+    parser.add_argument("--rarefaction-draws", type=int, default=100, help="subsamples at each depth")
+    parser.add_argument("--leave-one-out", dest="leave_one_out_mice", action="store_true",
+                        help="add influence of each mouse on its cell type")
+
+    args = parser.parse_args(argv)
+    args.sorted_cells = [cell_type.strip() for cell_type in args.sorted_cells.split(",")]
+    args.sample_numbers = [sample_num.strip() for sample_num in args.sample_numbers.split(",")]
+    if args.rarefaction_depths is not None:
+        args.rarefaction_depths = [int(depth) for depth in args.rarefaction_depths.split(",")]
+    if args.outputs not in OUTPUT_PRESETS:
+        args.outputs = [output.strip() for output in args.outputs.split(",")]
+
+    return args
+
+
+def main(argv=None):
+    """
+    main : runs an enrichment analysis from the command line
+        inputs:
+            argv : list of command line arguments, sys.argv if not given
+    """
+    args = parse_arguments(argv)
+    run_enrichment_analysis(**vars(args))
+    print("Enrichment analysis performed!")
+
+
+if __name__ == "__main__":
+    main()